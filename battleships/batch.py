@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Batch battleships solver
+
+Solves many puzzles in parallel over a pool of processes, and writes machine-readable
+results as JSON, one line per puzzle, in the order the puzzles were given. Nothing is
+drawn on the terminal while solving.
+
+Puzzles can be given as
+--- a directory of puzzle files, in the format that battleships.py reads, or
+--- a JSONL file (- for standard input) with one puzzle per line, as an object
+    {"name": "example", "rowclues": [2, 1, null, ...], "colclues": [...],
+     "ships": [4, 3, 2, 1], "hints": [[5, 0, "o"], [1, 2, "<"], ...]}
+    where unknown clues are null, and name and hints are optional
+
+Each result is an object with the keys
+--- name: the name of the puzzle (the file name, or from the JSON)
+--- solutions: the number of solutions found
+--- complete: false if the search stopped at --max-solutions before finishing
+--- grids: the first few solutions (--grids), each a list of rows using # for ship,
+    ~ for water and ? for unknown
+--- common: the cells that all of the solutions have in common (as for grids)
+--- guesses: the number of guesses made
+--- scheduler: the order guesses were explored in (see battleshiplib.SCHEDULERS)
+--- stats: search statistics from battleshiplib.BranchStats
+--- time: the time taken to solve the puzzle, in seconds
+--- error: why the puzzle couldn't be read or solved (only present if it couldn't)
+
+To find a solution to hard puzzles, --max-solutions 1 with --scheduler restarts (or lds)
+is often far quicker than the default depth first search.
+
+Run as:
+python batch.py puzzles [--output FILE] [--max-solutions N] [--grids N]
+                        [--backend grid|bitgrid] [--scheduler dfs|lds|best|restarts]
+                        [--processes N]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from multiprocessing import Pool
+from battleshiplib import (Inconsistent, BranchStats, Consensus, Grid, BitGrid, run, load_puzzle,
+                           SCHEDULERS, SHIP, WATER, UNKNOWN)
+
+BACKENDS = {"grid": Grid, "bitgrid": BitGrid}
+
+# Characters used for each cell value in the grids of the results
+SYMBOLS = {UNKNOWN: "?", SHIP: "#", WATER: "~"}
+
+def encode_grid(grid):
+    """Returns a state as a list of rows of text (see SYMBOLS)"""
+    return ["".join(SYMBOLS[cell] for cell in row) for row in grid.to_array().T.tolist()]
+
+class SolutionSample(Consensus):
+    """A Consensus that also keeps the first few solutions, encoded with encode_grid"""
+
+    def __init__(self, keep):
+        """keep is the number of solutions to keep"""
+        super().__init__()
+        self.keep = keep
+        self.grids = []
+
+    def append(self, state):
+        """Add a solution"""
+        super().append(state)
+        if len(self.grids) < self.keep:
+            self.grids.append(encode_grid(state))
+
+def parse_puzzle(data):
+    """
+    Interpret a puzzle given as a dictionary (see the JSONL format above).
+    Returns (rowclues, colclues, ships, initinfo).
+    Raises ValueError if it doesn't describe a puzzle.
+    """
+    try:
+        rowclues = [None if i is None else int(i) for i in data["rowclues"]]
+        colclues = [None if i is None else int(i) for i in data["colclues"]]
+        ships = [int(i) for i in data["ships"]]
+        initinfo = [(int(x), int(y), str(value)) for x, y, value in data.get("hints", [])]
+    except KeyError as e:
+        raise ValueError("Puzzle is missing " + e.args[0])
+    except (TypeError, ValueError):
+        raise ValueError("Unable to interpret puzzle")
+    return rowclues, colclues, ships, initinfo
+
+def read_directory(path):
+    """
+    Read every puzzle file in a directory, in order of file name.
+    Yields (name, puzzle or None, error message or None).
+    """
+    for filename in sorted(os.listdir(path)):
+        fullname = os.path.join(path, filename)
+        if filename.startswith(".") or not os.path.isfile(fullname):
+            continue
+        try:
+            yield filename, load_puzzle(fullname), None
+        except (IOError, ValueError) as e:
+            yield filename, None, str(e)
+
+def read_jsonl(stream):
+    """
+    Read puzzles from a stream with one JSON object per line (blank lines are skipped).
+    Yields (name, puzzle or None, error message or None).
+    """
+    for number, line in enumerate(stream, 1):
+        if len(line.strip()) == 0:
+            continue
+        name = "line {}".format(number)
+        try:
+            data = json.loads(line)
+            if not isinstance(data, dict):
+                raise ValueError("Puzzle is not a JSON object")
+            name = str(data.get("name", name))
+            yield name, parse_puzzle(data), None
+        except ValueError as e:
+            yield name, None, str(e)
+
+def solve_puzzle(puzzle, max_solutions=None, grids=1, backend="grid", scheduler="dfs"):
+    """
+    Solve a puzzle (rowclues, colclues, ships, initinfo) without printing anything.
+    max_solutions stops the search after that many solutions (None to find them all).
+    grids is the number of solutions to include in the result.
+    backend is a key of BACKENDS.
+    scheduler is a key of battleshiplib.SCHEDULERS.
+    Returns the result as a dictionary (see above, without name).
+    """
+    rowclues, colclues, ships, initinfo = puzzle
+    stats = BranchStats()
+    solutions = SolutionSample(grids)
+    result = {}
+    start = time.time()
+    try:
+        solutions, guesses = run(rowclues, colclues, initinfo, ships, backend=BACKENDS[backend],
+                                 stats=stats, verbose=False, solutionlist=solutions,
+                                 max_solutions=max_solutions, scheduler=SCHEDULERS[scheduler]())
+    except Inconsistent as e:
+        guesses = 0
+        result["error"] = e.args[0] if len(e.args) > 0 else "Puzzle is inconsistent"
+    elapsed = time.time() - start
+
+    common = solutions.common()
+    result.update({"solutions": len(solutions),
+                   "complete": max_solutions is None or len(solutions) < max_solutions,
+                   "grids": solutions.grids,
+                   "common": None if common is None else encode_grid(common),
+                   "guesses": guesses,
+                   "scheduler": scheduler,
+                   "stats": stats.as_dict(),
+                   "time": round(elapsed, 6)})
+    return result
+
+def _solve(args):
+    """Helper for solve_batch: solves a puzzle in a worker process"""
+    name, puzzle, error, options = args
+    if error is not None:
+        return {"name": name, "error": error}
+    result = {"name": name}
+    result.update(solve_puzzle(puzzle, **options))
+    return result
+
+def solve_batch(puzzles, processes=None, **options):
+    """
+    Solve many puzzles in parallel over a pool of processes (defaults to all cores).
+    puzzles is an iterable of (name, puzzle or None, error message or None), as produced
+    by read_directory and read_jsonl. options are passed to solve_puzzle.
+    Yields result dictionaries in the original order.
+    """
+    jobs = ((name, puzzle, error, options) for name, puzzle, error in puzzles)
+    with Pool(processes) as pool:
+        yield from pool.imap(_solve, jobs, chunksize=4)
+
+def main():
+    parser = argparse.ArgumentParser(description="Solve many battleships puzzles, writing JSON results")
+    parser.add_argument("puzzles", help="directory of puzzle files, or JSONL file of puzzles (- for stdin)")
+    parser.add_argument("--output", default=None, help="file to write results to (defaults to stdout)")
+    parser.add_argument("--max-solutions", type=int, default=None,
+                        help="stop searching each puzzle after this many solutions")
+    parser.add_argument("--grids", type=int, default=1,
+                        help="number of solution grids to include in each result (default 1)")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default="grid",
+                        help="class used to store the state of the board")
+    parser.add_argument("--scheduler", choices=sorted(SCHEDULERS), default="dfs",
+                        help="order to explore guesses in (default dfs)")
+    parser.add_argument("--processes", type=int, default=None,
+                        help="number of processes to use (defaults to all cores)")
+    args = parser.parse_args()
+
+    try:
+        if args.puzzles == "-":
+            source = sys.stdin
+            puzzles = read_jsonl(source)
+        elif os.path.isdir(args.puzzles):
+            source = None
+            puzzles = read_directory(args.puzzles)
+        else:
+            source = open(args.puzzles)
+            puzzles = read_jsonl(source)
+        output = sys.stdout if args.output is None else open(args.output, "w")
+    except IOError as e:
+        print("Unable to open file:", e, file=sys.stderr)
+        sys.exit(1)
+
+    start = time.time()
+    count = 0
+    failed = 0
+    for result in solve_batch(puzzles, args.processes, max_solutions=args.max_solutions,
+                              grids=args.grids, backend=args.backend, scheduler=args.scheduler):
+        output.write(json.dumps(result) + "\n")
+        count += 1
+        failed += "error" in result
+    elapsed = time.time() - start
+
+    if output is not sys.stdout:
+        output.close()
+    if source is not None and source is not sys.stdin:
+        source.close()
+    print("Solved {} puzzles ({} failed) in {:.2f}s".format(count, failed, elapsed), file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -5,9 +5,15 @@ Battleships/Bimaru solver logic library
 
 Jolyon Bloomfield, Jan 2018
 """
+import sys
+import time
+import random
+from collections import OrderedDict
 import numpy as np
 from colorama import init, Fore, Style
-from framework import PuzzleState, PuzzleSolver, Inconsistent, Solved
+from framework import (PuzzleState, PuzzleSolver, Inconsistent, Solved, NogoodStore,
+                       DepthFirst, LimitedDiscrepancy, BestFirst, RandomRestarts)
+from topology import square_topology
 init()
 
 if __name__ == "__main__":
@@ -18,9 +24,36 @@ UNKNOWN = 0
 SHIP = 1
 WATER = 2
 
+# Number of bits in the Zobrist keys used to hash states, and the seed used to make them
+HASH_BITS = 64
+HASH_SEED = 2018
+
+def popcount(x):
+    """Count the number of set bits in an integer"""
+    return bin(x).count("1")
+
+def all_lines(info):
+    """
+    Returns the keys of all lines on the board: (False, x) for column x and
+    (True, y) for row y, columns first
+    """
+    return [(False, x) for x in range(info.width)] + [(True, y) for y in range(info.height)]
+
+def zobrist_keys(width, height):
+    """
+    Make the Zobrist keys for a board: keys[value][x][y] is a random HASH_BITS-bit integer
+    for cell (x, y) being set to value. UNKNOWN cells have key 0.
+    The keys only depend on the board size, so hashes can be compared between runs.
+    """
+    rng = random.Random(HASH_SEED)
+    keys = [[[0] * height for _ in range(width)]]
+    for _ in (SHIP, WATER):
+        keys.append([[rng.getrandbits(HASH_BITS) for _ in range(height)] for _ in range(width)])
+    return keys
+
 class PuzzleInfo(object):
     """Stores information about the puzzle, including grid size and clues"""
-    def __init__(self, rowclues, colclues, ships):
+    def __init__(self, rowclues, colclues, ships, verify_hashes=False):
         """
         rowclues and colclues are the clues for each row and column
           The grid size is extracted from the clues
@@ -30,15 +63,186 @@ class PuzzleInfo(object):
           ships[0] = # of length 1 ships
           ships[1] = # of length 2 ships
           etc.
+        verify_hashes makes states include their contents in their hashes (see Grid.make_hash)
         """
-        self.width = len(colclues)
-        self.height = len(rowclues)
+        self.width = width = len(colclues)
+        self.height = height = len(rowclues)
         self.rowclues = rowclues
         self.colclues = colclues
         self.ships = ships
+        # Clue vectors for whole-grid checks. Unknown clues are masked out.
+        self.rowknown = np.array([i is not None for i in rowclues], dtype=bool)
+        self.colknown = np.array([i is not None for i in colclues], dtype=bool)
+        self.rowvalues = np.array([0 if i is None else i for i in rowclues], dtype=np.int64)
+        self.colvalues = np.array([0 if i is None else i for i in colclues], dtype=np.int64)
+        # Clues indexed by line key (see all_lines)
+        self.clues = {}
+        for x, clue in enumerate(colclues):
+            self.clues[False, x] = clue
+        for y, clue in enumerate(rowclues):
+            self.clues[True, y] = clue
+        # The most ships of each length that could lie along any one line (see LineAnalysis.complete)
+        lines = [(height, clue) for clue in colclues] + [(width, clue) for clue in rowclues]
+        self.maxruns = [max(min((size + 1) // (length + 1), size if clue is None else clue // length)
+                            for size, clue in lines)
+                        for length in range(1, len(ships) + 1)]
+        # Tables of neighbouring cells (see topology.py)
+        self.topology = square_topology(width, height)
+        # Zobrist keys for hashing states
+        self.zobrist = zobrist_keys(self.width, self.height)
+        self.verify_hashes = verify_hashes
+
+class ShipInventory(object):
+    """
+    Keeps track of the ships on a grid incrementally, as cells are set.
+
+    Ship segments are labelled using union-find. For each segment we store its length,
+    the number of unknown cells next to it (its open ends), its top left corner and its
+    direction. Segments without open ends are complete ("good") ships, while the rest
+    are incomplete ("bad"). Counts of good and bad ships of each length are updated as
+    each cell changes, so they can be read without scanning the grid. A ship that is
+    complete can no longer change, so complete ships are also kept in the order that
+    they were completed, along with how many of each length lie along each line.
+
+    Cells are assumed to only ever change from UNKNOWN to SHIP or WATER.
+    """
+
+    def __init__(self):
+        """Start with an empty inventory"""
+        # Union-find parent of each ship cell
+        self.parent = {}
+        # For each segment, indexed by its root cell: (length, open ends, top left, horizontal)
+        self.segments = {}
+        # good[i] and bad[i] count the good/bad ships of length i + 1
+        self.good = []
+        self.bad = []
+        # Complete ships as (pos, length, horiz), in the order they were completed
+        self.complete = []
+        # Number of complete ships of each length (2 or more) along each line, indexed
+        # by (line key, length) (see all_lines)
+        self.along = {}
+
+    def copy(self):
+        """Returns a copy of this inventory"""
+        new = ShipInventory()
+        new.parent = self.parent.copy()
+        new.segments = self.segments.copy()
+        new.good = self.good[:]
+        new.bad = self.bad[:]
+        new.complete = self.complete[:]
+        new.along = self.along.copy()
+        return new
+
+    def find(self, cell):
+        """Find the root cell of the segment containing the given ship cell"""
+        parent = self.parent
+        while parent[cell] != cell:
+            parent[cell] = parent[parent[cell]]
+            cell = parent[cell]
+        return cell
+
+    def tally(self, root, delta):
+        """Add delta to the good/bad count for the segment with the given root"""
+        length, openends, pos, horiz = self.segments[root]
+        counts = self.good if openends == 0 else self.bad
+        while len(counts) < length:
+            self.good.append(0)
+            self.bad.append(0)
+        counts[length - 1] += delta
+
+    def completed(self, root):
+        """Record that the segment with the given root has become a complete ship"""
+        length, openends, pos, horiz = self.segments[root]
+        self.complete.append((pos, length, horiz))
+        if length > 1:
+            key = ((True, pos[1]) if horiz else (False, pos[0]), length)
+            self.along[key] = self.along.get(key, 0) + 1
+
+    def update(self, x, y, value, grid):
+        """Update the inventory after cell (x, y) of grid has been set to value"""
+        neighbours = grid.info.topology.neighbors[x, y]
+        if value == WATER:
+            # Neighbouring segments lose an open end
+            for cell in neighbours:
+                if cell in self.parent:
+                    root = self.find(cell)
+                    self.tally(root, -1)
+                    length, openends, pos, horiz = self.segments[root]
+                    self.segments[root] = (length, openends - 1, pos, horiz)
+                    self.tally(root, 1)
+                    if openends == 1:
+                        self.completed(root)
+        elif value == SHIP:
+            # Start a new segment
+            cell = (x, y)
+            openends = sum(1 for n in neighbours if grid.get(*n) == UNKNOWN)
+            self.parent[cell] = cell
+            self.segments[cell] = (1, openends, cell, True)
+            root = cell
+            # Merge with neighbouring segments, which each lose this cell as an open end
+            for n in neighbours:
+                if n not in self.parent:
+                    continue
+                other = self.find(n)
+                if other == root:
+                    continue
+                self.tally(other, -1)
+                length1, open1, pos1, horiz1 = self.segments.pop(other)
+                length2, open2, pos2, horiz2 = self.segments.pop(root)
+                horiz = n[1] == y
+                self.parent[other] = root
+                self.segments[root] = (length1 + length2, open1 + open2 - 1, min(pos1, pos2), horiz)
+            self.tally(root, 1)
+            if self.segments[root][1] == 0:
+                self.completed(root)
+
+    def close_all(self):
+        """Mark all segments as complete (used when all unknown cells become water)"""
+        for root, (length, openends, pos, horiz) in self.segments.items():
+            if openends > 0:
+                self.tally(root, -1)
+                self.segments[root] = (length, 0, pos, horiz)
+                self.tally(root, 1)
+                self.completed(root)
+
+    def counts(self, minlength):
+        """
+        Returns copies of the good and bad counts, padded with zeros to
+        at least the given length
+        """
+        length = max(minlength, len(self.good))
+        padding = [0] * (length - len(self.good))
+        return self.good + padding, self.bad + padding
+
+    def has_complete(self, placement):
+        """Checks if there is a complete ship at the given placement (pos, length, horiz)"""
+        pos, length, horiz = placement
+        if pos not in self.parent:
+            return False
+        seglength, openends, segpos, seghoriz = self.segments[self.find(pos)]
+        return openends == 0 and seglength == length and segpos == pos and (seghoriz == horiz or length == 1)
+
+    def ships(self):
+        """Returns a list of all segments as (pos, length, horiz, good), sorted by position"""
+        return sorted((pos, length, horiz, openends == 0)
+                      for length, openends, pos, horiz in self.segments.values())
 
 class Grid(PuzzleState):
-    """Holds the state of the puzzle"""
+    """
+    Holds the state of the puzzle
+
+    The logic routines only access the state through the following methods, so that
+    other storage backends (such as BitGrid) can be substituted:
+    get, put, line, column, row, count_column, count_row, counts_valid, has_contact, holes,
+    fill_water
+    In addition, each state keeps a ShipInventory and a Zobrist hash of its contents,
+    which put updates as cells change. put also records the lines (see all_lines) that
+    have changed since the simple logic (dirty) and the line logic (unsettled) last
+    looked at them, so that the logic only revisits the lines that have changed.
+
+    Whole-grid checks are vectorized with numpy, rather than looping over cells, and the
+    number of cells with each setting in each row and column are kept up to date by put.
+    """
 
     def __init__(self, info):
         """
@@ -46,6 +250,17 @@ class Grid(PuzzleState):
         """
         self.info = info
         self.grid = np.zeros([info.width, info.height], dtype=np.int8)
+        self.inventory = ShipInventory()
+        # Zobrist hash: the XOR of the keys of every cell that is set
+        self.key = 0
+        # Lines that have changed since the logic last looked at them
+        self.dirty = set(all_lines(info))
+        self.unsettled = set(all_lines(info))
+        # Fleet that the line logic last settled the lines against
+        self.settled_fleet = None
+        # colcounts[setting][x] and rowcounts[setting][y] count the cells with each setting
+        self.colcounts = [[info.height] * info.width, [0] * info.width, [0] * info.width]
+        self.rowcounts = [[info.width] * info.height, [0] * info.height, [0] * info.height]
         # Grid is indexed as (x, y) = (col, row), with (0,0) in the top left corner
         # Note that this is TRANSPOSED compared to the way that numpy prints arrays
         # 0 = unknown
@@ -56,77 +271,1024 @@ class Grid(PuzzleState):
         """Clones this state, returning a new one"""
         newgrid = Grid(self.info)
         np.copyto(newgrid.grid, self.grid)
+        newgrid.inventory = self.inventory.copy()
+        newgrid.key = self.key
+        newgrid.dirty = self.dirty.copy()
+        newgrid.unsettled = self.unsettled.copy()
+        newgrid.settled_fleet = self.settled_fleet
+        newgrid.colcounts = [counts[:] for counts in self.colcounts]
+        newgrid.rowcounts = [counts[:] for counts in self.rowcounts]
         return newgrid
 
+    def get(self, x, y):
+        """Returns the contents of the (x, y) cell, which must be on the board"""
+        return self.grid.item(x, y)
+
+    def put(self, x, y, value):
+        """Sets the contents of the (x, y) cell, which must be on the board, without any checks"""
+        old = self.grid.item(x, y)
+        keys = self.info.zobrist
+        self.key ^= keys[old][x][y] ^ keys[value][x][y]
+        self.grid[x, y] = value
+        self.colcounts[old][x] -= 1
+        self.colcounts[value][x] += 1
+        self.rowcounts[old][y] -= 1
+        self.rowcounts[value][y] += 1
+        self.inventory.update(x, y, value, self)
+        self.mark(x, y)
+
+    def mark(self, x, y):
+        """Records that the row and column through cell (x, y) have changed"""
+        column = (False, x)
+        row = (True, y)
+        self.dirty.add(column)
+        self.dirty.add(row)
+        self.unsettled.add(column)
+        self.unsettled.add(row)
+
+    def line(self, key):
+        """Returns the line with the given key (see all_lines)"""
+        horiz, idx = key
+        return self.row(idx) if horiz else self.column(idx)
+
+    def column(self, x):
+        """Returns column x as a sequence of cell values"""
+        return self.grid[x]
+
+    def row(self, y):
+        """Returns row y as a sequence of cell values"""
+        return self.grid[:, y]
+
+    def count_column(self, x, setting):
+        """Counts the number of cells in column x with the given setting"""
+        return self.colcounts[setting][x]
+
+    def count_row(self, y, setting):
+        """Counts the number of cells in row y with the given setting"""
+        return self.rowcounts[setting][y]
+
+    def count_unknown(self):
+        """Counts the number of unknown cells on the board"""
+        return sum(self.rowcounts[UNKNOWN])
+
+    def counts_valid(self):
+        """
+        Checks that every row and column can still match its clue: there must not be
+        too many ships, and there must be enough unknowns to reach the clue
+        """
+        info = self.info
+        ships = self.grid == SHIP
+        unknown = self.grid == UNKNOWN
+        # Axis 1 runs along columns, axis 0 runs along rows
+        colships = np.count_nonzero(ships, axis=1)
+        colopen = colships + np.count_nonzero(unknown, axis=1)
+        if np.any(info.colknown & ((colships > info.colvalues) | (colopen < info.colvalues))):
+            return False
+        rowships = np.count_nonzero(ships, axis=0)
+        rowopen = rowships + np.count_nonzero(unknown, axis=0)
+        if np.any(info.rowknown & ((rowships > info.rowvalues) | (rowopen < info.rowvalues))):
+            return False
+        return True
+
+    def has_contact(self):
+        """Checks if any ships are touching diagonally"""
+        ships = self.grid == SHIP
+        # Compare each cell with its neighbours down and to the left/right
+        return bool(np.any(ships[:-1, :-1] & ships[1:, 1:]) or np.any(ships[1:, :-1] & ships[:-1, 1:]))
+
+    def holes(self):
+        """Returns a list of unknown cells that are surrounded by water"""
+        # Pad the board with water, as cells off the board count as water
+        water = np.pad(self.grid == WATER, 1, mode="constant", constant_values=True)
+        holes = (self.grid == UNKNOWN) & water[:-2, 1:-1] & water[2:, 1:-1] \
+                                       & water[1:-1, :-2] & water[1:-1, 2:]
+        # Transpose so that the holes are listed row by row
+        ys, xs = np.nonzero(holes.T)
+        return [(int(x), int(y)) for x, y in zip(xs, ys)]
+
+    def fill_water(self):
+        """
+        Fills all unknown squares with water
+        Returns True if anything changed
+        """
+        unknown = self.grid == UNKNOWN
+        if not np.any(unknown):
+            return False
+        keys = self.info.zobrist[WATER]
+        for x, y in zip(*np.nonzero(unknown)):
+            self.key ^= keys[x][y]
+        self.grid[unknown] = WATER
+        self.colcounts[WATER] = [self.info.height - ships for ships in self.colcounts[SHIP]]
+        self.rowcounts[WATER] = [self.info.width - ships for ships in self.rowcounts[SHIP]]
+        self.colcounts[UNKNOWN] = [0] * self.info.width
+        self.rowcounts[UNKNOWN] = [0] * self.info.height
+        self.inventory.close_all()
+        self.dirty.update(all_lines(self.info))
+        self.unsettled.update(all_lines(self.info))
+        return True
+
+    def to_array(self):
+        """Returns the state as a numpy array, indexed as (x, y)"""
+        return self.grid.copy()
+
+    def sync(self):
+        """
+        Brings the hash and the counts for each line up to date after the grid has been
+        written to directly (rather than through put). The inventory is not updated.
+        """
+        self.key = self.compute_key()
+        for setting in (UNKNOWN, SHIP, WATER):
+            cells = self.grid == setting
+            self.colcounts[setting] = np.count_nonzero(cells, axis=1).tolist()
+            self.rowcounts[setting] = np.count_nonzero(cells, axis=0).tolist()
+        self.dirty.update(all_lines(self.info))
+        self.unsettled.update(all_lines(self.info))
+
     def __str__(self):
         """Produce a string representation of the state (typically, to be printed)"""
-        rows = ["" for _ in range(self.info.height + 3)]
-
-        # Start by making the border
-        rows[1] = "    ┌" + "-" * (self.info.width * 2 - 1) + "┐"
-        for i in range(2, len(rows) - 1):
-            rows[i] = "|" + " " * (self.info.width * 2 - 1) + "| "
-        rows[-1] = "    └" + "-" * (self.info.width * 2 - 1) + "┘"
-
-        # Now, add in the clues
-        for idx, num in enumerate(self.info.rowclues):
-            if num is None:
-                rows[idx + 2] = '  ? ' + rows[idx + 2]
-            else:
-                rows[idx + 2] = '{:3d}'.format(num) + " " + rows[idx + 2]
-        rows[0] = "    "
-        for idx, num in enumerate(self.info.colclues):
-            if num is None:
-                rows[0] += " ?"
-            else:
-                rows[0] += " " + str(num)
+        return render(self, "plain")
+
+    def pretty_print(self, fmt="ansi"):
+        """Prints the state to the screen (in color, by default) with a single write"""
+        write_grids([self], fmt)
+
+    def pack(self):
+        """Returns a compact copy of the state for storing solutions (see PackedGrid)"""
+        array = self.to_array()
+        return PackedGrid(self.info, np.packbits(array == SHIP).tobytes(),
+                          np.packbits(array == WATER).tobytes(), self.key, self.__class__)
+
+    def compute_key(self):
+        """Computes the Zobrist hash of the state from scratch"""
+        keys = self.info.zobrist
+        key = 0
+        for x in range(self.info.width):
+            for y in range(self.info.height):
+                key ^= keys[self.get(x, y)][x][y]
+        return key
+
+    def make_hash(self):
+        """
+        Make a hash of the puzzle state. This is the Zobrist hash, which is kept up to date
+        as cells are set. If the puzzle info asks to verify hashes, the hash is checked
+        against one computed from scratch, and the contents of the state are included, so
+        that states that collide are never mistaken for each other.
+        """
+        if self.info.verify_hashes:
+            if self.key != self.compute_key():
+                raise RuntimeError("Zobrist hash is out of date")
+            # The same for every backend, and for packed copies (see PackedGrid)
+            return (self.key, self.to_array().tobytes())
+        return self.key
+
+class BitLine(object):
+    """
+    A row or column of a BitGrid, stored as ship and water bitmasks.
+    Supports the sequence operations that the line logic uses.
+    """
+
+    def __init__(self, ships, water, length):
+        """Bit i of ships/water is set if cell i of the line is ship/water"""
+        self.ships = ships
+        self.water = water
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            start, stop, _ = idx.indices(self.length)
+            stop = max(start, stop)
+            mask = (1 << (stop - start)) - 1
+            return BitLine((self.ships >> start) & mask, (self.water >> start) & mask, stop - start)
+        if idx < 0:
+            idx += self.length
+        if not 0 <= idx < self.length:
+            raise IndexError("BitLine index out of range")
+        if (self.ships >> idx) & 1:
+            return SHIP
+        if (self.water >> idx) & 1:
+            return WATER
+        return UNKNOWN
+
+    def __iter__(self):
+        for i in range(self.length):
+            yield self[i]
+
+    def __contains__(self, setting):
+        return self.count(setting) > 0
+
+    def count(self, setting):
+        """Counts the number of cells with the given setting"""
+        if setting == SHIP:
+            return popcount(self.ships)
+        if setting == WATER:
+            return popcount(self.water)
+        return self.length - popcount(self.ships | self.water)
+
+    def key(self):
+        """Returns a hashable description of the contents of the line"""
+        return (self.ships, self.water, self.length)
+
+class BitGrid(Grid):
+    """
+    Holds the state of the puzzle as bitboards: for each row and for each column,
+    an integer mask of the ship cells and of the water cells.
+    Bit x of a row mask describes cell (x, y); bit y of a column mask describes cell (x, y).
+    """
 
-        def set_char(x, y, char):
-            row = y + 2
-            col = 5 + 2*x
-            rows[row] = rows[row][0:col] + char + rows[row][col + 1:]
+    def __init__(self, info):
+        """
+        Initialize a blank state, given the puzzle information
+        """
+        self.info = info
+        self.ship_rows = [0] * info.height
+        self.water_rows = [0] * info.height
+        self.ship_cols = [0] * info.width
+        self.water_cols = [0] * info.width
+        self.inventory = ShipInventory()
+        self.key = 0
+        self.dirty = set(all_lines(info))
+        self.unsettled = set(all_lines(info))
+        self.settled_fleet = None
+        # Masks for a full row and a full column
+        self.full_row = (1 << info.width) - 1
+        self.full_col = (1 << info.height) - 1
 
-        # Now put in the solution
+    def clone(self):
+        """Clones this state, returning a new one"""
+        newgrid = BitGrid(self.info)
+        newgrid.ship_rows = self.ship_rows[:]
+        newgrid.water_rows = self.water_rows[:]
+        newgrid.ship_cols = self.ship_cols[:]
+        newgrid.water_cols = self.water_cols[:]
+        newgrid.inventory = self.inventory.copy()
+        newgrid.key = self.key
+        newgrid.dirty = self.dirty.copy()
+        newgrid.unsettled = self.unsettled.copy()
+        newgrid.settled_fleet = self.settled_fleet
+        return newgrid
+
+    def get(self, x, y):
+        """Returns the contents of the (x, y) cell, which must be on the board"""
+        if (self.ship_rows[y] >> x) & 1:
+            return SHIP
+        if (self.water_rows[y] >> x) & 1:
+            return WATER
+        return UNKNOWN
+
+    def put(self, x, y, value):
+        """Sets the contents of the (x, y) cell, which must be on the board, without any checks"""
+        keys = self.info.zobrist
+        self.key ^= keys[self.get(x, y)][x][y] ^ keys[value][x][y]
+        xbit = 1 << x
+        ybit = 1 << y
+        # Clear the cell
+        self.ship_rows[y] &= ~xbit
+        self.water_rows[y] &= ~xbit
+        self.ship_cols[x] &= ~ybit
+        self.water_cols[x] &= ~ybit
+        if value == SHIP:
+            self.ship_rows[y] |= xbit
+            self.ship_cols[x] |= ybit
+        elif value == WATER:
+            self.water_rows[y] |= xbit
+            self.water_cols[x] |= ybit
+        self.inventory.update(x, y, value, self)
+        self.mark(x, y)
+
+    def column(self, x):
+        """Returns column x as a BitLine"""
+        return BitLine(self.ship_cols[x], self.water_cols[x], self.info.height)
+
+    def row(self, y):
+        """Returns row y as a BitLine"""
+        return BitLine(self.ship_rows[y], self.water_rows[y], self.info.width)
+
+    def count_column(self, x, setting):
+        """Counts the number of cells in column x with the given setting"""
+        return self.column(x).count(setting)
+
+    def count_row(self, y, setting):
+        """Counts the number of cells in row y with the given setting"""
+        return self.row(y).count(setting)
+
+    def counts_valid(self):
+        """
+        Checks that every row and column can still match its clue: there must not be
+        too many ships, and there must be enough unknowns to reach the clue
+        """
+        for clues, ships, water, length in ((self.info.colclues, self.ship_cols, self.water_cols, self.info.height),
+                                            (self.info.rowclues, self.ship_rows, self.water_rows, self.info.width)):
+            for clue, shipmask, watermask in zip(clues, ships, water):
+                if clue is None:
+                    continue
+                shipcount = popcount(shipmask)
+                if shipcount > clue or length - popcount(watermask) < clue:
+                    return False
+        return True
+
+    def has_contact(self):
+        """Checks if any ships are touching diagonally"""
+        for y in range(self.info.height - 1):
+            ships = self.ship_rows[y]
+            if ((ships << 1) | (ships >> 1)) & self.ship_rows[y + 1]:
+                return True
+        return False
+
+    def holes(self):
+        """Returns a list of unknown cells that are surrounded by water"""
+        width = self.info.width
+        height = self.info.height
+        holes = []
+        for y in range(height):
+            water = self.water_rows[y]
+            unknown = self.full_row & ~(self.ship_rows[y] | water)
+            # Cells off the board count as water
+            unknown &= (water << 1) | 1
+            unknown &= (water >> 1) | (1 << (width - 1))
+            if y > 0:
+                unknown &= self.water_rows[y - 1]
+            if y < height - 1:
+                unknown &= self.water_rows[y + 1]
+            x = 0
+            while unknown:
+                if unknown & 1:
+                    holes.append((x, y))
+                unknown >>= 1
+                x += 1
+        return holes
+
+    def fill_water(self):
+        """
+        Fills all unknown squares with water
+        Returns True if anything changed
+        """
+        changed = False
+        keys = self.info.zobrist[WATER]
         for y in range(self.info.height):
-            for x in range(self.info.width):
-                cell = self.grid[x, y]
-                if cell == WATER:
-                    set_char(x, y, "~")
-                elif cell == SHIP:
-                    # Ships need more logic
-                    if cell_is(x, y-1, SHIP, self) and cell_is(x, y+1, WATER, self):
-                        set_char(x, y, "V")
-                    elif cell_is(x, y+1, SHIP, self) and cell_is(x, y-1, WATER, self):
-                        set_char(x, y, "Λ")
-                    elif cell_is(x+1, y, SHIP, self) and cell_is(x-1, y, WATER, self):
-                        set_char(x, y, "<")
-                    elif cell_is(x-1, y, SHIP, self) and cell_is(x+1, y, WATER, self):
-                        set_char(x, y, ">")
-                    elif cell_is(x-1, y, WATER, self) and cell_is(x+1, y, WATER, self) and cell_is(x, y+1, WATER, self) and cell_is(x, y-1, WATER, self):
-                        set_char(x, y, "@")
-                    else:
-                        set_char(x, y, "#")
+            water = self.full_row & ~self.ship_rows[y]
+            if water != self.water_rows[y]:
+                changed = True
+                # Add the keys for the new water cells
+                new = water & ~self.water_rows[y]
+                x = 0
+                while new:
+                    if new & 1:
+                        self.key ^= keys[x][y]
+                    new >>= 1
+                    x += 1
+                self.water_rows[y] = water
+        for x in range(self.info.width):
+            self.water_cols[x] = self.full_col & ~self.ship_cols[x]
+        if changed:
+            self.inventory.close_all()
+            self.dirty.update(all_lines(self.info))
+            self.unsettled.update(all_lines(self.info))
+        return changed
+
+    def masks_to_array(self, rows):
+        """Unpacks row bitmasks into a numpy array of 0s and 1s, indexed as (x, y)"""
+        width = self.info.width
+        size = (width + 7) // 8
+        data = b"".join(row.to_bytes(size, "little") for row in rows)
+        bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8), bitorder="little")
+        return bits.reshape(self.info.height, size * 8)[:, :width].T
+
+    def to_array(self):
+        """Returns the state as a numpy array, indexed as (x, y)"""
+        ships = self.masks_to_array(self.ship_rows)
+        water = self.masks_to_array(self.water_rows)
+        return (ships * SHIP + water * WATER).astype(np.int8)
+
+    def count_unknown(self):
+        """Counts the number of unknown cells on the board"""
+        known = sum(popcount(ships | water) for ships, water in zip(self.ship_rows, self.water_rows))
+        return self.info.width * self.info.height - known
+
+class PackedGrid(object):
+    """
+    A compact, read-only copy of a state, used to store solutions (see Grid.pack).
 
-        return "\n".join(rows)
+    Only the shared PuzzleInfo, the ship and water cells (as bitmasks, packed eight
+    cells to a byte), the hash and the class of the state are kept, rather than the
+    whole state with its inventory and bookkeeping. Call unpack to get the full state back.
+    """
+    __slots__ = ("info", "ships", "water", "key", "backend")
 
-    def pretty_print(self):
-        """Prints the state to the screen in color"""
-        for char in str(self):
-            if char == "~":
-                print(Fore.BLUE + "~" + Fore.RESET, end="")
-            elif char in "<>@#ΛV":
-                print(Fore.RED + Style.BRIGHT + char + Style.RESET_ALL, end="")
-            else:
-                print(char, end="")
-        print()
+    def __init__(self, info, ships, water, key, backend):
+        """
+        ships and water are the bitmasks of the cells, as bytes, in to_array order
+        backend is the class of the state that was packed
+        """
+        self.info = info
+        self.ships = ships
+        self.water = water
+        self.key = key
+        self.backend = backend
+
+    def to_array(self):
+        """Returns the state as a numpy array, indexed as (x, y)"""
+        shape = (self.info.width, self.info.height)
+        count = shape[0] * shape[1]
+        ships = np.unpackbits(np.frombuffer(self.ships, dtype=np.uint8), count=count)
+        water = np.unpackbits(np.frombuffer(self.water, dtype=np.uint8), count=count)
+        return (ships * SHIP + water * WATER).astype(np.int8).reshape(shape)
+
+    @property
+    def grid(self):
+        """The state as a numpy array, as for Grid"""
+        return self.to_array()
+
+    def get(self, x, y):
+        """Returns the value of cell (x, y)"""
+        idx = x * self.info.height + y
+        bit = 0x80 >> (idx & 7)
+        if self.ships[idx >> 3] & bit:
+            return SHIP
+        if self.water[idx >> 3] & bit:
+            return WATER
+        return UNKNOWN
+
+    def unpack(self, backend=None):
+        """
+        Returns a full state with the same cells, of the class that was packed (or the
+        given backend class)
+        """
+        grid = (backend or self.backend)(self.info)
+        array = self.to_array()
+        for x, y in zip(*array.nonzero()):
+            grid.put(int(x), int(y), int(array[x, y]))
+        return grid
 
     def make_hash(self):
-        """Make a hash of the puzzle state"""
-        return hash(self.grid.tostring())
+        """Returns the same hash as the state that was packed"""
+        if self.info.verify_hashes:
+            return (self.key, self.to_array().tobytes())
+        return self.key
+
+    def __str__(self):
+        """Produce a string representation of the state (typically, to be printed)"""
+        return render(self, "plain")
+
+    def pretty_print(self, fmt="ansi"):
+        """Prints the state to the screen (in color, by default) with a single write"""
+        write_grids([self], fmt)
+
+### RENDERING ###
+
+# Output formats for render: the board with clues (plain, or colored with ANSI codes),
+# or a compact single line of cells with rows separated by /
+FORMATS = ("plain", "ansi", "compact")
+
+# ANSI colored versions of each symbol used on the board
+ANSI_SYMBOLS = {"~": Fore.BLUE + "~" + Fore.RESET, " ": " "}
+ANSI_SYMBOLS.update({char: Fore.RED + Style.BRIGHT + char + Style.RESET_ALL for char in "<>@#ΛV"})
+
+def cell_symbol(cell, up, down, left, right):
+    """The symbol for a cell, given its value and the values of its neighbours"""
+    if cell == WATER:
+        return "~"
+    elif cell == UNKNOWN:
+        return " "
+    # Ships need more logic
+    if up == SHIP and down == WATER:
+        return "V"
+    elif down == SHIP and up == WATER:
+        return "Λ"
+    elif right == SHIP and left == WATER:
+        return "<"
+    elif left == SHIP and right == WATER:
+        return ">"
+    elif up == down == left == right == WATER:
+        return "@"
+    return "#"
+
+# The symbol for every combination of a cell and its neighbours, indexed by
+# cell + 3*up + 9*down + 27*left + 81*right
+SYMBOL_TABLE = np.array([cell_symbol(index % 3, index // 3 % 3, index // 9 % 3,
+                                     index // 27 % 3, index // 81 % 3)
+                         for index in range(243)])
+
+def board_symbols(grid):
+    """
+    Returns the symbols for each cell of a state as a list of rows of characters (see
+    cell_symbol). The whole board is looked up in SYMBOL_TABLE at once.
+    """
+    array = grid.to_array()
+    # Pad the board with water, as cells off the board count as water
+    board = np.full((array.shape[0] + 2, array.shape[1] + 2), WATER, dtype=np.int16)
+    board[1:-1, 1:-1] = array
+    index = (array + 3 * board[1:-1, :-2] + 9 * board[1:-1, 2:]
+             + 27 * board[:-2, 1:-1] + 81 * board[2:, 1:-1])
+    return SYMBOL_TABLE[index.T].tolist()
+
+def render(grid, fmt="plain"):
+    """
+    Produce a string representation of a state in one of FORMATS, building each row
+    once from the symbols of the whole board
+    """
+    symbols = board_symbols(grid)
+    if fmt == "compact":
+        return "/".join("".join(row).replace(" ", ".") for row in symbols)
+    if fmt == "ansi":
+        symbols = [[ANSI_SYMBOLS[char] for char in row] for row in symbols]
+    elif fmt != "plain":
+        raise ValueError("Unknown format: " + str(fmt))
+
+    info = grid.info
+    # Column clues and the top border
+    rows = ["    " + "".join(" ?" if num is None else " " + str(num) for num in info.colclues),
+            "    ┌" + "-" * (info.width * 2 - 1) + "┐"]
+    # Each row, with its clue
+    for num, row in zip(info.rowclues, symbols):
+        clue = "  ? " if num is None else "{:3d} ".format(num)
+        rows.append(clue + "|" + " ".join(row) + "| ")
+    rows.append("    └" + "-" * (info.width * 2 - 1) + "┘")
+    return "\n".join(rows)
+
+def write_grids(grids, fmt="ansi", stream=None, titles=None, batch=True):
+    """
+    Write a number of states to a stream (defaults to standard output) in one of FORMATS.
+    titles is an optional list of lines to write before each state.
+    With batch, everything is written at once; otherwise, each state is written at once.
+    Plain and ANSI boards are followed by a blank line when there is more than one.
+    """
+    if stream is None:
+        stream = sys.stdout
+    separator = "\n\n" if fmt != "compact" and len(grids) > 1 else "\n"
+    chunks = []
+    for idx, grid in enumerate(grids):
+        title = "" if titles is None else titles[idx] + "\n"
+        chunks.append(title + render(grid, fmt) + separator)
+        if not batch:
+            stream.write(chunks.pop())
+    stream.write("".join(chunks))
+    stream.flush()
+
+def line_key(line):
+    """Returns a hashable description of the contents of a line (ndarray or BitLine)"""
+    if isinstance(line, np.ndarray):
+        return line.tobytes()
+    return line.key()
+
+class LineAnalysis(object):
+    """
+    Everything the logic needs to know about a single line, given its clue:
+    --- unknowns is the number of unknown cells
+    --- valid indicates whether the line can still meet its clue
+    --- ships and water are the unknown cells that the clue forces to be ships or water
+    --- allowed(length) gives the start positions of ships of that length (see find_allowed)
+    """
+
+    def __init__(self, line, clue):
+        """Analyze the line, which is copied so that the analysis can be cached"""
+        self.line = [int(cell) for cell in line]
+        self.clue = clue
+        self.unknowns = self.line.count(UNKNOWN)
+        self.shipcount = self.line.count(SHIP)
+        self.ships = ()
+        self.water = ()
+        self.starts = {}
+        self.completions = {}
+        self.valid = clue is None or self.shipcount <= clue <= self.shipcount + self.unknowns
+        if clue is None or self.unknowns == 0:
+            return
+        empty = tuple(i for i, cell in enumerate(self.line) if cell == UNKNOWN)
+        if self.shipcount == clue:
+            # The rest must be water
+            self.water = empty
+        elif self.line.count(WATER) + clue == len(self.line):
+            # The rest must be ships
+            self.ships = empty
+
+    def allowed(self, length):
+        """
+        Finds allowed positions for a ship of the given length on the line
+        Such positions must include the placement of a new ship tile
+        """
+        if length not in self.starts:
+            self.starts[length] = self.find_starts(length)
+        return self.starts[length]
+
+    def find_starts(self, length):
+        """Computes the allowed positions for a ship of the given length"""
+        line = self.line
+        clue = self.clue
+        # Check the length isn't too long for the line
+        if clue is not None and clue < length:
+            return ()
+        # Check that there are still empty cells available
+        if self.unknowns == 0:
+            return ()
+
+        result = []
+        # Run through all possible start positions, and see if they're valid
+        for start in range(0, len(line) - length + 1):
+            # Check to make sure we're not making a longer ship than we want.
+            if start > 0 and line[start - 1] == SHIP:
+                continue
+            if start + length < len(line) and line[start + length] == SHIP:
+                continue
+            # Is there water in the segment?
+            segment = line[start:start + length]
+            if WATER in segment:
+                continue
+            # How many unknowns are in the segment?
+            unknowns = segment.count(UNKNOWN)
+            if unknowns == 0:
+                continue
+            # Check to make sure we haven't put too many ships on this line.
+            if clue is not None and self.shipcount + unknowns > clue:
+                continue
+            # Looks feasible. Add it to the list
+            result.append(start)
+        return tuple(result)
+
+    def complete(self, budget):
+        """
+        Finds the cells that are the same in every valid way of completing the line.
+        budget gives the maximum number of ships of each length (shortest first) that
+        can lie along the line. Runs of two or more ship cells along the line are
+        complete ships, so must be no longer than the longest ship, and are limited by
+        the budget. Single ship cells may be part of a perpendicular ship, so are not.
+        If the clue is known, the number of ship cells must match it.
+        Returns (ships, water), the unknown cells that are always ships or water,
+        or None if the line cannot be completed.
+        """
+        # Only the limits that could be reached along this line matter: k runs of length L
+        # take up k * L ship cells, and k * (L + 1) - 1 cells in all. Other limits are
+        # dropped (None), which keeps the enumeration small for large fleets.
+        limits = []
+        for i, count in enumerate(budget):
+            length = i + 1
+            most = (len(self.line) + 1) // (length + 1)
+            if self.clue is not None:
+                most = min(most, self.clue // length)
+            limits.append(count if length > 1 and count < most else None)
+        budget = tuple(limits)
+        if budget not in self.completions:
+            self.completions[budget] = self.enumerate(budget)
+        return self.completions[budget]
+
+    def enumerate(self, budget):
+        """
+        Computes the result of complete, by dynamic programming over the line.
+        Lengths of ship with a budget of None are not limited.
+        """
+        line = self.line
+        clue = self.clue
+        maxships = clue if clue is not None else len(line)
+        maxlen = len(budget)
+
+        def close(runlen, runs):
+            """Close off a run of ship cells, returning the new run counts (or None)"""
+            if runlen < 2 or budget[runlen - 1] is None:
+                return runs
+            if runs[runlen - 1] >= budget[runlen - 1]:
+                return None
+            return runs[:runlen - 1] + (runs[runlen - 1] + 1,) + runs[runlen:]
+
+        # Forward pass: each state is (ship cells, length of current run, runs of each length)
+        states = {(0, 0, (0,) * maxlen)}
+        steps = []
+        for cell in line:
+            newstates = set()
+            step = []
+            for state in states:
+                ships, runlen, runs = state
+                if cell != WATER and ships < maxships and runlen < maxlen:
+                    newstate = (ships + 1, runlen + 1, runs)
+                    newstates.add(newstate)
+                    step.append((state, SHIP, newstate))
+                if cell != SHIP:
+                    newruns = close(runlen, runs)
+                    if newruns is not None:
+                        newstate = (ships, 0, newruns)
+                        newstates.add(newstate)
+                        step.append((state, WATER, newstate))
+            states = newstates
+            steps.append(step)
+
+        # Backward pass: keep only the states that lead to a valid completion,
+        # and record the values that each cell can take along the way
+        good = {state for state in states
+                if (clue is None or state[0] == clue) and close(state[1], state[2]) is not None}
+        values = [set() for _ in line]
+        for i in range(len(line) - 1, -1, -1):
+            previous = set()
+            for state, value, newstate in steps[i]:
+                if newstate in good:
+                    previous.add(state)
+                    values[i].add(value)
+            good = previous
+        if not good:
+            return None
+
+        ships = tuple(i for i, cell in enumerate(line) if cell == UNKNOWN and values[i] == {SHIP})
+        water = tuple(i for i, cell in enumerate(line) if cell == UNKNOWN and values[i] == {WATER})
+        return ships, water
+
+class LineCache(object):
+    """
+    Bounded cache of LineAnalysis objects, keyed on the contents of the line and its clue.
+    The same line contents come up over and over again, both in repeated passes of the
+    logic and across sibling branches of the search, so the analysis is only done once.
+    Start positions for each ship length are computed on demand and stored in the
+    analysis, so that the cache is effectively keyed on (line, clue, length).
+    The least recently used lines are discarded once maxsize is reached.
+    """
+
+    def __init__(self, maxsize=65536):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def analyze(self, line, clue):
+        """Returns the LineAnalysis for the given line and clue"""
+        key = (line_key(line), clue)
+        analysis = self.entries.get(key)
+        if analysis is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return analysis
+        self.misses += 1
+        analysis = LineAnalysis(line, clue)
+        self.entries[key] = analysis
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+        return analysis
+
+    def clear(self):
+        """Empties the cache and resets the statistics"""
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def hit_rate(self):
+        """Returns the fraction of lookups that were found in the cache"""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups > 0 else 0.0
+
+    def stats(self):
+        """Returns a dictionary of statistics, for sizing the cache"""
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hit_rate(),
+                "size": len(self.entries), "maxsize": self.maxsize}
+
+# Line analysis cache shared by all states
+line_cache = LineCache()
+
+class ProbeCache(object):
+    """
+    Bounded cache of the results of probing (see probe), keyed on the puzzle clues and
+    the hash of the state, so that states reached again (through other branches of the
+    search, or in another run of the same puzzle) aren't probed a second time.
+    The least recently used states are discarded once maxsize is reached.
+    """
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.probes = 0
+        self.fixes = 0
+
+    def lookup(self, key):
+        """Returns the fixes found for the given state, or None if it hasn't been probed"""
+        fixes = self.entries.get(key)
+        if fixes is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        else:
+            self.misses += 1
+        return fixes
+
+    def store(self, key, fixes):
+        """Stores the fixes found for the given state"""
+        self.entries[key] = fixes
+        self.entries.move_to_end(key)
+        self.fixes += len(fixes)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        """Empties the cache and resets the statistics"""
+        self.entries.clear()
+        self.hits = self.misses = self.probes = self.fixes = 0
+
+    def stats(self):
+        """Returns a dictionary of statistics"""
+        return {"hits": self.hits, "misses": self.misses, "probes": self.probes,
+                "fixes": self.fixes, "size": len(self.entries), "maxsize": self.maxsize}
+
+# Probe cache shared by all states
+probe_cache = ProbeCache()
+
+# Ways of choosing the length of ship to guess on
+BRANCHINGS = ("longest", "fewest")
+# Ways of ordering the placements that are guessed (see order_placements)
+ORDERINGS = ("scan", "constrained", "clues")
+# Schedulers for the order that guesses are explored in, by name (make a new one for each run)
+SCHEDULERS = {"dfs": DepthFirst, "lds": LimitedDiscrepancy, "best": BestFirst,
+              "restarts": RandomRestarts}
+
+class SolverOptions(object):
+    """Switches for the optional parts of the battleships logic"""
+
+    def __init__(self, line_logic=True, probing=False, probe_budget=500, probe_time=None,
+                 branching="longest", ordering="scan", verify_hashes=False, symmetry=True,
+                 nogoods=0):
+        """
+        line_logic enables line_logic, which fixes the cells that agree across every
+          valid completion of a line
+        probing enables probe, which tries each value of each unknown cell before guessing
+        probe_budget is the maximum number of trial values that probe tests per call
+        probe_time is the maximum time in seconds that probe spends per call (None for no limit)
+        branching chooses the length of ship to guess on:
+          longest: the longest length that is still missing ships
+          fewest: the length with the fewest possible placements
+        ordering chooses the order in which placements are guessed (see order_placements)
+        verify_hashes checks the Zobrist hash of each state as it is used, and makes
+          states that share a hash compare by their contents (see Grid.make_hash)
+        symmetry enables symmetry breaking between ships of the same length, so that the
+          same board is not reached by placing them in different orders (see BattleShips.exclusions)
+        nogoods is the number of nogoods to keep (0 to not learn any): sets of ship placements
+          that can't all be in a solution, learned from the guesses that fail (see
+          framework.NogoodStore and BattleShips.refutes)
+        """
+        if branching not in BRANCHINGS:
+            raise ValueError("Unknown branching strategy: {}".format(branching))
+        if ordering not in ORDERINGS:
+            raise ValueError("Unknown ordering: {}".format(ordering))
+        self.line_logic = line_logic
+        self.probing = probing
+        self.probe_budget = probe_budget
+        self.probe_time = probe_time
+        self.branching = branching
+        self.ordering = ordering
+        self.verify_hashes = verify_hashes
+        self.symmetry = symmetry
+        self.nogoods = nogoods
+
+class BranchStats(object):
+    """Statistics about the guesses made while solving"""
+
+    def __init__(self):
+        """Initialize all counts to zero"""
+        # Number of states that needed to guess
+        self.nodes = 0
+        # Total number of placements in their guess lists
+        self.branches = 0
+        # For each depth in the search tree: [number of nodes, total number of branches]
+        self.levels = []
+        # For each ship length guessed on: [number of nodes, total number of branches]
+        self.lengths = {}
+
+    def record(self, depth, length, branches):
+        """Record a guess at the given depth on a ship length with the given number of branches"""
+        self.nodes += 1
+        self.branches += branches
+        while len(self.levels) <= depth:
+            self.levels.append([0, 0])
+        self.levels[depth][0] += 1
+        self.levels[depth][1] += branches
+        counts = self.lengths.setdefault(length, [0, 0])
+        counts[0] += 1
+        counts[1] += branches
+
+    def branching(self):
+        """Returns the average branching factor at each depth of the search tree"""
+        return [branches / nodes for nodes, branches in self.levels]
+
+    def as_dict(self):
+        """Returns the statistics as a dictionary"""
+        return {"nodes": self.nodes,
+                "branches": self.branches,
+                "branching": self.branching(),
+                "lengths": {length: counts[:] for length, counts in sorted(self.lengths.items())}}
+
+class Consensus(object):
+    """
+    Collects solutions as running per-cell counts, rather than storing them.
+
+    Pass a Consensus to run as the solution list: each solution is folded into the
+    counts of how many solutions have a ship and how many have water in each cell as it
+    is found. With symmetry breaking on (see SolverOptions), the search never reaches
+    a solution twice, so run doesn't keep the hashes of the solutions either, and the
+    memory used for solutions doesn't grow with their number.
+    """
+
+    def __init__(self):
+        """Start with no solutions"""
+        self.count = 0
+        self.info = None
+        self.ships = None
+        self.water = None
+        # The first solution found, kept to display unique solutions
+        self.first = None
+
+    def append(self, state):
+        """Add a solution"""
+        array = state.to_array()
+        if self.count == 0:
+            self.info = state.info
+            self.ships = np.zeros(array.shape, dtype=np.int64)
+            self.water = np.zeros(array.shape, dtype=np.int64)
+            self.first = state
+        self.ships += array == SHIP
+        self.water += array == WATER
+        self.count += 1
+
+    def __len__(self):
+        return self.count
+
+    def common(self):
+        """Returns a Grid of the cells that all solutions have in common (or None if there are none)"""
+        if self.count == 0:
+            return None
+        result = Grid(self.info)
+        result.grid[self.ships == self.count] = SHIP
+        result.grid[self.water == self.count] = WATER
+        result.sync()
+        return result
+
+    def probabilities(self):
+        """
+        Returns a numpy array (indexed as (x, y)) of the fraction of solutions with a
+        ship in each cell (or None if there are no solutions)
+        """
+        if self.count == 0:
+            return None
+        return self.ships / self.count
+
+    def heatmap(self):
+        """
+        Returns a string showing the percentage of solutions with a ship in each cell.
+        Cells that are water in every solution are shown as ~, and cells that are a ship in
+        every solution are shown as #.
+        """
+        probs = self.probabilities()
+        if probs is None:
+            return ""
+        lines = ["    " + "".join("{:>4}".format("?" if clue is None else clue)
+                                  for clue in self.info.colclues)]
+        for y in range(self.info.height):
+            clue = self.info.rowclues[y]
+            line = "{:>3} ".format("?" if clue is None else clue)
+            for x in range(self.info.width):
+                if self.water[x, y] == self.count:
+                    line += "   ~"
+                elif self.ships[x, y] == self.count:
+                    line += "   #"
+                else:
+                    line += "{:4d}".format(int(round(100 * probs[x, y])))
+            lines.append(line)
+        return "\n".join(lines)
 
 class BattleShips(PuzzleSolver):
     """Solver class for Battleships"""
 
+    def __init__(self, initstate, options=None, stats=None, **kwargs):
+        """
+        Initialize the solver. options is a SolverOptions object (None for the defaults),
+        and stats is a BranchStats object to record guessing statistics in (or None).
+        Both are shared with all children. All other arguments are passed to PuzzleSolver.
+        """
+        super().__init__(initstate, **kwargs)
+        self.options = options if options is not None else SolverOptions()
+        self.stats = stats
+        # Placements that this solver must not make (see exclusions)
+        self.excluded = None
+        # Number of complete ships that have been checked against them
+        self.checked = None
+        # What this solver takes from its parent (see clone)
+        self.inherited = None
+
+    def spawn(self, state, **kwargs):
+        """Make a new solver for the given state, sharing this solver's options and stats"""
+        return super().spawn(state, options=self.options, stats=self.stats, **kwargs)
+
+    def clone(self):
+        """
+        Make a new solver that is a clone of this one, one level deeper.
+        The parent moves onto its next guess as soon as the clone is handed out, but the
+        clone may not be explored until later (depending on the scheduler), so the clone
+        takes what it needs from the parent's guess list now: the length of ship being
+        guessed, the guess list, the index of the guess, and the exclusions and number
+        of ships checked against them.
+        """
+        solver = super().clone()
+        solver.inherited = (self.guesslen, self.guesslist, self.guess,
+                            self.exclusions(), self.checked)
+        return solver
+
+    def heuristic(self):
+        """Estimate how far this state is from being solved, as its number of unknown cells"""
+        return self.state.count_unknown()
+
     def logic(self):
         """
         Perform logical operations on the current state to solve the puzzle
@@ -140,14 +1302,14 @@ class BattleShips(PuzzleSolver):
         """
         # Continuously loop - we must exit by returning or raising an exception
         while True:
-            # Start by doing simple checks to find rows/cols that can be filled in
+            # Start by doing simple checks to find rows/cols that can be filled in.
+            # This also checks that the lines that have changed can meet their clues, and
+            # set_ship keeps ships from touching, so the state is known to be valid.
             simple_logic(self)
+            self.check_exclusions()
 
-            # Check for consistency
-            validate(self.state)
-
-            # Now, go and count all ships
-            goodships, badships, ships = find_ships(self.state)
+            # Now, go and count all ships (kept up to date by the grid's inventory)
+            goodships, badships = self.state.inventory.counts(len(self.state.info.ships))
 
             # Are there any ships with lengths longer than maximum?
             maxlength = len(self.state.info.ships)
@@ -163,6 +1325,11 @@ class BattleShips(PuzzleSolver):
                 # We have a solution - grid is valid, and all boats accounted for
                 # Fill in any unknowns with water
                 water_fill(self.state)
+                # Filling in water can leave a clue unmet, or close off an extra ship
+                validate(self.state)
+                if self.state.inventory.counts(maxlength)[0] != list(self.state.info.ships):
+                    raise Inconsistent()
+                self.check_exclusions()
                 raise Solved()
 
             # If all one-length ships are accounted for, fill in all holes with water
@@ -174,6 +1341,16 @@ class BattleShips(PuzzleSolver):
                     # Go back to simple logic
                     continue
 
+            # Fix any cells that every valid completion of their line agrees on
+            if self.options.line_logic and line_logic(self):
+                # Go back to simple logic
+                continue
+
+            # Try out each value of the unknown cells, and fix any that fail
+            if self.options.probing and probe(self):
+                # Go back to simple logic
+                continue
+
             # Find the longest length that is not yet satisfied
             for i in range(maxlength-1, -1, -1):
                 if remaining[i] > 0:
@@ -186,39 +1363,118 @@ class BattleShips(PuzzleSolver):
 
             # Close all badships of this length
             if badships[maxlength - 1] > 0:
-                for pos, length, horiz, good in ships:
+                for pos, length, horiz, good in self.state.inventory.ships():
                     if length == maxlength and good == False:
                         set_full_ship((pos, length, horiz), self.state)
                 # Give simple logic another go
                 continue
 
             # We now have zero badships of this length, but we're still missing ships.
-            # Is our parent guessing on the same length?
-            if self.depth > 0 and self.parent.guesslen == maxlength:
-                # Looks like they are! We can lift their possibilities!
-                parentposs = self.parent.guesslist[self.parent.guess + 1:]
-                # We have to weed out anything that doesn't work though
-                possibilities = [i for i in parentposs if allowed_placement(i, self.state)]
+            # Choose which length of ship to guess on.
+            if self.options.branching == "fewest":
+                # Any length that has no badships can be guessed on
+                lengths = [i + 1 for i in range(maxlength - 1, -1, -1)
+                           if remaining[i] > 0 and (i + 1 == maxlength or badships[i] == 0)]
             else:
-                # Go and construct a list of possibilities from scratch
-                possibilities = find_positions(self.state, maxlength)
+                lengths = [maxlength]
 
-            # Check that there are sufficient possibilities to cover the remaining slots
-            if len(possibilities) < remaining[maxlength - 1]:
-                raise Inconsistent()
+            best = None
+            applied = False
+            for length in lengths:
+                possibilities = self.find_possibilities(length)
+
+                # Check that there are sufficient possibilities to cover the remaining slots
+                if len(possibilities) < remaining[length - 1]:
+                    raise Inconsistent()
 
-            # If the number of possibilities is equal to the number of ships left,
-            # apply them all and continue (Inconsistent will be caught in framework)
-            if len(possibilities) == remaining[maxlength - 1]:
-                for i in possibilities:
-                    self.apply_guess(i)
+                # If the number of possibilities is equal to the number of ships left,
+                # apply them all and continue (Inconsistent will be caught in framework)
+                if len(possibilities) == remaining[length - 1]:
+                    for i in possibilities:
+                        self.apply_guess(i)
+                    applied = True
+                    break
+
+                # Keep the length with the fewest possibilities (longest first on ties)
+                if best is None or len(possibilities) < len(best[1]):
+                    best = (length, possibilities)
+            if applied:
                 continue
+            length, possibilities = best
+
+            # Order the possibilities
+            possibilities = order_placements(possibilities, self.state, self.options.ordering)
+            if self.stats is not None:
+                self.stats.record(self.depth, length, len(possibilities))
 
             # Set the length of ship that we're guessing, so that any children can read it
-            self.guesslen = maxlength
+            self.guesslen = length
+            # along with the longest length that is still missing ships
+            self.longest = maxlength
 
             # And get out, so we can start guessing!
-            return possibilities, remaining[maxlength - 1]
+            return possibilities, remaining[length - 1]
+
+    def exclusions(self):
+        """
+        Returns the placements that this solver must not make, as a dictionary from each
+        length of ship to a frozenset of placement keys (see placement_key).
+
+        Ships of the same length are interchangeable, so once a solver has tried placing a
+        ship somewhere, every solution with a ship there is found by that guess. The guesses
+        that follow it, and all of their descendants, can exclude that placement. This
+        extends the lifting of the parent's guess list in find_possibilities to every
+        ancestor, and to ships that the logic places rather than guesses.
+        """
+        if self.excluded is None:
+            self.excluded = {}
+            if self.inherited is not None and self.options.symmetry:
+                length, guesslist, guess, excluded, _ = self.inherited
+                self.excluded = dict(excluded)
+                tried = guesslist[:guess]
+                if len(tried) > 0:
+                    self.excluded[length] = (self.excluded.get(length, frozenset())
+                                             | {placement_key(i) for i in tried})
+        return self.excluded
+
+    def check_exclusions(self):
+        """
+        Raises Inconsistent if the state has a complete ship in an excluded placement.
+        Only the ships completed since the last check are looked at.
+        """
+        inventory = self.state.inventory
+        excluded = self.exclusions()
+        if self.checked is None:
+            self.checked = 0
+            if self.inherited is not None and len(excluded) > 0:
+                # The parent has checked its ships against its own exclusions, so they
+                # only need checking against the placements that it has tried since
+                _, guesslist, guess, _, checked = self.inherited
+                for placement in guesslist[:guess]:
+                    if inventory.has_complete(placement):
+                        raise Inconsistent()
+                self.checked = checked
+        if len(excluded) > 0:
+            for pos, length, horiz in inventory.complete[self.checked:]:
+                if length in excluded and placement_key((pos, length, horiz)) in excluded[length]:
+                    raise Inconsistent()
+        self.checked = len(inventory.complete)
+
+    def find_possibilities(self, length):
+        """Find all the places where a ship of the given length could go"""
+        # Is our parent guessing on the same length?
+        if self.inherited is not None and self.inherited[0] == length:
+            # Looks like they are! We can lift their possibilities!
+            _, guesslist, guess, _, _ = self.inherited
+            parentposs = guesslist[guess + 1:]
+            # We have to weed out anything that doesn't work though
+            return [i for i in parentposs if allowed_placement(i, self.state)]
+        # Go and construct a list of possibilities from scratch
+        possibilities = find_positions(self.state, length)
+        excluded = self.exclusions().get(length)
+        if excluded:
+            possibilities = [i for i in possibilities if placement_key(i) not in excluded]
+        return possibilities
 
     def apply_guess(self, guess):
         """
@@ -227,40 +1483,213 @@ class BattleShips(PuzzleSolver):
         """
         set_full_ship(guess, self.state)
 
+    def decision(self, guess):
+        """Returns the decision that a guess makes, as its placement key (see placement_key)"""
+        return placement_key(guess)
+
+    def holds(self, decision):
+        """Returns True if there is a complete ship at the placement of the given decision"""
+        return self.state.inventory.has_complete(decision)
+
+    def refutes(self, decisions):
+        """
+        Returns True if the ships of the given placements can't all be in a solution: they
+        are placed on a copy of the initial state, and the deductive logic (see propagate)
+        finds it to be inconsistent. This doesn't make a new solver, so it isn't counted
+        as a guess.
+        """
+        trial = Probe(self.origin.clone(), self.options)
+        try:
+            for placement in decisions:
+                set_full_ship(placement, trial.state)
+            propagate(trial)
+        except Inconsistent:
+            return True
+        return False
+
     def afterguess(self, guess):
         """
         After setting a length 1 ship, set it to water and perform logic again
+        This is only valid when all longer ships are complete, as otherwise the cell
+        could still be part of a longer ship
         """
         pos, length, horiz = guess
-        if length == 1:
+        if length == 1 and self.longest == 1:
             x, y = pos
             set_water(x, y, self.state)  # This should not raise an exception...
             return True
         return False
 
-def run(rowclues, colclues, initinfo, ships, debug=False):
+def run(rowclues, colclues, initinfo, ships, debug=False, backend=Grid, options=None, stats=None,
+        verbose=True, solutionlist=None, max_solutions=None, scheduler=None):
     """
     Run everything, given the row and column clues, initial board, and ship list.
-    Returns a list of solutions found, and the number of guesses taken.
+    backend is the class used to store the state (Grid or BitGrid).
+    options is a SolverOptions object (None for the defaults).
+    stats is a BranchStats object that records statistics about guessing (or None).
+    verbose controls whether the initial state is printed.
+    solutionlist is where solutions are stored: a list (the default), or any object with
+      an append method, such as a Consensus.
+    max_solutions stops the search once this many solutions have been found (None for
+      all of them); 2 is enough to check that the solution is unique.
+    scheduler is the framework Scheduler that chooses the order guesses are explored in
+      (None for depth first search).
+    Returns the solutions found, and the number of guesses taken.
+    Raises Inconsistent (with a message) if the initial information is inconsistent.
     """
-    info = PuzzleInfo(rowclues, colclues, ships)
-    initState = Grid(info)
+    if options is None:
+        options = SolverOptions()
+    info = PuzzleInfo(rowclues, colclues, ships, verify_hashes=options.verify_hashes)
+    initState = backend(info)
     initialize(initState, initinfo)
-    print("Initial state:")
-    initState.pretty_print()
-    solver = BattleShips(initState, debug=debug)
+    if verbose:
+        print("Initial state:")
+        initState.pretty_print()
+    # Each guess places at least one ship, so the search can be as deep as the fleet is large
+    max_depth = max(50, sum(ships))
+    # With symmetry breaking, no solution is reached twice, so a Consensus doesn't need
+    # the hash of every solution to be kept
+    dedupe = not (isinstance(solutionlist, Consensus) and options.symmetry and
+                  (scheduler is None or not scheduler.repeats_solutions))
+    nogoods = NogoodStore(options.nogoods) if options.nogoods > 0 else None
+    # The number of solvers created is shared by all runs, so count from here
+    firststate = BattleShips.StateNum
+    solver = BattleShips(initState, options=options, stats=stats, debug=debug,
+                         solutionlist=solutionlist, max_depth=max_depth,
+                         max_solutions=max_solutions, scheduler=scheduler, dedupe=dedupe,
+                         nogoods=nogoods)
     solver.solve()
-    return solver.solutionlist, BattleShips.StateNum - 1
+    if debug:
+        print("Line cache:", line_cache.stats())
+        print("Probe cache:", probe_cache.stats())
+        if nogoods is not None:
+            print("Nogoods:", nogoods.stats())
+    return solver.solutionlist, BattleShips.StateNum - firststate - 1
+
+def load_puzzle(filename):
+    """
+    Reads a puzzle from a file (see battleships.py for the format).
+    Returns (rowclues, colclues, ships, initinfo).
+    Raises IOError if the file can't be read, and ValueError if it doesn't describe a puzzle.
+    """
+    data = []
+    with open(filename) as f:
+        for line in f:
+            line = line.strip()
+            if len(line) > 0 and line[0] != "#":
+                data.append(line)
+
+    # Interpret the data
+    if len(data) < 3:
+        raise ValueError("File does not seem to describe a puzzle")
+    # Extract row and column clues
+    rowclues = [int(i) if i != "?" else None for i in map(str.strip, data[0].split(","))]
+    colclues = [int(i) if i != "?" else None for i in map(str.strip, data[1].split(","))]
+    # Extract number of ships
+    ships = list(map(int, map(str.strip, data[2].split(","))))
+    # Extract initial information
+    initinfo = []
+    for i in data[3:]:
+        tokens = list(map(str.strip, i.split(",")))
+        if len(tokens) != 3:
+            raise ValueError("Unable to interpret line: " + i)
+        x, y, value = tokens
+        initinfo.append((int(x), int(y), value))
+    return rowclues, colclues, ships, initinfo
+
+def format_puzzle(rowclues, colclues, ships, initinfo):
+    """
+    Returns the contents of a puzzle file describing the given puzzle (the reverse of
+    load_puzzle). Unknown clues are given as None.
+    """
+    def clues(values):
+        return ", ".join("?" if i is None else str(i) for i in values)
+    lines = ["# Row clues", clues(rowclues),
+             "# Column clues", clues(colclues),
+             "# Number of ships (shortest first)", ", ".join(map(str, ships))]
+    if len(initinfo) > 0:
+        lines.append("# Initial information: x, y, information")
+        lines.extend("{}, {}, {}".format(x, y, value) for x, y, value in initinfo)
+    return "\n".join(lines) + "\n"
+
+def random_solution(width, height, ships, rng, attempts=100, tries=20):
+    """
+    Place a fleet at random on an empty board, longest ships first.
+    rng is a random.Random object.
+    Each ship is placed by trying up to tries random placements, and then choosing from
+    all possible placements if none of those fit, so that large boards fill quickly.
+    Returns a Grid with every cell filled in (without clues), or None if the fleet
+    couldn't be placed in the given number of attempts.
+    """
+    info = PuzzleInfo([None] * height, [None] * width, ships)
+    for _ in range(attempts):
+        grid = Grid(info)
+        try:
+            for length in range(len(ships), 0, -1):
+                for _ in range(ships[length - 1]):
+                    for _ in range(tries):
+                        placement = ((rng.randrange(width), rng.randrange(height)), length,
+                                     rng.random() < 0.5)
+                        if allowed_placement(placement, grid):
+                            break
+                    else:
+                        placements = find_positions(grid, length)
+                        if len(placements) == 0:
+                            raise Inconsistent()
+                        placement = rng.choice(placements)
+                    set_full_ship(placement, grid)
+        except Inconsistent:
+            continue
+        water_fill(grid)
+        return grid
+    return None
+
+def solution_clues(grid):
+    """Returns the row and column clues (rowclues, colclues) for a filled in grid"""
+    ships = grid.to_array() == SHIP
+    return np.count_nonzero(ships, axis=0).tolist(), np.count_nonzero(ships, axis=1).tolist()
+
+def cell_hint(grid, x, y):
+    """
+    Returns the initial information (see initialize) that describes cell (x, y) of a
+    filled in grid: w for water, o for a ship of length 1, <, >, ^ or v for the end
+    of a ship, or # for the middle of a ship
+    """
+    if grid.get(x, y) != SHIP:
+        return "w"
+    left, right = cell_is(x - 1, y, SHIP, grid), cell_is(x + 1, y, SHIP, grid)
+    up, down = cell_is(x, y - 1, SHIP, grid), cell_is(x, y + 1, SHIP, grid)
+    if not (left or right or up or down):
+        return "o"
+    if right and not left:
+        return "<"
+    if left and not right and not (up or down):
+        return ">"
+    if down and not up:
+        return "^"
+    if up and not down and not (left or right):
+        return "v"
+    return "#"
+
+def solution_hints(grid, fraction, rng):
+    """
+    Reveals a random fraction of the cells of a filled in grid.
+    rng is a random.Random object.
+    Returns a list of initial information (x, y, hint) for initialize.
+    """
+    return [(x, y, cell_hint(grid, x, y))
+            for y in range(grid.info.height) for x in range(grid.info.width)
+            if rng.random() < fraction]
 
 def initialize(grid, info):
     """
     Takes in an initialized grid, and applies initial information.
-    Raises Inconsistent if an inconsistency is found.
+    Raises Inconsistent if an inconsistency is found, with a message describing it
+    (nothing is printed, so that this can be used for batch work).
     """
     # Check board size
     if grid.info.height < 1 or grid.info.width < 1:
-        print("Invalid board size.")
-        raise Inconsistent
+        raise Inconsistent("Invalid board size.")
 
     # Apply initial info
     try:
@@ -295,11 +1724,11 @@ def initialize(grid, info):
                 set_ship(x, y + 1, grid)
                 set_water(x, y - 1, grid)
             else:
-                print("Error in initial data. Information '" + str(infotype) + "' unrecognised.")
-                raise Inconsistent
-    except Inconsistent:
-        print("Initial data is inconsistent. No solution possible.")
-        raise
+                raise Inconsistent("Error in initial data. Information '" + str(infotype) + "' unrecognised.")
+    except Inconsistent as e:
+        if len(e.args) > 0:
+            raise
+        raise Inconsistent("Initial data is inconsistent. No solution possible.")
 
     # Perform consistency checks
     # Compute number of ship segments
@@ -317,8 +1746,7 @@ def initialize(grid, info):
     else:
         # Make sure the row count and the ship count are in agreement
         if rowcount != shipcount:
-            print("Number of entries on rows not equal to total number of ships.")
-            raise Inconsistent
+            raise Inconsistent("Number of entries on rows not equal to total number of ships.")
 
     # Check if the column clues are all present (no None entries)
     colcount = 0
@@ -329,51 +1757,48 @@ def initialize(grid, info):
     else:
         # Make sure the column count and the ship count are in agreement
         if colcount != shipcount:
-            print("Number of entries on columns not equal to total number of ships.")
-            raise Inconsistent
+            raise Inconsistent("Number of entries on columns not equal to total number of ships.")
 
     # Validate the present board
     try:
         validate(grid)
     except Inconsistent:
-        print("Initial state is invalid.")
-        raise
+        raise Inconsistent("Initial state is invalid.")
 
 def combine_grids(states):
     """
     Takes in a number of states (typically solutions), and finds what they all
     have in common. Returns a new Grid object.
     """
-    result = states[0].clone()
+    result = Grid(states[0].info)
+    result.grid = states[0].to_array()
     for i in states[1:]:
-        result.grid &= i.grid
+        result.grid &= i.to_array()
+    result.sync()
     return result
 
 def cell_is(x, y, setting, grid):
     """Checks if a cell is a specific setting"""
     # Check for off the board first (considered water)
-    if x < 0 or x >= grid.info.width:
-        return setting == WATER
-    if y < 0 or y >= grid.info.height:
+    if (x, y) not in grid.info.topology.neighbors:
         return setting == WATER
     # Otherwise, check the grid
-    return grid.grid[x, y] == setting
+    return grid.get(x, y) == setting
 
 def set_water(x, y, grid):
     """
     Sets the (x, y) position in the grid to be water (ignore if off the board)
     Returns True if the state changed
     """
-    if x < 0 or y < 0:
+    if (x, y) not in grid.info.topology.neighbors:
         return False
-    if x >= grid.info.width or y >= grid.info.height:
-        return False
-    if grid.grid[x, y] == SHIP:
+    cell = grid.get(x, y)
+    if cell == SHIP:
         raise Inconsistent()
-    elif grid.grid[x, y] == WATER:
+    elif cell == WATER:
         return False
     else:
-        grid.grid[x, y] = WATER
+        grid.put(x, y, WATER)
         return True
 
 def set_ship(x, y, grid):
@@ -382,20 +1807,24 @@ def set_ship(x, y, grid):
     This is the only routine that should be setting any ship pieces
     Returns True if something changed
     """
-    if x < 0 or y < 0:
-        raise Inconsistent()
-    if x >= grid.info.width or y >= grid.info.height:
+    diagonals = grid.info.topology.diagonals.get((x, y))
+    if diagonals is None:
+        # Off the board
         raise Inconsistent()
-    if grid.grid[x, y] == WATER:
+    get = grid.get
+    cell = get(x, y)
+    if cell == WATER:
         raise Inconsistent()
 
-    if grid.grid[x, y] == UNKNOWN:
-        grid.grid[x, y] = SHIP
-        # Now mark diagonals with water
-        set_water(x+1, y+1, grid)
-        set_water(x-1, y+1, grid)
-        set_water(x+1, y-1, grid)
-        set_water(x-1, y-1, grid)
+    if cell == UNKNOWN:
+        grid.put(x, y, SHIP)
+        # Now mark diagonals with water (as set_water, but they are known to be on the board)
+        for cx, cy in diagonals:
+            cell = get(cx, cy)
+            if cell == SHIP:
+                raise Inconsistent()
+            elif cell == UNKNOWN:
+                grid.put(cx, cy, WATER)
         return True
     else:
         return False
@@ -406,26 +1835,18 @@ def set_full_ship(placement, grid):
     Returns True if anything changed
     """
     pos, length, horiz = placement
-    x, y = pos
+    topology = grid.info.topology
+    # The direction of a placement is its axis in the topology
+    cells = topology.ship_cells(pos, length, horiz)
+    if cells is None:
+        # Off the board
+        raise Inconsistent()
     changed = False
-    if length == 1:
-        changed = changed | set_ship(x, y, grid)
-        changed = changed | set_water(x, y - 1, grid)
-        changed = changed | set_water(x, y + 1, grid)
-        changed = changed | set_water(x + 1, y, grid)
-        changed = changed | set_water(x - 1, y, grid)
-    elif horiz:
-        # Horizontal
-        for i in range(length):
-            changed = changed | set_ship(x + i, y, grid)
-        changed = changed | set_water(x - 1, y, grid)
-        changed = changed | set_water(x + length, y, grid)
-    else:
-        # Vertical
-        for i in range(length):
-            changed = changed | set_ship(x, y + i, grid)
-        changed = changed | set_water(x, y - 1, grid)
-        changed = changed | set_water(x, y + length, grid)
+    for x, y in cells:
+        changed = set_ship(x, y, grid) | changed
+    # Close off the ends of the ship (all of the neighbours of a length 1 ship)
+    for x, y in topology.ship_ends(cells, horiz):
+        changed = set_water(x, y, grid) | changed
     return changed
 
 def water_fill(grid):
@@ -433,203 +1854,281 @@ def water_fill(grid):
     Fills all unknown squares with water
     Returns True if anything changed
     """
-    changed = False
-    for x in range(grid.info.width):
-        for y in range(grid.info.height):
-            if grid.grid[x, y] == UNKNOWN:
-                changed = True
-                grid.grid[x, y] = WATER
-    return changed
+    return grid.fill_water()
 
 def countrow(row, setting):
     """Counts the number of a given setting in a row"""
-    return np.count_nonzero(row==setting)
+    if isinstance(row, np.ndarray):
+        return np.count_nonzero(row==setting)
+    return row.count(setting)
 
 def validate(grid):
     """Make sure that the given grid is valid"""
     # Check to make sure the rows and columns are valid
-    def valid_row(row, clue):
-        if clue is None: return
-        unknownCount = countrow(row, UNKNOWN)
-        shipCount = countrow(row, SHIP)
-        if shipCount + unknownCount < clue or shipCount > clue:
-            raise Inconsistent()
-
-    for x in range(grid.info.width):
-        valid_row(grid.grid[x], grid.info.colclues[x])
-    for y in range(grid.info.height):
-        valid_row(grid.grid[:,y], grid.info.rowclues[y])
+    if not grid.counts_valid():
+        raise Inconsistent()
 
     # Check that the board doesn't have ships that are touching
     # Checking diagonals is sufficient
-    for x in range(grid.info.width):
-        for y in range(grid.info.height):
-            if grid.grid[x, y] == SHIP:
-                # Check diagonals that are below.
-                # Above diagonals will have already triggered.
-                if cell_is(x + 1, y + 1, SHIP, grid) or cell_is(x - 1, y + 1, SHIP, grid):
-                    raise Inconsistent()
+    if grid.has_contact():
+        raise Inconsistent()
 
 def find_holes(grid):
     """Returns a list of cells that are surrounded by water"""
-    holes = []
-    for y in range(grid.info.height):
-        for x in range(grid.info.width):
-            # Is this empty?
-            if grid.grid[x, y] == UNKNOWN:
-                # Check to see if there are any unknowns adjacent
-                if cell_is(x-1, y, WATER, grid) and \
-                   cell_is(x+1, y, WATER, grid) and \
-                   cell_is(x, y+1, WATER, grid) and \
-                   cell_is(x, y-1, WATER, grid):
-                    holes.append((x, y))
-
-    return holes
+    return grid.holes()
 
 def simple_logic(puzzle):
-    """Performs simple counting logic to see if each row and column can be filled"""
-    rows = puzzle.state.info.height
-    cols = puzzle.state.info.width
-
-    # List of rows and columns that aren't fully solved
-    rowlist = [True for i in range(rows)]
-    collist = [True for i in range(cols)]
-
-    changed = True
-    while changed:
-        changed = False
-
-        # Run through all the columns
-        for x in range(cols):
-            # If already fully solved, move onto the next column
-            if not collist[x]:
-                continue
+    """
+    Performs simple counting logic to see if each row and column can be filled.
+    Only the lines that have changed since they were last analyzed are looked at.
+    Raises Inconsistent if a line can no longer meet its clue.
+    """
+    state = puzzle.state
+    clues = state.info.clues
+    dirty = state.dirty
+    while dirty:
+        key = dirty.pop()
+        clue = clues[key]
+        # If the clue is unknown, there's nothing we can do
+        if clue is None:
+            continue
 
-            # If the clue is unknown, there's nothing we can do
-            clue = puzzle.state.info.colclues[x]
-            if clue is None:
-                collist[x] = False
-                continue
+        analysis = line_cache.analyze(state.line(key), clue)
+        if not analysis.valid:
+            raise Inconsistent()
 
-            line = puzzle.state.grid[x]
-            unknownCount = countrow(line, UNKNOWN)
-            if unknownCount == 0:
-                collist[x] = False
-                continue
+        # Set the rest to water or ships
+        horiz, idx = key
+        for i in analysis.water:
+            if horiz:
+                set_water(i, idx, state)
+            else:
+                set_water(idx, i, state)
+        for i in analysis.ships:
+            if horiz:
+                set_ship(i, idx, state)
+            else:
+                set_ship(idx, i, state)
 
-            shipCount = countrow(line, SHIP)
-            if shipCount == clue:
-                # Set the rest to water
-                collist[x] = False
-                changed = True
-                for y in range(rows):
-                    if line[y] == 0:
-                        set_water(x, y, puzzle.state)
-                continue
+def line_logic(puzzle):
+    """
+    Enumerates all the ways of completing each row and column that match its clue and
+    the remaining fleet, and fixes the cells that are the same in all of them.
+    Raises Inconsistent if a line cannot be completed.
+    Returns True if anything changed.
+    """
+    state = puzzle.state
+    fleet = state.info.ships
+    maxlength = len(fleet)
+
+    # Count the complete ships (from the inventory, which also counts the complete
+    # ships lying along each line). Ships of length 1 don't count towards the budget,
+    # so are ignored.
+    inventory = state.inventory
+    complete = [inventory.good[i] if 0 < i < len(inventory.good) else 0 for i in range(maxlength)]
+    along = inventory.along
+
+    def budget(key):
+        """Number of ships of each length that may lie along the given line"""
+        return tuple(fleet[i] - complete[i] + along.get((key, i + 1), 0) for i in range(maxlength))
+
+    # Only the lines that have changed need to be looked at again, unless the fleet
+    # that is left to place along them has changed. Once there are more ships of a
+    # length left than could lie along any line, the exact number doesn't matter.
+    fleetkey = tuple(min(fleet[i] - complete[i], state.info.maxruns[i]) for i in range(maxlength))
+    if fleetkey != state.settled_fleet:
+        lines = all_lines(state.info)
+        state.settled_fleet = fleetkey
+    else:
+        lines = state.unsettled
+    state.unsettled = set()
 
-            waterCount = countrow(line, WATER)
-            if waterCount + clue == len(line):
-                # Set the rest to ships
-                collist[x] = False
-                changed = True
-                for y in range(rows):
-                    if line[y] == 0:
-                        set_ship(x, y, puzzle.state)
-                continue
+    changed = False
+    for key in lines:
+        analysis = line_cache.analyze(state.line(key), state.info.clues[key])
+        if analysis.unknowns == 0:
+            continue
+        result = analysis.complete(budget(key))
+        if result is None:
+            raise Inconsistent()
+        ships, water = result
+        horiz, idx = key
+        for i in water:
+            if horiz:
+                changed = set_water(i, idx, state) or changed
+            else:
+                changed = set_water(idx, i, state) or changed
+        for i in ships:
+            if horiz:
+                changed = set_ship(i, idx, state) or changed
+            else:
+                changed = set_ship(idx, i, state) or changed
 
-        # Run through all the rows
-        for y in range(rows):
-            # If already fully solved, move onto the next row
-            if not rowlist[y]:
-                continue
+    return changed
 
-            # If the clue is unknown, there's nothing we can do
-            clue = puzzle.state.info.rowclues[y]
-            if clue is None:
-                rowlist[y] = False
-                continue
+class Probe(object):
+    """Holds a trial state, so that the logic routines can be run on it during probing"""
 
-            line = puzzle.state.grid[:,y]
-            unknownCount = countrow(line, UNKNOWN)
-            if unknownCount == 0:
-                rowlist[y] = False
-                continue
+    def __init__(self, state, options):
+        self.state = state
+        self.options = options
 
-            shipCount = countrow(line, SHIP)
-            if shipCount == clue:
-                # Set the rest to water
-                rowlist[y] = False
-                changed = True
-                for x in range(cols):
-                    if line[x] == 0:
-                        set_water(x, y, puzzle.state)
-                continue
+def propagate(puzzle):
+    """
+    Runs the deductive logic (simple logic, line logic and the fleet counts) on the
+    puzzle until nothing more changes, without guessing or filling in the final water.
+    Raises Inconsistent if the state is inconsistent.
+    """
+    fleet = puzzle.state.info.ships
+    maxlength = len(fleet)
+    while True:
+        simple_logic(puzzle)
+        goodships, badships = puzzle.state.inventory.counts(maxlength)
+        if len(goodships) > maxlength:
+            raise Inconsistent()
+        if any(goodships[i] > fleet[i] for i in range(maxlength)):
+            raise Inconsistent()
+        if not (puzzle.options.line_logic and line_logic(puzzle)):
+            return
 
-            waterCount = countrow(line, WATER)
-            if waterCount + clue == len(line):
-                # Set the rest to ships
-                rowlist[y] = False
-                changed = True
-                for x in range(cols):
-                    if line[x] == 0:
-                        set_ship(x, y, puzzle.state)
-                continue
+def probe(puzzle):
+    """
+    Failed-literal probing: for each unknown cell, tentatively set it to a ship and to
+    water on a copy of the state and propagate. If one of these is inconsistent, the
+    cell must take the other value, so it is fixed on the real state. If both are
+    consistent, any cells that come out the same either way are fixed instead.
+    Probing stops at the first cell that leads to something being fixed, or once the budget of trials
+    (options.probe_budget) or time (options.probe_time) runs out.
+    Results are cached on the state hash (see ProbeCache).
+    Raises Inconsistent if the state is inconsistent.
+    Returns True if anything changed.
+    """
+    state = puzzle.state
+    info = state.info
+    options = puzzle.options
+    key = (tuple(info.rowclues), tuple(info.colclues), tuple(info.ships), state.make_hash())
+    fixes = probe_cache.lookup(key)
+
+    if fixes is None:
+        fixes = []
+        start = time.perf_counter()
+        trials = 0
+        unknowns = np.argwhere(state.to_array() == UNKNOWN)
+        for x, y in unknowns:
+            if trials >= options.probe_budget:
+                break
+            if options.probe_time is not None and time.perf_counter() - start > options.probe_time:
+                break
+            outcomes = []
+            for value, other in ((SHIP, WATER), (WATER, SHIP)):
+                trials += 1
+                trial = Probe(state.clone(), options)
+                try:
+                    if value == SHIP:
+                        set_ship(x, y, trial.state)
+                    else:
+                        set_water(x, y, trial.state)
+                    propagate(trial)
+                except Inconsistent:
+                    fixes.append((int(x), int(y), other))
+                    break
+                outcomes.append(trial.state.to_array())
+            else:
+                # Both values are possible, but any cells that both agree on are fixed
+                original = state.to_array()
+                agreed = (outcomes[0] == outcomes[1]) & (outcomes[0] != UNKNOWN) & (original == UNKNOWN)
+                for cx, cy in np.argwhere(agreed):
+                    fixes.append((int(cx), int(cy), int(outcomes[0][cx, cy])))
+            if fixes:
+                break
+        probe_cache.probes += trials
+        probe_cache.store(key, fixes)
+
+    for x, y, value in fixes:
+        if value == SHIP:
+            set_ship(x, y, state)
+        else:
+            set_water(x, y, state)
+    return len(fixes) > 0
 
 def find_allowed(length, line, clue):
     """
     Finds allowed positions for a ship on a line
     Such positions must include the placement of a new ship tile
+    The analysis of the line is cached (see LineCache)
     """
-    # Check the length isn't too long for the line
-    if clue is not None and clue < length:
-        return []
-    # Check that there are still empty cells available
-    unknowns = countrow(line, UNKNOWN)
-    if unknowns == 0:
-        return []
-
-    result = []
-    ships = countrow(line, SHIP)
-    # Run through all possible start positions, and see if they're valid
-    for start in range(0, len(line) - length + 1):
-        # Check to make sure we're not making a longer ship than we want.
-        if start > 0 and line[start - 1] == SHIP:
-            continue
-        if start + length < len(line) and line[start + length] == SHIP:
-            continue
-        # Is there water in the segment?
-        segment = line[start:start + length]
-        if WATER in segment:
-            continue
-        # How many unknowns are in the segment?
-        unknowns = np.count_nonzero(segment == 0)
-        if unknowns == 0:
-            continue
-        # Check to make sure we haven't put too many ships on this line.
-        if clue is not None and ships + unknowns > clue:
-            continue
-        # Looks feasible. Add it to the list
-        result.append(start)
-    return result
+    return line_cache.analyze(line, clue).allowed(length)
 
 def allowed_placement(placement, grid):
     """
     Check that we're allowed to place a ship at the given placement on the grid.
     Only return True if this placement actually places another ship piece.
+
+    Assuming that the grid is currently valid, this gives the same result as placing
+    the ship on a clone of the grid and validating the whole board, but only looks at
+    the box of cells around the ship (which all become ship or water), and the clues
+    of the rows and columns that the box lies in.
     """
-    tempgrid = grid.clone()
-    try:
-        # Check that the ship can be placed here
-        changed = set_full_ship(placement, tempgrid)
-        # Check that putting the ship here actually changes something
-        if not changed:
-            return False
-        # Check that the resulting grid is valid
-        validate(tempgrid)
-        return True
-    except Inconsistent:
+    pos, length, horiz = placement
+    x, y = pos
+    width = grid.info.width
+    height = grid.info.height
+    get = grid.get
+    # The ship covers columns x to x1 - 1 and rows y to y1 - 1, which must be on the board
+    if horiz:
+        x1, y1 = x + length, y + 1
+    else:
+        x1, y1 = x + 1, y + length
+    if x < 0 or y < 0 or x1 > width or y1 > height:
+        return False
+
+    # The ship must not overlap water
+    for cx in range(x, x1):
+        for cy in range(y, y1):
+            if get(cx, cy) == WATER:
+                return False
+
+    # Every unknown cell in the box becomes a ship (in the ship) or water (around it).
+    # Count the changes to the number of ships and unknowns in each column and row.
+    left, top = max(x - 1, 0), max(y - 1, 0)
+    right, bottom = min(x1 + 1, width), min(y1 + 1, height)
+    colships = [0] * (right - left)
+    colunknowns = [0] * (right - left)
+    rowships = [0] * (bottom - top)
+    rowunknowns = [0] * (bottom - top)
+    changed = False
+    for cx in range(left, right):
+        inship = x <= cx < x1
+        for cy in range(top, bottom):
+            cell = get(cx, cy)
+            if cell == UNKNOWN:
+                changed = True
+                colunknowns[cx - left] += 1
+                rowunknowns[cy - top] += 1
+                if inship and y <= cy < y1:
+                    colships[cx - left] += 1
+                    rowships[cy - top] += 1
+            elif cell == SHIP and not (inship and y <= cy < y1):
+                # The cells around the ship must not contain ships
+                return False
+
+    # Check that putting the ship here actually changes something
+    if not changed:
         return False
 
+    # Check that the affected rows and columns can still satisfy their clues
+    for start, ships, unknowns, clues, count in (
+            (left, colships, colunknowns, grid.info.colclues, grid.count_column),
+            (top, rowships, rowunknowns, grid.info.rowclues, grid.count_row)):
+        for i in range(len(ships)):
+            clue = clues[start + i]
+            if clue is None:
+                continue
+            total = count(start + i, SHIP) + ships[i]
+            if total > clue or total + count(start + i, UNKNOWN) - unknowns[i] < clue:
+                return False
+    return True
+
 def find_positions(grid, length):
     """
     Finds possible positions for a ship of a given length on the grid
@@ -639,7 +2138,7 @@ def find_positions(grid, length):
 
     # Search columns first
     for x in range(grid.info.width):
-        mylist = find_allowed(length, grid.grid[x], grid.info.colclues[x])
+        mylist = find_allowed(length, grid.column(x), grid.info.colclues[x])
         # We have a list of possible starting positions.
         # Make sure they're actually valid places to put a ship.
         for y in mylist:
@@ -651,7 +2150,7 @@ def find_positions(grid, length):
     if length > 1:
         # Search rows next
         for y in range(grid.info.height):
-            mylist = find_allowed(length, grid.grid[:, y], grid.info.rowclues[y])
+            mylist = find_allowed(length, grid.row(y), grid.info.rowclues[y])
             # We have a list of possible starting positions that don't break the row.
             # Check which ones are actually valid.
             for x in mylist:
@@ -661,6 +2160,59 @@ def find_positions(grid, length):
 
     return position_list
 
+def placement_key(placement):
+    """
+    Returns a key describing where a placement (pos, length, horiz) puts its ship.
+    Ships of length 1 have no direction, so all placements of them are vertical.
+    """
+    pos, length, horiz = placement
+    return pos, length, horiz and length > 1
+
+def placement_cells(placement, grid):
+    """Returns the unknown cells that a placement would turn into ship"""
+    pos, length, horiz = placement
+    cells = grid.info.topology.ship_cells(pos, length, horiz)
+    return [(cx, cy) for cx, cy in cells if grid.get(cx, cy) == UNKNOWN]
+
+def clue_units(placement, grid):
+    """Counts the number of outstanding clue units that a placement would fill"""
+    units = 0
+    for x, y in placement_cells(placement, grid):
+        if grid.info.colclues[x] is not None:
+            units += 1
+        if grid.info.rowclues[y] is not None:
+            units += 1
+    return units
+
+def freedom(placement, grid):
+    """
+    Finds the most constrained row or column that a placement would add ships to.
+    Returns the number of unknown cells in that line that must end up as water
+    (lines with unknown clues aren't constrained).
+    """
+    result = grid.info.width + grid.info.height
+    for x, y in placement_cells(placement, grid):
+        clue = grid.info.colclues[x]
+        if clue is not None:
+            result = min(result, grid.count_column(x, UNKNOWN) - clue + grid.count_column(x, SHIP))
+        clue = grid.info.rowclues[y]
+        if clue is not None:
+            result = min(result, grid.count_row(y, UNKNOWN) - clue + grid.count_row(y, SHIP))
+    return result
+
+def order_placements(placements, grid, ordering):
+    """
+    Order a list of placements to guess, according to the given ordering:
+      scan: the order they were found in (columns, then rows)
+      constrained: placements in the most constrained row or column first
+      clues: placements that fill the most outstanding clue units first
+    """
+    if ordering == "constrained":
+        return sorted(placements, key=lambda placement: freedom(placement, grid))
+    if ordering == "clues":
+        return sorted(placements, key=lambda placement: -clue_units(placement, grid))
+    return placements
+
 def find_ships(grid):
     """
     Identify the position of all ships (both complete and incomplete) on the grid
@@ -668,66 +2220,13 @@ def find_ships(grid):
 
     Good ships are ones that are surrounded by water (length is known)
     Bad ships are ship segments whose final length is unknown
-    """
-    working = np.zeros_like(grid.grid)
-    numships = 0
-
-    # Run through the grid and number all ships
-    for x in range(grid.info.width):
-        for y in range(grid.info.height):
-            if grid.grid[x, y] == SHIP:
-                # Check to see if it's next to a known ship
-                if x > 0 and working[x - 1, y] != 0:
-                    working[x, y] = working[x - 1, y]
-                    continue
-                if y > 0 and working[x, y - 1] != 0:
-                    working[x, y] = working[x, y - 1]
-                    continue
-                # Not next to a marked ship, so make a new ship
-                numships += 1
-                working[x, y] = numships
-
-    # Find the lengths and positions of each ship, as well as if it's surrounded by water
-    shiplengths = [0 for _ in range(numships)]
-    shippos = [None for _ in range(numships)]  # top left corner of ship
-    goodship = [True for _ in range(numships)]
-    for x in range(grid.info.width):
-        for y in range(grid.info.height):
-            if working[x, y] > 0:
-                if shiplengths[working[x, y] - 1] == 0:
-                    shippos[working[x, y] - 1] = (x, y)
-                shiplengths[working[x, y] - 1] += 1
-                # Check to see if there are any unknowns adjacent
-                if cell_is(x-1, y, UNKNOWN, grid) or \
-                   cell_is(x+1, y, UNKNOWN, grid) or \
-                   cell_is(x, y+1, UNKNOWN, grid) or \
-                   cell_is(x, y-1, UNKNOWN, grid):
-                    goodship[working[x, y] - 1] = False
-    if numships > 0:
-        longestship = max(shiplengths)
-    else:
-        longestship = 0
-
-    shiphoriz = [True for _ in range(numships)]
-    longestship = max(longestship, len(grid.info.ships))
-    reportgood = [0 for i in range(longestship)]
-    reportbad = [0 for i in range(longestship)]
-    for i in range(numships):
-        # Figure out the ship direction
-        x, y = shippos[i]
-        if cell_is(x, y+1, SHIP, grid):
-            shiphoriz[i] = False
-        # Add to the number of appropriate ship lengths
-        if goodship[i]:
-            reportgood[shiplengths[i] - 1] += 1
-        else:
-            reportbad[shiplengths[i] - 1] += 1
 
+    The ships are read from the grid's inventory, which is kept up to date as cells
+    are set, so this does not need to scan the grid.
+    """
+    reportgood, reportbad = grid.inventory.counts(len(grid.info.ships))
     # Make an inventory of each ship: ((x, y), length, horiz, surrounded)
-    ships = [
-             (shippos[i], shiplengths[i], shiphoriz[i], goodship[i])
-             for i in range(numships)
-            ]
+    ships = grid.inventory.ships()
 
     # Return all information
     return [reportgood, reportbad, ships]
@@ -4,13 +4,22 @@
 Battleships/Bimaru solver
 
 Run as:
-python battleships.py puzzlefile
+python battleships.py puzzlefile [--consensus] [--format ansi|plain|compact]
 See below for description of file format for puzzles
 
+With --consensus, solutions are not printed (or stored) individually. Instead, the
+number of solutions, the cells they all have in common, and the percentage of
+solutions with a ship in each cell are reported. Use this for puzzles with very
+many solutions.
+
+With --format, boards are drawn in color (ansi, the default), without color (plain),
+or as a single line each (compact). All of the solutions are written at once.
+
 Jolyon Bloomfield, Jan 2018
 """
 import sys
-from battleshiplib import Inconsistent, run, combine_grids
+import argparse
+from battleshiplib import Inconsistent, run, combine_grids, load_puzzle, Consensus, write_grids, FORMATS
 
 print("**************************************************************")
 print("*                     Battleships Solver                     *")
@@ -48,73 +57,57 @@ print("**************************************************************")
 6, 9, <
 """
 
-# Get the command line argument
-try:
-    filename = sys.argv[1]
-except:
-    print("Specify the puzzle file to solve as a command line argument. Eg, puzzle1")
-    sys.exit()
+# Get the command line arguments
+parser = argparse.ArgumentParser(description="Solve a battleships puzzle")
+parser.add_argument("puzzlefile", help="the puzzle file to solve, eg, puzzle1")
+parser.add_argument("--consensus", action="store_true",
+                    help="report what the solutions have in common rather than each solution")
+parser.add_argument("--format", choices=FORMATS, default="ansi", help="how to draw the boards")
+args = parser.parse_args()
+filename = args.puzzlefile
 
 # Get the data out of that file
-data = []
 try:
-    with open(filename) as f:
-        for line in f:
-            line = line.strip()
-            if len(line) > 0 and line[0] != "#":
-                data.append(line)
-except:
+    rowclues, colclues, ships, initinfo = load_puzzle(filename)
+except IOError:
     print("Unable to read", filename)
     sys.exit(1)
-
-# Interpret the data
-if len(data) < 3:
-    print("File does not seem to describe a puzzle")
-    sys.exit()
-# Extract row clues
-rowclues = data[0].split(",")
-rowclues = map(lambda x: x.strip(), rowclues)
-rowclues = [int(i) if i != "?" else None for i in rowclues]
-# Extract column clues
-colclues = data[1].split(",")
-colclues = map(lambda x: x.strip(), colclues)
-colclues = [int(i) if i != "?" else None for i in colclues]
-# Extract number of ships
-ships = data[2].split(",")
-ships = map(lambda x: x.strip(), ships)
-ships = list(map(int, ships))
-# Extract initial information
-initinfo = []
-for i in data[3:]:
-    tokens = i.split(",")
-    tokens = list(map(lambda x: x.strip(), tokens))
-    if len(tokens) != 3:
-        print("Unable to interpret line:", i)
-        sys.exit(1)
-    x, y, value = tokens
-    initinfo.append((int(x), int(y), value))
+except ValueError as e:
+    print(e.args[0])
+    sys.exit(1)
 
 
 ### SOLVE THE PUZZLE ###
 
 try:
-    results, guesses = run(rowclues, colclues, initinfo, ships, debug=False)
+    results, guesses = run(rowclues, colclues, initinfo, ships, debug=False,
+                           solutionlist=Consensus() if args.consensus else None)
     print()
-except Inconsistent:
+except Inconsistent as e:
+    if len(e.args) > 0:
+        print(e.args[0])
     print("Unable to solve.")
 else:
+    if args.consensus and len(results) > 1:
+        print("Found {} solutions in {} guesses.".format(len(results), guesses))
+        print()
+        print("The cells that all solutions have in common are the following:")
+        results.common().pretty_print(args.format)
+        print()
+        print("Percentage of solutions with a ship in each cell:")
+        print(results.heatmap())
+        sys.exit()
+
     # Print all solutions
     if len(results) == 0:
         print("Unable to find any solutions (used {} guesses).".format(guesses))
     elif len(results) == 1:
         print("Found a unique solution in {} guesses.".format(guesses))
         print()
-        results[0].pretty_print()
+        (results.first if args.consensus else results[0]).pretty_print(args.format)
     else:
-        for idx, soln in enumerate(results):
-            print("Solution #{}:".format(idx+1))
-            soln.pretty_print()
-            print()
+        write_grids(results, args.format,
+                    titles=["Solution #{}:".format(idx+1) for idx in range(len(results))])
         print("Found {} solutions in {} guesses.".format(len(results), guesses))
         print()
 
@@ -123,4 +116,4 @@ else:
         for sol in results[1:]:
             combinedgrid = combinedgrid & sol.grid
         print("The cells that all solutions have in common are the following:")
-        combine_grids(results).pretty_print()
+        combine_grids(results).pretty_print(args.format)
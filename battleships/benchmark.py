@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark the battleships solvers against each other
+
+Solves puzzles with the guessing solver (battleshiplib.run, built on
+framework.PuzzleSolver) and the exact cover solver (exactcover.solve), checks that
+they find the same solutions, and reports the time each takes, along with the number
+of guesses made by the guessing solver and the time it spends per guess.
+
+Puzzles are read from files, and can also be generated at random: a fleet (scaled
+from 4, 3, 2 and 1 ships on a 10x10 board) is placed on a board of each size, and a
+fraction of its cells are revealed as initial information. With little revealed,
+large boards have very many solutions, so reveal more of the board as it grows.
+
+Run as:
+python benchmark.py [puzzlefile ...] [--sizes N ...] [--count N] [--reveal F] [--seed N]
+                    [--solvers framework exactcover]
+"""
+import sys
+import time
+import random
+import argparse
+from battleshiplib import Inconsistent, BranchStats, Consensus, run, load_puzzle
+from battleshiplib import random_solution, solution_clues, solution_hints
+import exactcover
+
+SOLVERS = ("framework", "exactcover")
+
+def default_fleet(width, height):
+    """A fleet for the given board size, scaled from 4, 3, 2, 1 ships on a 10x10 board"""
+    scale = width * height / 100
+    return [max(1, round(count * scale)) for count in (4, 3, 2, 1)]
+
+def generate(sizes, count, seed=None, reveal=0.0):
+    """
+    Generate count random puzzles of each size, revealing the given fraction of cells.
+    Returns a list of (name, (rowclues, colclues, ships, initinfo)).
+    """
+    rng = random.Random(seed)
+    puzzles = []
+    for size in sizes:
+        ships = default_fleet(size, size)
+        for idx in range(count):
+            solution = random_solution(size, size, ships, rng)
+            if solution is None:
+                continue
+            rowclues, colclues = solution_clues(solution)
+            initinfo = solution_hints(solution, reveal, rng)
+            puzzles.append(("random{}x{}-{}".format(size, size, idx),
+                            (rowclues, colclues, ships, initinfo)))
+    return puzzles
+
+def solve_framework(rowclues, colclues, ships, initinfo):
+    """
+    Solve a puzzle with the guessing solver, folding the solutions into a Consensus.
+    Returns the consensus, the number of guesses made and the time taken.
+    """
+    stats = BranchStats()
+    start = time.time()
+    try:
+        solutions, _ = run(rowclues, colclues, initinfo, ships, verbose=False, stats=stats,
+                           solutionlist=Consensus())
+    except Inconsistent:
+        solutions = Consensus()
+    return solutions, stats.nodes, time.time() - start
+
+def solve_exactcover(rowclues, colclues, ships, initinfo):
+    """
+    Solve a puzzle with the exact cover solver.
+    Returns the consensus of the solutions and the time taken.
+    """
+    start = time.time()
+    solutions = Consensus()
+    try:
+        for solution in exactcover.solve(rowclues, colclues, initinfo, ships):
+            solutions.append(solution)
+    except Inconsistent:
+        pass
+    return solutions, time.time() - start
+
+def agree(first, second):
+    """Checks if two consensus objects describe the same set of solutions"""
+    if len(first) != len(second):
+        return False
+    if len(first) == 0:
+        return True
+    return (first.ships == second.ships).all() and (first.water == second.water).all()
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the battleships solvers")
+    parser.add_argument("puzzlefiles", nargs="*", help="puzzle files to solve")
+    parser.add_argument("--sizes", type=int, nargs="*", default=[],
+                        help="sizes of random boards to generate")
+    parser.add_argument("--count", type=int, default=3, help="number of boards of each size")
+    parser.add_argument("--reveal", type=float, default=0.0,
+                        help="fraction of the cells of random boards to reveal")
+    parser.add_argument("--seed", type=int, default=None, help="random seed")
+    parser.add_argument("--solvers", nargs="+", choices=SOLVERS, default=list(SOLVERS),
+                        help="solvers to run")
+    args = parser.parse_args()
+
+    puzzles = []
+    for filename in args.puzzlefiles:
+        try:
+            puzzles.append((filename, load_puzzle(filename)))
+        except (IOError, ValueError) as e:
+            print("Unable to read {}: {}".format(filename, e))
+            sys.exit(1)
+    puzzles += generate(args.sizes, args.count, args.seed, args.reveal)
+
+    totals = [0.0, 0.0]
+    print("{:20} {:>9} {:>10} {:>8} {:>8} {:>10}  {}".format(
+        "puzzle", "solutions", "framework", "guesses", "ms/guess", "exactcover", ""))
+    for name, (rowclues, colclues, ships, initinfo) in puzzles:
+        results = {}
+        columns = ["", "", "", ""]
+        if "framework" in args.solvers:
+            results["framework"], nodes, ftime = solve_framework(rowclues, colclues, ships, initinfo)
+            columns[0:3] = ["{:.3f}".format(ftime), nodes,
+                            "{:.3f}".format(1000 * ftime / nodes) if nodes else ""]
+            totals[0] += ftime
+        if "exactcover" in args.solvers:
+            results["exactcover"], ctime = solve_exactcover(rowclues, colclues, ships, initinfo)
+            columns[3] = "{:.3f}".format(ctime)
+            totals[1] += ctime
+        solutions = list(results.values())
+        differ = len(solutions) == 2 and not agree(*solutions)
+        print("{:20} {:>9} {:>10} {:>8} {:>8} {:>10}  {}".format(
+            name, len(solutions[0]), *columns, "SOLUTIONS DIFFER" if differ else ""))
+    print("{:20} {:>9} {:>10.3f} {:>8} {:>8} {:>10.3f}".format("total", "", totals[0], "", "", totals[1]))
+
+if __name__ == "__main__":
+    main()
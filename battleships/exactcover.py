@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Battleships/Bimaru solver via an exact cover encoding
+
+An alternative to the guessing solver in battleshiplib.py. The puzzle is encoded
+as an exact cover problem with multiplicities, which is solved by links.WeightedDLX.
+The rows of the matrix are
+--- Every legal placement of a ship
+--- A water row for every cell that isn't known to be a ship
+and the columns are
+--- Each cell has a primary column, which must be covered exactly once, either by a
+    ship or by its water row
+--- Each length of ship has a primary column, which needs as many placements as there
+    are ships of that length
+--- Each row and column of the board with a known clue has a primary column, which
+    needs as many water rows as there are cells that aren't ships
+--- Each 2x2 block of cells has a secondary column, which can be covered by at most
+    one placement. Two ships touch (even diagonally) if and only if they share a block,
+    so this prevents ships from touching.
+When a line has all the water it needs, the rest of its cells are forced to be ships,
+and when a cell can only be water it is forced to be water, so the solver performs
+the same simple logic as the guessing solver before it branches. It then branches on
+the cells known to be ships, then on the longest ships in the fleet.
+
+Run as:
+python exactcover.py puzzlefile
+(See battleships.py for the file format)
+"""
+import sys
+from links import WeightedDLX
+from battleshiplib import (Grid, PuzzleInfo, Inconsistent, initialize, set_full_ship, water_fill,
+                           load_puzzle, combine_grids, write_grids, SHIP, WATER)
+
+def placement_cells(placement):
+    """Returns the cells covered by a placement"""
+    (x, y), length, horiz = placement
+    return [(x + i, y) if horiz else (x, y + i) for i in range(length)]
+
+def find_placements(grid):
+    """
+    Find every placement of every ship in the fleet that stays on the board, doesn't
+    cover any water, and doesn't put too many ships in a row or column
+    """
+    info = grid.info
+    result = []
+    for length in range(1, len(info.ships) + 1):
+        if info.ships[length - 1] == 0:
+            continue
+        for horiz in ([True] if length == 1 else [True, False]):
+            for x in range(info.width - (length - 1 if horiz else 0)):
+                for y in range(info.height - (0 if horiz else length - 1)):
+                    placement = ((x, y), length, horiz)
+                    cells = placement_cells(placement)
+                    if any(grid.get(cx, cy) == WATER for cx, cy in cells):
+                        continue
+                    if horiz:
+                        if info.rowclues[y] is not None and info.rowclues[y] < length:
+                            continue
+                        if any(info.colclues[cx] == 0 for cx, _ in cells):
+                            continue
+                    else:
+                        if info.colclues[x] is not None and info.colclues[x] < length:
+                            continue
+                        if any(info.rowclues[cy] == 0 for _, cy in cells):
+                            continue
+                    result.append(placement)
+    return result
+
+def build_matrix(grid):
+    """Construct the exact cover matrix for a grid containing the initial information"""
+    info = grid.info
+    needs = []
+    priorities = []
+    columns = {}
+
+    def add_column(key, need, priority):
+        columns[key] = len(needs)
+        needs.append(need)
+        priorities.append(priority)
+
+    # Branch on the cells known to be ships first, then on the fleet, longest ships
+    # first, and then on everything else
+    maxlength = len(info.ships)
+    # Cells
+    for x in range(info.width):
+        for y in range(info.height):
+            add_column(("cell", x, y), 1, 0 if grid.get(x, y) == SHIP else maxlength + 1)
+    # Fleet slots
+    for length in range(1, maxlength + 1):
+        if info.ships[length - 1] > 0:
+            add_column(("ships", length), info.ships[length - 1], maxlength + 1 - length)
+    # Water in each row and column
+    for y, clue in enumerate(info.rowclues):
+        if clue is not None:
+            add_column(("row", y), info.width - clue, maxlength + 1)
+    for x, clue in enumerate(info.colclues):
+        if clue is not None:
+            add_column(("col", x), info.height - clue, maxlength + 1)
+
+    # Secondary columns for each 2x2 block (clipped to the board if it is only one cell wide)
+    blockwidth = max(info.width - 1, 1)
+    blockheight = max(info.height - 1, 1)
+    links = WeightedDLX(needs, blockwidth * blockheight, priorities)
+
+    def blocks(x, y):
+        """Returns the secondary columns for the blocks containing a cell"""
+        return {len(needs) + bx * blockheight + by
+                for bx in (x - 1, x) if 0 <= bx < blockwidth
+                for by in (y - 1, y) if 0 <= by < blockheight}
+
+    for placement in find_placements(grid):
+        (x, y), length, horiz = placement
+        cols = [columns[("ships", length)]]
+        secondary = set()
+        for cx, cy in placement_cells(placement):
+            cols.append(columns[("cell", cx, cy)])
+            secondary |= blocks(cx, cy)
+        links.add_row(cols + sorted(secondary), ("ship", placement))
+
+    for x in range(info.width):
+        for y in range(info.height):
+            if grid.get(x, y) == SHIP:
+                continue
+            cols = [columns[("cell", x, y)]]
+            for key in (("row", y), ("col", x)):
+                if key in columns:
+                    cols.append(columns[key])
+            links.add_row(cols, ("water", (x, y)))
+    return links
+
+def solve(rowclues, colclues, initinfo, ships, limit=None, stats=None):
+    """
+    Solve a puzzle, given the row and column clues, initial board, and ship list.
+    If limit is given, stop once that many solutions have been found.
+    If stats is a links.SearchStats object, statistics about the search are recorded in it.
+    Returns a list of solutions (as Grid objects).
+    Raises Inconsistent if the initial information is inconsistent.
+    """
+    grid = Grid(PuzzleInfo(rowclues, colclues, ships))
+    initialize(grid, initinfo)
+    links = build_matrix(grid)
+
+    solutions = []
+    for rows in links.run(limit=limit, stats=stats):
+        solution = grid.clone()
+        for kind, placement in rows:
+            if kind == "ship":
+                set_full_ship(placement, solution)
+        water_fill(solution)
+        solutions.append(solution)
+    return solutions
+
+def main():
+    print("Battleships Solver (exact cover)")
+    if len(sys.argv) < 2:
+        print("Specify the puzzle file to solve as a command line argument. Eg, puzzle1")
+        sys.exit()
+    try:
+        rowclues, colclues, ships, initinfo = load_puzzle(sys.argv[1])
+    except IOError:
+        print("Unable to read", sys.argv[1])
+        sys.exit(1)
+    except ValueError as e:
+        print(e.args[0])
+        sys.exit(1)
+
+    try:
+        results = solve(rowclues, colclues, initinfo, ships)
+    except Inconsistent as e:
+        if len(e.args) > 0:
+            print(e.args[0])
+        print("Unable to solve.")
+        return
+
+    if len(results) == 0:
+        print("Unable to find any solutions.")
+    elif len(results) == 1:
+        print("Found a unique solution.")
+        print()
+        results[0].pretty_print()
+    else:
+        write_grids(results, titles=["Solution #{}:".format(idx+1) for idx in range(len(results))])
+        print("Found {} solutions.".format(len(results)))
+        print()
+        print("The cells that all solutions have in common are the following:")
+        combine_grids(results).pretty_print()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Battleships puzzle generator
+
+Generates puzzles with unique solutions as follows:
+--- Place a random fleet on an empty board, and take the row and column clues from it
+--- Search for two solutions to the clues alone. While there is more than one, reveal
+    a cell (as initial information: w, o, <, >, ^, v or #) that one of the solutions
+    found gets wrong, and search again
+--- Remove the revealed cells in a random order, putting back any removal that makes
+    the solution non-unique
+--- Uniqueness is checked with battleshiplib.run, using a search that stops as soon as
+    it finds a second solution
+
+Run as:
+python generator.py [count] [--width W] [--height H] [--ships 4,3,2,1]
+                    [--processes N] [--seed SEED] [--output DIRECTORY]
+
+Puzzles are printed in the file format that battleships.py reads, separated by blank
+lines, or written to DIRECTORY as puzzle files named generated1, generated2, ...
+The number of puzzles generated per minute is reported at the end.
+"""
+import os
+import sys
+import time
+import random
+import argparse
+from multiprocessing import Pool
+from battleshiplib import run, random_solution, solution_clues, cell_hint, format_puzzle
+
+def find_solutions(rowclues, colclues, initinfo, ships, limit=2):
+    """Find the solutions to a puzzle, stopping once limit solutions have been found"""
+    solutions, _ = run(rowclues, colclues, initinfo, ships, verbose=False, max_solutions=limit)
+    return solutions
+
+def add_hints(grid, rowclues, colclues, ships, rng, initinfo=()):
+    """
+    Reveal cells of a filled in grid until its clues and the revealed cells have a
+    unique solution. Each cell revealed is chosen at random from the cells that some
+    other solution gets wrong, so that solution is ruled out.
+    Returns the list of initial information.
+    """
+    initinfo = list(initinfo)
+    target = grid.to_array()
+    while True:
+        solutions = find_solutions(rowclues, colclues, initinfo, ships)
+        wrong = set()
+        for solution in solutions:
+            xs, ys = (solution.to_array() != target).nonzero()
+            wrong.update(zip(xs.tolist(), ys.tolist()))
+        if len(wrong) == 0:
+            # The only solution found is the grid itself
+            return initinfo
+        x, y = rng.choice(sorted(wrong))
+        initinfo.append((x, y, cell_hint(grid, x, y)))
+
+def remove_hints(rowclues, colclues, ships, initinfo, rng):
+    """
+    Remove initial information in a random order, keeping the solution unique.
+    Returns the remaining initial information.
+    """
+    order = list(initinfo)
+    rng.shuffle(order)
+    kept = set(order)
+    for hint in order:
+        kept.discard(hint)
+        remaining = [i for i in initinfo if i in kept]
+        if len(find_solutions(rowclues, colclues, remaining, ships)) != 1:
+            # Removing this hint loses uniqueness; put it back
+            kept.add(hint)
+    return [i for i in initinfo if i in kept]
+
+def generate(seed=None, width=10, height=10, ships=(4, 3, 2, 1), minimize=True):
+    """
+    Generate a puzzle with a unique solution.
+    ships gives the number of ships of each length (shortest first).
+    minimize removes any revealed cells that are not needed for uniqueness.
+    Returns (rowclues, colclues, ships, initinfo), or None if the fleet doesn't fit.
+    """
+    rng = random.Random(seed)
+    ships = list(ships)
+    grid = random_solution(width, height, ships, rng)
+    if grid is None:
+        return None
+    rowclues, colclues = solution_clues(grid)
+    initinfo = add_hints(grid, rowclues, colclues, ships, rng)
+    if minimize:
+        initinfo = remove_hints(rowclues, colclues, ships, initinfo, rng)
+    return rowclues, colclues, ships, initinfo
+
+def _generate(args):
+    """Helper for generate_many: unpacks arguments for use with a process pool"""
+    return generate(*args)
+
+def generate_many(count, width=10, height=10, ships=(4, 3, 2, 1), minimize=True,
+                  processes=None, seed=None):
+    """
+    Generate count puzzles in parallel over a pool of processes (defaults to all cores).
+    Yields puzzles as they are produced.
+    """
+    rng = random.Random(seed)
+    jobs = [(rng.getrandbits(64), width, height, ships, minimize) for _ in range(count)]
+    with Pool(processes) as pool:
+        for puzzle in pool.imap_unordered(_generate, jobs):
+            if puzzle is not None:
+                yield puzzle
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate battleships puzzles with unique solutions")
+    parser.add_argument("count", type=int, nargs="?", default=1, help="number of puzzles to generate")
+    parser.add_argument("--width", type=int, default=10, help="width of the board")
+    parser.add_argument("--height", type=int, default=10, help="height of the board")
+    parser.add_argument("--ships", default="4,3,2,1",
+                        help="number of ships of each length, shortest first (default 4,3,2,1)")
+    parser.add_argument("--keep-hints", action="store_true",
+                        help="don't remove revealed cells that aren't needed for uniqueness")
+    parser.add_argument("--processes", type=int, default=None,
+                        help="number of processes to use (defaults to all cores)")
+    parser.add_argument("--seed", type=int, default=None, help="random seed")
+    parser.add_argument("--output", default=None,
+                        help="directory to write puzzle files to (defaults to printing them)")
+    args = parser.parse_args()
+
+    try:
+        ships = [int(i) for i in args.ships.split(",")]
+    except ValueError:
+        print("Unable to interpret ships:", args.ships)
+        sys.exit(1)
+    if args.output is not None:
+        os.makedirs(args.output, exist_ok=True)
+
+    start = time.time()
+    generated = 0
+    for puzzle in generate_many(args.count, args.width, args.height, ships,
+                                not args.keep_hints, args.processes, args.seed):
+        generated += 1
+        text = format_puzzle(*puzzle)
+        if args.output is None:
+            if generated > 1:
+                print()
+            print(text, end="")
+        else:
+            with open(os.path.join(args.output, "generated{}".format(generated)), "w") as f:
+                f.write(text)
+    elapsed = time.time() - start
+
+    rate = 60 * generated / elapsed if elapsed > 0 else 0
+    print("Generated {} of {} puzzles in {:.2f}s ({:.1f} puzzles/minute)".format(
+        generated, args.count, elapsed, rate), file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1 @@
+../links.py
\ No newline at end of file
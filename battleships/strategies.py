@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Compare branching strategies for the battleships solver
+
+Solves each puzzle with every combination of branching strategy (which length of
+ship to guess on) and ordering (which placements to guess first), and reports the
+number of guessing nodes, the total number of branches, and the time taken, so that
+the strategy that minimizes the search on a corpus of puzzles can be chosen.
+
+Run as:
+python strategies.py puzzlefile [puzzlefile ...] [--branching B ...] [--ordering O ...]
+"""
+import sys
+import time
+import argparse
+from battleshiplib import (Inconsistent, run, load_puzzle, SolverOptions, BranchStats,
+                           BRANCHINGS, ORDERINGS)
+
+def compare(puzzles, branchings=BRANCHINGS, orderings=ORDERINGS, probing=False):
+    """
+    Solve each puzzle with each combination of branching and ordering.
+    puzzles is a list of (name, (rowclues, colclues, ships, initinfo)).
+    Yields (name, branching, ordering, number of solutions, BranchStats, time taken).
+    """
+    for name, (rowclues, colclues, ships, initinfo) in puzzles:
+        for branching in branchings:
+            for ordering in orderings:
+                options = SolverOptions(branching=branching, ordering=ordering, probing=probing)
+                stats = BranchStats()
+                start = time.time()
+                try:
+                    results, _ = run(rowclues, colclues, initinfo, ships, options=options,
+                                     stats=stats, verbose=False)
+                except Inconsistent:
+                    results = []
+                yield name, branching, ordering, len(results), stats, time.time() - start
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare branching strategies for battleships")
+    parser.add_argument("puzzlefiles", nargs="+", help="puzzle files to solve")
+    parser.add_argument("--branching", nargs="+", choices=BRANCHINGS, default=BRANCHINGS,
+                        help="branching strategies to compare")
+    parser.add_argument("--ordering", nargs="+", choices=ORDERINGS, default=ORDERINGS,
+                        help="placement orderings to compare")
+    parser.add_argument("--probing", action="store_true", help="probe cells before guessing")
+    args = parser.parse_args()
+
+    puzzles = []
+    for filename in args.puzzlefiles:
+        try:
+            puzzles.append((filename, load_puzzle(filename)))
+        except (IOError, ValueError) as e:
+            print("Unable to read {}: {}".format(filename, e))
+            sys.exit(1)
+
+    totals = {}
+    print("{:20} {:10} {:12} {:>9} {:>8} {:>9} {:>9}".format(
+        "puzzle", "branching", "ordering", "solutions", "nodes", "branches", "time"))
+    for name, branching, ordering, solutions, stats, elapsed in compare(
+            puzzles, args.branching, args.ordering, args.probing):
+        print("{:20} {:10} {:12} {:9} {:8} {:9} {:9.3f}".format(
+            name, branching, ordering, solutions, stats.nodes, stats.branches, elapsed))
+        total = totals.setdefault((branching, ordering), [0, 0, 0.0])
+        total[0] += stats.nodes
+        total[1] += stats.branches
+        total[2] += elapsed
+
+    print()
+    print("Totals (fewest nodes first):")
+    for (branching, ordering), (nodes, branches, elapsed) in sorted(totals.items(),
+                                                                  key=lambda item: item[1]):
+        print("{:20} {:10} {:12} {:9} {:8} {:9} {:9.3f}".format(
+            "", branching, ordering, "", nodes, branches, elapsed))
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,25 @@
 """
 Unit tests running on battleshiplib.py
 """
+import os
+import gc
+import json
+import random
+import weakref
 
-from battleshiplib import run
+from battleshiplib import run, BitGrid, Grid, PuzzleInfo, SHIP, WATER, UNKNOWN, set_ship, set_water, find_ships, allowed_placement
+from battleshiplib import LineCache, LineAnalysis, SolverOptions, find_allowed
+from battleshiplib import BattleShips, initialize, probe, probe_cache
+from battleshiplib import BranchStats, BRANCHINGS, ORDERINGS, order_placements, load_puzzle
+from battleshiplib import Consensus, combine_grids, placement_key
+from battleshiplib import random_solution, solution_clues, solution_hints, format_puzzle
+from battleshiplib import render, write_grids, FORMATS, PackedGrid, SCHEDULERS
+from framework import PuzzleSolver, LimitedDiscrepancy, BestFirst, RandomRestarts, NogoodStore
+from links import WeightedDLX, SearchStats
+from topology import SquareTopology
+import exactcover
+import generator
+import batch
 
 def test_1():
     initinfo = [[2, 2, "w"]]
@@ -12,7 +29,7 @@ def test_1():
     results, guesses = run(rowclues, colclues, initinfo, ships)
     assert len(results) == 1
     assert guesses == 0
-    assert results[0].grid.tostring() == b'\x01\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x01\x02\x02\x01\x01\x01\x02\x02\x02\x02\x02\x02\x01\x02\x01\x02\x01\x02\x01\x02\x01\x02\x02\x02'
+    assert results[0].grid.tobytes() == b'\x01\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x01\x02\x02\x01\x01\x01\x02\x02\x02\x02\x02\x02\x01\x02\x01\x02\x01\x02\x01\x02\x01\x02\x02\x02'
 
 def test_2():
     initinfo = [
@@ -28,7 +45,7 @@ def test_2():
     ships = [4, 3, 2, 1]
     results, guesses = run(rowclues, colclues, initinfo, ships)
     assert len(results) == 1
-    assert results[0].grid.tostring() == b'\x02\x02\x02\x02\x02\x01\x01\x01\x02\x02\x02\x02\x01\x02\x02\x02\x02\x02\x02\x02\x02\x02\x01\x02\x02\x02\x02\x02\x02\x01\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x01\x01\x02\x02\x02\x02\x01\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x01\x02\x01\x01\x01\x01\x02\x02\x01\x02\x01\x02\x01\x02\x02\x02\x02\x02\x02\x02\x02\x02\x01\x02\x02\x02\x02\x01\x02\x02\x02\x02\x01'
+    assert results[0].grid.tobytes() == b'\x02\x02\x02\x02\x02\x01\x01\x01\x02\x02\x02\x02\x01\x02\x02\x02\x02\x02\x02\x02\x02\x02\x01\x02\x02\x02\x02\x02\x02\x01\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x01\x01\x02\x02\x02\x02\x01\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x01\x02\x01\x01\x01\x01\x02\x02\x01\x02\x01\x02\x01\x02\x02\x02\x02\x02\x02\x02\x02\x02\x01\x02\x02\x02\x02\x01\x02\x02\x02\x02\x01'
 
 def test_3():
     initinfo = []
@@ -39,7 +56,7 @@ def test_3():
     assert len(results) == 6
     strings = set()
     for i in results:
-        strings.add(i.grid.tostring())
+        strings.add(i.grid.tobytes())
     s = ["" for i in range(6)]
     s[0] = b'\x01\x02\x02\x01\x02\x02\x02\x02\x02\x02\x02\x02\x02\x01\x02\x02\x01\x02\x02\x01\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x01\x02\x02\x02\x02\x02\x02\x01\x01\x02\x01\x02\x01\x01\x01\x02\x01\x02\x02\x02\x01\x02\x02\x02\x02\x02\x01\x02\x02\x02\x02\x02\x02\x02\x01\x02\x02\x02\x01\x01\x01\x01\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x01\x01\x02\x02\x02\x02\x01'
     s[1] = b'\x01\x02\x02\x01\x02\x02\x02\x02\x02\x02\x02\x02\x02\x01\x02\x02\x02\x01\x02\x01\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x01\x02\x02\x02\x02\x02\x02\x01\x01\x02\x01\x02\x01\x01\x01\x02\x01\x02\x02\x02\x01\x02\x02\x02\x02\x02\x01\x02\x02\x02\x02\x02\x02\x01\x02\x02\x02\x02\x01\x01\x01\x01\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x01\x01\x02\x02\x02\x02\x01'
@@ -59,7 +76,7 @@ def test_4():
     assert len(results) == 12
     strings = set()
     for i in results:
-        strings.add(i.grid.tostring())
+        strings.add(i.grid.tobytes())
     s = ["" for i in range(12)]
     s[0] = b'\x01\x02\x01\x02\x02\x02\x01\x02\x02\x02\x02\x02\x02\x02\x02\x02\x01\x02\x02\x02\x02\x02\x02\x01\x02\x02\x01\x02\x02\x02\x02\x02\x02\x02\x02\x02\x01\x02\x01\x02\x02\x02\x02\x01\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x01\x01\x01\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x01\x02\x02\x02\x02\x01\x02\x01\x02\x01\x01\x02\x01\x01\x02\x01\x02\x01\x02\x01\x02\x02\x02\x02\x02\x02\x02\x01\x02\x02'
     s[1] = b'\x01\x02\x02\x01\x02\x02\x01\x02\x02\x02\x02\x02\x02\x02\x02\x02\x01\x02\x02\x02\x02\x02\x01\x02\x02\x02\x01\x02\x02\x02\x02\x02\x02\x02\x02\x02\x01\x02\x01\x02\x02\x02\x02\x01\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x01\x01\x01\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x01\x02\x02\x02\x02\x01\x02\x01\x02\x01\x01\x02\x01\x01\x02\x01\x02\x01\x02\x01\x02\x02\x02\x02\x02\x02\x02\x01\x02\x02'
@@ -85,7 +102,7 @@ def test_5():
     assert len(results) == 5
     strings = set()
     for i in results:
-        strings.add(i.grid.tostring())
+        strings.add(i.grid.tobytes())
     s = ["" for i in range(5)]
     s[0] = b'\x01\x02\x02\x01\x02\x02\x02\x02\x02\x02\x02\x02\x02\x01\x02\x02\x01\x01\x01\x01\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x01\x02\x02\x02\x02\x02\x02\x02\x02\x02\x01\x02\x02\x01\x02\x02\x01\x02\x02\x02\x01\x02\x02\x02\x02\x02\x02\x01\x02\x02\x02\x02\x01\x01\x02\x01\x01\x02\x02\x01\x01\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x01\x01\x01\x02\x01\x02\x02\x02'
     s[1] = b'\x02\x02\x02\x01\x02\x02\x01\x02\x02\x02\x01\x02\x02\x01\x02\x02\x01\x02\x01\x01\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x01\x02\x02\x02\x02\x02\x02\x02\x02\x02\x01\x02\x02\x01\x02\x02\x01\x02\x02\x02\x01\x02\x02\x02\x02\x02\x02\x01\x02\x02\x02\x02\x01\x01\x01\x01\x02\x02\x02\x01\x01\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x01\x01\x01\x02\x02\x02\x02\x01'
@@ -115,7 +132,7 @@ def test_6():
     ships = [0, 1, 1]
     results, guesses = run(rowclues, colclues, initinfo, ships)
     assert len(results) == 1
-    assert results[0].grid.tostring() == b'\x01\x02\x02\x02\x02\x01\x02\x02\x02\x02\x01\x02\x02\x01\x01'
+    assert results[0].grid.tobytes() == b'\x01\x02\x02\x02\x02\x01\x02\x02\x02\x02\x01\x02\x02\x01\x01'
 
 def test_7():
     rowclues = [None] * 10
@@ -139,4 +156,624 @@ def test_7():
     ships = [4, 3, 2, 1]
     results, guesses = run(rowclues, colclues, initinfo, ships)
     assert len(results) == 1
-    assert results[0].grid.tostring() == b'\x02\x02\x02\x01\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x01\x02\x02\x02\x02\x02\x02\x02\x01\x02\x02\x02\x02\x02\x02\x02\x01\x02\x01\x02\x01\x02\x01\x01\x01\x02\x02\x02\x01\x02\x01\x02\x02\x02\x02\x02\x02\x02\x02\x02\x01\x02\x01\x02\x02\x01\x02\x02\x02\x02\x02\x02\x01\x02\x02\x01\x02\x01\x01\x01\x01\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02'
+    assert results[0].grid.tobytes() == b'\x02\x02\x02\x01\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x01\x02\x02\x02\x02\x02\x02\x02\x01\x02\x02\x02\x02\x02\x02\x02\x01\x02\x01\x02\x01\x02\x01\x01\x01\x02\x02\x02\x01\x02\x01\x02\x02\x02\x02\x02\x02\x02\x02\x02\x01\x02\x01\x02\x02\x01\x02\x02\x02\x02\x02\x02\x01\x02\x02\x01\x02\x01\x01\x01\x01\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02\x02'
+
+def test_bitgrid():
+    puzzles = [
+        ([], [2,2,1,7,2,1,2,2,0,4], [2,3,0,1,7,2,1,4,0,3], [5, 4, 2, 1]),
+        ([], [2,0,2,7,1,1,4,1,2,3,0], [2,5,0,1,3,1,5,2,0,4], [5, 4, 2, 1]),
+        ([], [3, None, 0, None, None], [1, None, 3], [0, 1, 1]),
+        ([[5, 0, "o"], [1, 2, "<"], [9, 4, "o"], [1, 5, "w"], [2, 9, "o"], [6, 9, "<"]],
+         [2,1,3,0,2,3,1,3,0,5], [3,1,2,0,2,1,2,6,1,2], [4, 3, 2, 1]),
+    ]
+    for initinfo, rowclues, colclues, ships in puzzles:
+        results, guesses = run(rowclues, colclues, initinfo, ships)
+        bitresults, bitguesses = run(rowclues, colclues, initinfo, ships, backend=BitGrid)
+        assert bitresults[0].backend is BitGrid
+        assert isinstance(bitresults[0].unpack(), BitGrid)
+        assert sorted(i.grid.tobytes() for i in results) == sorted(i.to_array().tobytes() for i in bitresults)
+
+def test_grid_checks():
+    info = PuzzleInfo([1, None, 1], [2, 0, None, None], [1])
+    for backend in [Grid, BitGrid]:
+        grid = backend(info)
+        grid.put(0, 0, SHIP)
+        grid.put(1, 0, WATER)
+        grid.put(0, 2, WATER)
+        grid.put(2, 1, WATER)
+        grid.put(3, 0, WATER)
+        grid.put(3, 2, WATER)
+        assert grid.holes() == [(2, 0), (3, 1)]
+        assert grid.counts_valid()
+        assert not grid.has_contact()
+        grid.put(1, 1, SHIP)
+        assert grid.has_contact()
+        assert not grid.counts_valid()
+        assert grid.fill_water()
+        assert not grid.fill_water()
+        assert grid.holes() == []
+
+def test_inventory():
+    info = PuzzleInfo([None] * 4, [None] * 4, [1, 1])
+    for backend in [Grid, BitGrid]:
+        grid = backend(info)
+        set_ship(1, 1, grid)
+        set_ship(3, 1, grid)
+        assert find_ships(grid)[:2] == [[0, 0], [2, 0]]
+        # Join the two segments into one
+        set_ship(2, 1, grid)
+        assert find_ships(grid) == [[0, 0, 0], [0, 0, 1], [((1, 1), 3, True, False)]]
+        # Close it off
+        set_water(0, 1, grid)
+        assert find_ships(grid)[:2] == [[0, 0, 1], [0, 0, 0]]
+        clone = grid.clone()
+        set_ship(0, 3, clone)
+        assert find_ships(clone)[1] == [1, 0, 0]
+        assert find_ships(grid)[1] == [0, 0, 0]
+
+def test_allowed_placement():
+    info = PuzzleInfo([1, None, 0, None], [1, None, None, 0], [1, 1])
+    for backend in [Grid, BitGrid]:
+        grid = backend(info)
+        set_ship(0, 0, grid)
+        # Fits the clues
+        assert allowed_placement(((1, 3), 2, True), grid)
+        # Column 3 has no ships
+        assert not allowed_placement(((2, 3), 2, True), grid)
+        # Touches the existing ship
+        assert not allowed_placement(((1, 1), 2, True), grid)
+        # Off the board
+        assert not allowed_placement(((1, 3), 2, False), grid)
+        # Row 2 has no ships
+        assert not allowed_placement(((2, 1), 2, False), grid)
+        # Nothing changes
+        set_water(0, 1, grid)
+        set_water(1, 0, grid)
+        set_water(1, 1, grid)
+        assert not allowed_placement(((0, 0), 1, True), grid)
+
+def test_line_cache():
+    info = PuzzleInfo([None] * 6, [3, None], [1, 1])
+    for backend in [Grid, BitGrid]:
+        cache = LineCache(maxsize=2)
+        grid = backend(info)
+        set_ship(0, 1, grid)
+        set_water(0, 3, grid)
+        line = grid.column(0)
+        analysis = cache.analyze(line, 3)
+        assert analysis.allowed(2) == (0, 1, 4)
+        assert analysis.allowed(3) == (0,)
+        assert analysis.ships == () and analysis.water == ()
+        assert cache.analyze(line, 3) is analysis
+        assert cache.hits == 1 and cache.misses == 1
+        # A full line forces the remaining cells
+        assert cache.analyze(line, 1).water == (0, 2, 4, 5)
+        assert find_allowed(1, line, 1) == ()
+        # Least recently used entries are discarded
+        cache.analyze(grid.column(1), None)
+        assert len(cache.entries) == 2
+        assert cache.analyze(line, 3) is not analysis
+        assert cache.stats()["misses"] == 4
+
+def test_line_completions():
+    # Without room for longer ships, three ships on five cells must alternate
+    line = LineAnalysis([0, 0, 0, 0, 0], 3)
+    assert line.complete((3, 0, 0)) == ((0, 2, 4), (1, 3))
+    # and four ships won't fit at all
+    assert LineAnalysis([0, 0, 0, 0, 0], 4).complete((3, 0, 0)) is None
+    # With a ship of length 2 available, nothing is certain
+    assert line.complete((3, 1, 0)) == ((), ())
+    # Ships can't be longer than the longest ship, even if the clue is unknown
+    assert LineAnalysis([1, 1, 1, 0], None).complete((0, 0, 1)) == ((), (3,))
+
+def test_line_logic_option():
+    # The same solutions are found with and without line logic
+    found = []
+    for line_logic in [True, False]:
+        results, _ = run([2, 2, 1, 7, 2, 1, 2, 2, 0, 4], [2, 3, 0, 1, 7, 2, 1, 4, 0, 3], [],
+                         [5, 4, 2, 1], options=SolverOptions(line_logic=line_logic))
+        found.append(sorted(result.grid.tobytes() for result in results))
+    assert len(found[0]) == 6
+    assert found[0] == found[1]
+
+def test_probing():
+    initinfo = [[5, 0, "o"], [1, 2, "<"], [9, 4, "o"], [1, 5, "w"], [2, 9, "o"], [6, 9, "<"]]
+    rowclues = [2,1,3,0,2,3,1,3,0,5]
+    colclues = [3,1,2,0,2,1,2,6,1,2]
+    ships = [4, 3, 2, 1]
+    options = SolverOptions(probing=True)
+    grid = Grid(PuzzleInfo(rowclues, colclues, ships))
+    initialize(grid, initinfo)
+    # Probing fixes cells, and the result of probing a state is cached
+    probe_cache.clear()
+    solver = BattleShips(grid.clone(), options=SolverOptions(line_logic=False))
+    assert probe(solver)
+    assert probe_cache.misses == 1
+    solver = BattleShips(grid.clone(), options=SolverOptions(line_logic=False))
+    assert probe(solver)
+    assert probe_cache.hits == 1
+    # Probing doesn't change the solution
+    results, _ = run(rowclues, colclues, initinfo, ships, options=options)
+    expected, _ = run(rowclues, colclues, initinfo, ships)
+    assert len(results) == 1
+    assert results[0].grid.tobytes() == expected[0].grid.tobytes()
+
+def test_branching():
+    rowclues = [2,2,1,7,2,1,2,2,0,4]
+    colclues = [2,3,0,1,7,2,1,4,0,3]
+    ships = [5, 4, 2, 1]
+    expected = None
+    for branching in BRANCHINGS:
+        for ordering in ORDERINGS:
+            stats = BranchStats()
+            options = SolverOptions(branching=branching, ordering=ordering)
+            results, _ = run(rowclues, colclues, [], ships, options=options, stats=stats)
+            found = sorted(result.grid.tobytes() for result in results)
+            if expected is None:
+                expected = found
+            # Every strategy finds all 6 solutions
+            assert found == expected and len(found) == 6
+            assert stats.nodes > 0
+            assert sum(nodes for nodes, _ in stats.lengths.values()) == stats.nodes
+            assert len(stats.branching()) == len(stats.levels)
+
+    # Placements that fill the most clue units come first
+    grid = Grid(PuzzleInfo([None, 2, None], [3, 1, None], [0, 1]))
+    placements = [((2, 0), 2, False), ((0, 1), 2, True), ((0, 0), 2, True)]
+    assert order_placements(placements, grid, "clues") == [placements[1], placements[2], placements[0]]
+    assert order_placements(placements, grid, "constrained")[0] == placements[1]
+    assert order_placements(placements, grid, "scan") == placements
+
+    try:
+        SolverOptions(branching="widest")
+        assert False
+    except ValueError:
+        pass
+
+def test_load_puzzle():
+    filename = os.path.join(os.path.dirname(os.path.abspath(__file__)), "puzzle1")
+    rowclues, colclues, ships, initinfo = load_puzzle(filename)
+    assert rowclues == [4,0,2,1,2,1]
+    assert colclues == [1,0,4,0,3,2]
+    assert ships == [3,2,1]
+    assert initinfo == [(2, 2, "w")]
+
+def test_weighted_links():
+    # Column 0 needs two rows, column 1 needs weight 2, column 2 is secondary
+    links = WeightedDLX([2, 2], numsecondary=1)
+    links.add_row([0, 2], "a")
+    links.add_row([0, 2], "b")
+    links.add_row([0, 1], "c")
+    links.add_row([1], "d", weights=[2])
+    links.add_row([1], "e")
+    # a and b clash on the secondary column
+    assert sorted(links.run()) == [("a", "c", "e"), ("b", "c", "e")]
+    assert links.run(limit=1) in [[("a", "c", "e")], [("b", "c", "e")]]
+
+def test_exact_cover():
+    rowclues = [2, 2, 1, 7, 2, 1, 2, 2, 0, 4]
+    colclues = [2, 3, 0, 1, 7, 2, 1, 4, 0, 3]
+    ships = [5, 4, 2, 1]
+    results, _ = run(rowclues, colclues, [], ships)
+    solutions = exactcover.solve(rowclues, colclues, [], ships)
+    assert len(solutions) == 6
+    assert (sorted(result.grid.tobytes() for result in results)
+            == sorted(solution.to_array().tobytes() for solution in solutions))
+    assert len(exactcover.solve(rowclues, colclues, [], ships, limit=2)) == 2
+
+    # Forced rows don't add levels to the statistics
+    dirname = os.path.dirname(os.path.abspath(__file__))
+    rowclues, colclues, ships, initinfo = load_puzzle(os.path.join(dirname, "puzzle2"))
+    stats = SearchStats()
+    exactcover.solve(rowclues, colclues, initinfo, ships, stats=stats)
+    summary = stats.as_dict()
+    assert summary["nodes"] == stats.nodes > 0
+    assert len(summary["branching"]) == len(stats.levels)
+    assert all(nodes > 0 for nodes, _ in stats.levels)
+
+def test_zobrist():
+    info = PuzzleInfo([None] * 4, [None] * 5, [1])
+    for backend in (Grid, BitGrid):
+        grid = backend(info)
+        empty = grid.make_hash()
+        set_ship(1, 1, grid)
+        clone = grid.clone()
+        set_water(2, 3, clone)
+        # Hashes are kept up to date incrementally
+        assert clone.key == clone.compute_key()
+        assert grid.make_hash() != clone.make_hash() != empty
+        # Setting the same cells in a different order gives the same hash
+        other = backend(info)
+        set_water(2, 3, other)
+        set_ship(1, 1, other)
+        assert other.make_hash() == clone.make_hash()
+        other.fill_water()
+        assert other.key == other.compute_key()
+
+    # Verified hashes include the contents of the state
+    info = PuzzleInfo([None] * 4, [None] * 5, [1], verify_hashes=True)
+    grid = Grid(info)
+    set_ship(1, 1, grid)
+    assert grid.make_hash() == (grid.key, grid.to_array().tobytes())
+    grid.key ^= 1
+    try:
+        grid.make_hash()
+        assert False
+    except RuntimeError:
+        pass
+
+def test_consensus():
+    rowclues = [2, 2, 1, 7, 2, 1, 2, 2, 0, 4]
+    colclues = [2, 3, 0, 1, 7, 2, 1, 4, 0, 3]
+    ships = [5, 4, 2, 1]
+    results, _ = run(rowclues, colclues, [], ships, verbose=False)
+    consensus, _ = run(rowclues, colclues, [], ships, verbose=False, solutionlist=Consensus())
+    assert isinstance(consensus, Consensus)
+    assert len(consensus) == len(results) == 6
+    assert consensus.common().grid.tobytes() == combine_grids(results).grid.tobytes()
+    probs = consensus.probabilities()
+    assert probs.tolist() == (sum(result.grid == SHIP for result in results) / 6).tolist()
+    assert len(consensus.heatmap().split("\n")) == len(rowclues) + 1
+    assert Consensus().common() is None
+
+    # With symmetry breaking, no solution is reached twice, so no hashes need keeping
+    solver = BattleShips(Grid(PuzzleInfo(rowclues, colclues, ships)), solutionlist=Consensus(),
+                         dedupe=False)
+    solver.solve()
+    assert solver.solved is None and len(solver.solutionlist) == 6
+    consensus, _ = run(rowclues, colclues, [], ships, verbose=False, solutionlist=Consensus(),
+                       scheduler=RandomRestarts(budget=1, seed=2))
+    assert len(consensus) == 6
+    try:
+        BattleShips(Grid(PuzzleInfo(rowclues, colclues, ships)), dedupe=False,
+                    scheduler=RandomRestarts())
+        assert False
+    except ValueError:
+        pass
+
+def test_symmetry():
+    rowclues = [2, 2, 1, 7, 2, 1, 2, 2, 0, 4]
+    colclues = [2, 3, 0, 1, 7, 2, 1, 4, 0, 3]
+    ships = [5, 4, 2, 1]
+    found = []
+    nodes = []
+    for symmetry in (False, True):
+        for branching in BRANCHINGS:
+            stats = BranchStats()
+            options = SolverOptions(symmetry=symmetry, branching=branching)
+            results, _ = run(rowclues, colclues, [], ships, options=options, stats=stats, verbose=False)
+            found.append(sorted(result.grid.tobytes() for result in results))
+            nodes.append(stats.nodes)
+    assert all(i == found[0] for i in found) and len(found[0]) == 6
+    # Excluding placements that have already been tried never adds guesses
+    assert nodes[2] <= nodes[0] and nodes[3] <= nodes[1]
+
+    # Length 1 ships are the same in either direction
+    assert placement_key(((1, 2), 1, True)) == placement_key(((1, 2), 1, False))
+    assert placement_key(((1, 2), 2, True)) != placement_key(((1, 2), 2, False))
+
+def test_large_board():
+    rng = random.Random(4)
+    ships = [16, 12, 8, 4]
+    solution = random_solution(20, 20, ships, rng)
+    rowclues, colclues = solution_clues(solution)
+    # Revealing every cell gives the solution back
+    grid = Grid(solution.info)
+    initialize(grid, solution_hints(solution, 1.0, rng))
+    assert grid.grid.tobytes() == solution.grid.tobytes()
+
+    initinfo = solution_hints(solution, 0.8, rng)
+    for backend in (Grid, BitGrid):
+        results, _ = run(rowclues, colclues, initinfo, ships, backend=backend, verbose=False)
+        assert solution.grid.tobytes() in [result.to_array().tobytes() for result in results]
+        for result in results:
+            # Solutions are stored packed
+            result = result.unpack()
+            # The counts along each line are kept up to date as cells are set
+            for x in range(20):
+                assert result.count_column(x, SHIP) == colclues[x]
+                assert result.count_column(x, UNKNOWN) == 0
+            for y in range(20):
+                assert result.count_row(y, SHIP) == rowclues[y]
+            assert len(result.inventory.complete) == sum(ships)
+
+def test_max_solutions():
+    rng = random.Random(7)
+    ships = [3, 2, 1]
+    solution = random_solution(8, 8, ships, rng)
+    rowclues, colclues = solution_clues(solution)
+    results, _ = run(rowclues, colclues, [], ships, verbose=False)
+    assert len(results) > 2
+    for limit in (1, 2):
+        limited, _ = run(rowclues, colclues, [], ships, verbose=False, max_solutions=limit)
+        assert len(limited) == limit
+        assert all(result.make_hash() in [r.make_hash() for r in results] for result in limited)
+    consensus = Consensus()
+    run(rowclues, colclues, [], ships, verbose=False, solutionlist=consensus, max_solutions=2)
+    assert len(consensus) == 2
+
+def test_generator(tmp_path):
+    puzzle = generator.generate(seed=5, width=8, height=8, ships=(3, 2, 1))
+    rowclues, colclues, ships, initinfo = puzzle
+    results, _ = run(rowclues, colclues, initinfo, ships, verbose=False)
+    assert len(results) == 1
+    assert solution_clues(results[0]) == (rowclues, colclues)
+    # No revealed cell can be removed without losing uniqueness
+    for hint in initinfo:
+        remaining = [i for i in initinfo if i != hint]
+        results, _ = run(rowclues, colclues, remaining, ships, verbose=False)
+        assert len(results) > 1
+    # The puzzle survives being written out and read back in
+    filename = tmp_path / "generated"
+    filename.write_text(format_puzzle(*puzzle))
+    assert load_puzzle(str(filename)) == (rowclues, colclues, ships, initinfo)
+
+def test_batch(capsys):
+    dirname = os.path.dirname(os.path.abspath(__file__))
+    puzzle = load_puzzle(os.path.join(dirname, "puzzle5"))
+    result = batch.solve_puzzle(puzzle, grids=10)
+    assert result["solutions"] == 5 and result["complete"]
+    assert len(result["grids"]) == 5
+    assert result["grids"][0] == batch.encode_grid(run(*puzzle[:2], puzzle[3], puzzle[2], verbose=False)[0][0])
+    assert all("?" not in row for row in result["grids"][0])
+    assert "?" in "".join(result["common"])
+    result = batch.solve_puzzle(puzzle, max_solutions=2)
+    assert result["solutions"] == 2 and not result["complete"] and len(result["grids"]) == 1
+    result = batch.solve_puzzle(puzzle, scheduler="restarts")
+    assert result["solutions"] == 5 and result["scheduler"] == "restarts"
+
+    # Puzzles from JSONL, including bad ones
+    rowclues, colclues, ships, initinfo = puzzle
+    lines = [json.dumps({"name": "good", "rowclues": rowclues, "colclues": colclues,
+                         "ships": ships, "hints": initinfo}),
+             "",
+             json.dumps({"rowclues": rowclues, "colclues": colclues, "ships": ships,
+                         "hints": [[0, 0, "x"]]}),
+             json.dumps({"rowclues": rowclues}),
+             "not json"]
+    puzzles = list(batch.read_jsonl(lines))
+    assert [name for name, _, _ in puzzles] == ["good", "line 3", "line 4", "line 5"]
+    assert puzzles[0][1] == puzzle and puzzles[0][2] is None
+    assert puzzles[1][2] is None
+    assert puzzles[2][1] is None and puzzles[3][1] is None
+    result = batch.solve_puzzle(puzzles[1][1])
+    assert result["solutions"] == 0 and "unrecognised" in result["error"]
+    # Nothing is printed along the way
+    assert capsys.readouterr().out == ""
+
+def test_render():
+    initinfo = [[2, 2, "w"]]
+    rowclues = [4,0,2,1,2,1]
+    colclues = [1,0,4,0,3,2]
+    ships = [3,2,1]
+    solution = run(rowclues, colclues, initinfo, ships, verbose=False)[0][0]
+    assert render(solution, "compact") == "@~@~<>/~~~~~~/~~~~<>/~~Λ~~~/~~#~@~/~~V~~~"
+    plain = render(solution, "plain")
+    assert plain == str(solution)
+    assert plain.split("\n")[2] == "  4 |@ ~ @ ~ < >| "
+    ansi = render(solution, "ansi")
+    assert ansi != plain and "\x1b[" in ansi
+
+    # The partially solved grid has unknown cells
+    grid = Grid(PuzzleInfo(rowclues, colclues, ships))
+    set_ship(0, 0, grid)
+    assert render(grid, "compact").startswith("#.....")
+
+    class Stream(object):
+        """Records each write"""
+        def __init__(self):
+            self.writes = []
+        def write(self, text):
+            self.writes.append(text)
+        def flush(self):
+            pass
+
+    for fmt in FORMATS:
+        batched, each = Stream(), Stream()
+        titles = ["first", "second"]
+        write_grids([solution, grid], fmt, stream=batched, titles=titles)
+        write_grids([solution, grid], fmt, stream=each, titles=titles, batch=False)
+        assert len([text for text in batched.writes if text]) == 1
+        assert len([text for text in each.writes if text]) == 2
+        assert "".join(batched.writes) == "".join(each.writes)
+        assert "".join(each.writes).startswith("first\n" + render(solution, fmt) + "\n")
+
+def test_topology():
+    square = SquareTopology(4, 3)
+    assert len(square) == 12 and (3, 2) in square and (4, 0) not in square
+    assert sorted(square.neighbors[0, 0]) == [(0, 1), (1, 0)]
+    assert sorted(square.diagonals[1, 1]) == [(0, 0), (0, 2), (2, 0), (2, 2)]
+    # The horiz flag of a placement is its axis
+    assert square.ship_cells((1, 0), 3, True) == [(1, 0), (2, 0), (3, 0)]
+    assert square.ship_cells((1, 0), 3, False) == [(1, 0), (1, 1), (1, 2)]
+    assert square.ship_cells((2, 0), 3, True) is None
+    assert square.ship_ends([(1, 0), (2, 0)], True) == [(0, 0), (3, 0)]
+    assert square.ship_ends([(1, 1)], False) == square.neighbors[1, 1]
+
+    # Every table is symmetric
+    for cell in square.cells:
+        for other in square.neighbors[cell]:
+            assert cell in square.neighbors[other]
+        for other in square.diagonals[cell]:
+            assert cell in square.diagonals[other]
+
+def test_packed_solutions():
+    dirname = os.path.dirname(os.path.abspath(__file__))
+    rowclues, colclues, ships, initinfo = load_puzzle(os.path.join(dirname, "puzzle5"))
+    for backend in (Grid, BitGrid):
+        results, _ = run(rowclues, colclues, initinfo, ships, backend=backend, verbose=False)
+        assert len(results) == 5
+        for result in results:
+            assert isinstance(result, PackedGrid)
+            state = result.unpack()
+            assert isinstance(state, backend)
+            assert state.to_array().tobytes() == result.to_array().tobytes()
+            assert state.make_hash() == result.make_hash()
+            assert str(state) == str(result)
+            assert all(result.get(x, y) == state.get(x, y) for x in range(10) for y in range(10))
+            assert len(state.inventory.complete) == sum(ships)
+
+    # With hashes verified, a state, its packed copy and the same cells in any backend
+    # all have the same hash
+    info = PuzzleInfo(rowclues, colclues, ships, verify_hashes=True)
+    states = [Grid(info), BitGrid(info)]
+    for state in states:
+        initialize(state, initinfo)
+        assert state.make_hash() == state.pack().make_hash()
+        assert state.make_hash() == state.pack().unpack().make_hash()
+    assert states[0].make_hash() == states[1].make_hash()
+    results, _ = run(rowclues, colclues, initinfo, ships, backend=BitGrid, verbose=False,
+                     options=SolverOptions(verify_hashes=True))
+    for result in results:
+        assert result.unpack().make_hash() == result.make_hash()
+
+    # Finished parts of the search are released as soon as they are done, so the solvers
+    # alive at any time are the chain from the root to the current state
+    alive = weakref.WeakSet()
+    most = [0, 0]
+
+    class Tracked(BattleShips):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            alive.add(self)
+
+        def logic(self):
+            gc.collect()
+            most[0] = max(most[0], len(alive) - (self.depth + 1))
+            most[1] += 1
+            return super().logic()
+
+    rng = random.Random(4)
+    solution = random_solution(8, 8, [3, 2, 1], rng)
+    rowclues, colclues = solution_clues(solution)
+    grid = Grid(PuzzleInfo(rowclues, colclues, [3, 2, 1]))
+    solver = Tracked(grid)
+    solver.solve()
+    assert len(solver.solutionlist) == 62 and most[1] > 100
+    assert most[0] == 0
+
+def test_schedulers():
+    # Every scheduler finds the same solutions, with or without symmetry breaking
+    rng = random.Random(9)
+    for _ in range(4):
+        ships = [3, 2, 1]
+        solution = random_solution(8, 8, ships, rng)
+        rowclues, colclues = solution_clues(solution)
+        rowclues[rng.randrange(8)] = None
+        for symmetry in (True, False):
+            options = SolverOptions(symmetry=symmetry)
+            expected = None
+            for name in sorted(SCHEDULERS):
+                scheduler = SCHEDULERS[name]()
+                results, _ = run(rowclues, colclues, [], ships, verbose=False, options=options,
+                                 scheduler=scheduler)
+                found = sorted(result.to_array().tobytes() for result in results)
+                assert len(found) == len(set(found))
+                if expected is None:
+                    expected = found
+                    assert len(expected) > 1
+                assert found == expected
+                limited, _ = run(rowclues, colclues, [], ships, verbose=False, options=options,
+                                 scheduler=SCHEDULERS[name](), max_solutions=1)
+                assert len(limited) == 1 and limited[0].to_array().tobytes() in expected
+
+    # Restarts with a tiny budget still explore everything in the end
+    scheduler = RandomRestarts(budget=1, seed=3)
+    results, _ = run(rowclues, colclues, [], ships, verbose=False, scheduler=scheduler)
+    assert scheduler.runs > 1 and len(results) == len(expected)
+
+    # Limited discrepancy search explores states with fewer discrepancies first
+    explored = []
+
+    class Counted(LimitedDiscrepancy):
+        def score(self, solver, base):
+            # The first score of a solver is its own number of discrepancies
+            if not hasattr(solver, "discrepancies"):
+                solver.discrepancies = base
+            return super().score(solver, base)
+
+    class Recorded(BattleShips):
+        def logic(self):
+            if not hasattr(self, "recorded"):
+                self.recorded = True
+                explored.append(self.discrepancies)
+            return super().logic()
+
+    grid = Grid(PuzzleInfo(rowclues, colclues, ships))
+    Recorded(grid, scheduler=Counted()).solve()
+    assert explored == sorted(explored) and explored[-1] > 1
+
+    # Best first search uses a custom heuristic if given one
+    rated = []
+    run(rowclues, colclues, [], ships, verbose=False,
+        scheduler=BestFirst(lambda solver: rated.append(solver) or -solver.depth))
+    assert len(rated) > 0
+
+def test_bitgrid_arrays():
+    # Boards narrower and wider than a byte, filled in at random
+    rng = random.Random(2)
+    for width, height in [(5, 7), (13, 4), (20, 9)]:
+        info = PuzzleInfo([None] * height, [None] * width, [1])
+        grid, bitgrid = Grid(info), BitGrid(info)
+        for _ in range(width * height // 2):
+            x, y, value = rng.randrange(width), rng.randrange(height), rng.choice([SHIP, WATER])
+            grid.put(x, y, value)
+            bitgrid.put(x, y, value)
+        assert bitgrid.to_array().shape == (width, height)
+        assert (bitgrid.to_array() == grid.to_array()).all()
+        unknown = int((grid.to_array() == UNKNOWN).sum())
+        assert grid.count_unknown() == bitgrid.count_unknown() == unknown
+
+def test_nogoods():
+    store = NogoodStore(maxsize=2)
+    store.add([1, 2])
+    store.add([3])
+    assert store.check(2, lambda decision: decision == 1) == frozenset([1, 2])
+    assert store.check(2, lambda decision: False) is None and store.check(5, bool) is None
+    # The least recently used nogood is discarded (checking [1, 2] used it last)
+    store.add([4, 5])
+    assert len(store) == 2 and [3] not in store and [1, 2] in store
+    assert store.check(3, bool) is None and store.check(4, lambda decision: decision == 5)
+    assert store.stats()["evicted"] == 1 and store.stats()["hits"] == 2
+    store.clear()
+    assert len(store) == 0 and len(store.index) == 0
+
+    # Learning prunes guesses without changing the solutions found, for any scheduler
+    dirname = os.path.dirname(os.path.abspath(__file__))
+    rowclues, colclues, ships, initinfo = load_puzzle(os.path.join(dirname, "puzzle5"))
+    results, guesses = run(rowclues, colclues, initinfo, ships, verbose=False)
+    expected = sorted(result.to_array().tobytes() for result in results)
+    learnt, fewer = run(rowclues, colclues, initinfo, ships, verbose=False,
+                        options=SolverOptions(nogoods=100))
+    assert sorted(result.to_array().tobytes() for result in learnt) == expected
+    assert fewer < guesses
+    for scheduler in (LimitedDiscrepancy(), BestFirst(), RandomRestarts(budget=2, seed=1)):
+        learnt, _ = run(rowclues, colclues, initinfo, ships, verbose=False, scheduler=scheduler,
+                        options=SolverOptions(nogoods=100))
+        assert sorted(result.to_array().tobytes() for result in learnt) == expected
+
+    # Nogoods are small sets of placements that no solution has all of
+    info = PuzzleInfo(rowclues, colclues, ships)
+    grid = Grid(info)
+    initialize(grid, initinfo)
+    store = NogoodStore()
+    solver = BattleShips(grid, nogoods=store)
+    solver.solve()
+    assert store.hits > 0 and len(store) > 0
+    assert any(len(nogood) <= 2 for nogood in store.entries)
+    for nogood in store.entries:
+        assert solver.refutes(nogood)
+        for result in solver.solutionlist:
+            assert not all(result.unpack().inventory.has_complete(placement) for placement in nogood)
+
+    # Decisions are placement keys, and hold when their ship is complete
+    assert solver.decision(((2, 3), 1, True)) == ((2, 3), 1, False)
+    state = solver.solutionlist[0].unpack()
+    placement = next(iter(state.inventory.complete))
+    solver.state = state
+    assert solver.holds(placement_key(placement))
+    # By default, a decision holds if it is on the path, and is refuted by logic
+    assert not PuzzleSolver.holds(solver, placement)
+    for nogood in store.entries:
+        assert PuzzleSolver.refutes(solver, nogood)
+    assert not PuzzleSolver.refutes(solver, [placement])
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Board topologies for battleships
+
+A topology describes the shape of a board: which cells it has, the directions that
+ships can lie in (its axes), and which cells touch each other. Ships are straight
+runs of cells along an axis, and no cell of another ship may touch them.
+
+Everything the solver needs to know about neighbouring cells is computed once, when
+the topology is built, and stored in tables keyed by cell (a tuple of coordinates),
+so that the logic looks cells up rather than adding offsets and checking them against
+the edges of the board:
+--- step[axis][cell] is the next cell along an axis (None off the board), and
+    back[axis][cell] is the previous one
+--- neighbors[cell] are the cells next to a cell along the axes
+--- diagonals[cell] are the other cells that touch a cell. A ship cell makes all of
+    its diagonals water, as other ships can't touch it there, and its own ship can't
+    bend there.
+
+SquareTopology is the usual rectangular board. Axis False (0) is vertical and axis
+True (1) is horizontal, so that the horiz flag of a placement is its axis.
+"""
+from functools import lru_cache
+
+class Topology(object):
+    """
+    Base class for topologies. Subclasses pass the cells of the board, the axes (as
+    offsets) and the offsets of every cell that touches a cell.
+    """
+
+    def __init__(self, cells, axes, touching):
+        """
+        cells is a list of the coordinate tuples of the cells on the board
+        axes is a list of offsets giving the directions that ships can lie in
+        touching is a list of the offsets of every cell that touches a cell
+        """
+        self.cells = list(cells)
+        self.axes = list(axes)
+        self.touching = list(touching)
+        onboard = set(self.cells)
+
+        def offset(cell, delta, sign=1):
+            """The cell at the given offset from a cell, or None if it's off the board"""
+            moved = tuple(c + sign * d for c, d in zip(cell, delta))
+            return moved if moved in onboard else None
+
+        self.step = [{cell: offset(cell, axis) for cell in self.cells} for axis in self.axes]
+        self.back = [{cell: offset(cell, axis, -1) for cell in self.cells} for axis in self.axes]
+        along = set(self.axes) | {tuple(-d for d in axis) for axis in self.axes}
+        self.neighbors = {}
+        self.diagonals = {}
+        for cell in self.cells:
+            self.neighbors[cell] = [n for n in (offset(cell, delta) for delta in self.touching
+                                                if delta in along) if n is not None]
+            self.diagonals[cell] = [n for n in (offset(cell, delta) for delta in self.touching
+                                                if delta not in along) if n is not None]
+
+    def __contains__(self, cell):
+        return cell in self.neighbors
+
+    def __len__(self):
+        return len(self.cells)
+
+    def ship_cells(self, start, length, axis):
+        """
+        Returns the cells of a ship of the given length starting at a cell and running
+        along an axis, or None if it doesn't fit on the board
+        """
+        step = self.step[axis]
+        cells = [start]
+        for _ in range(length - 1):
+            cell = step.get(cells[-1])
+            if cell is None:
+                return None
+            cells.append(cell)
+        return cells if start in self else None
+
+    def ship_ends(self, cells, axis):
+        """
+        Returns the cells just beyond each end of a ship (given by its cells, running along
+        an axis) that are on the board. A ship of length 1 has no direction, so all of
+        its neighbours are returned.
+        """
+        if len(cells) == 1:
+            return self.neighbors[cells[0]]
+        ends = (self.back[axis][cells[0]], self.step[axis][cells[-1]])
+        return [cell for cell in ends if cell is not None]
+
+class SquareTopology(Topology):
+    """A rectangular board of square cells, indexed (x, y) from the top left corner"""
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        cells = [(x, y) for x in range(width) for y in range(height)]
+        touching = [(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1) if (dx, dy) != (0, 0)]
+        # Axis False is vertical, axis True is horizontal
+        super().__init__(cells, [(0, 1), (1, 0)], touching)
+
+@lru_cache(maxsize=32)
+def square_topology(width, height):
+    """Returns a SquareTopology of the given size, sharing it between puzzles of that size"""
+    return SquareTopology(width, height)
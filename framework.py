@@ -14,9 +14,37 @@ logic methods find an inconsistent state. Solved should be raised whenever
 the logic methods find a solved state. The PuzzleSolver class handles
 both exceptions.
 
+The order in which guesses are explored is chosen by a Scheduler. Each state is
+explored by a generator (PuzzleSolver.expand), which does logic and hands out a
+new solver for each guess in turn, and the scheduler chooses which generator to
+advance next. Four schedulers are defined:
+--- DepthFirst (the default) explores each guess completely before the next
+--- LimitedDiscrepancy explores the states that depart from the order of the
+    guess lists the fewest times first
+--- BestFirst explores the state that the heuristic rates as closest to solved first
+--- RandomRestarts searches depth first with the guesses in a random order, starting
+    again with a new order (and a bigger budget) whenever a budget of states is used up
+Because guesses are assumed to be incorrect once they have been handed out, a
+solver must take anything it needs from its parent when it is cloned, rather than
+reading it later, as the parent may have moved on by the time it is explored.
+
+Solvers can also learn from the guesses that fail, with a NogoodStore. Each solver
+keeps its path: the decisions made by the guesses on the way to it (see decision).
+When a state is found to be inconsistent, its path is shrunk to a small set of
+decisions that can't hold together (see learn and refutes), which is stored as a
+nogood. Whenever a guess is made, the nogoods containing its decision are checked,
+and if every other decision of one holds (see holds), the guess is abandoned before
+a solver is made for it. Nogoods are checked against the root state rather than
+anything the search has ruled out along the way, so they hold in every branch, for
+any scheduler.
+
 Jolyon Bloomfield, January 2018
 """
 import abc
+import heapq
+import random
+from itertools import count
+from collections import OrderedDict
 
 class Inconsistent(Exception):
     """Error raised when a state is found to be inconsistent"""
@@ -47,23 +75,43 @@ class PuzzleState(abc.ABC):
     def make_hash(self):
         """Make a hash of the puzzle state"""
 
+    def pack(self):
+        """
+        Returns a copy of this (solved) state to store in the solution list.
+        Override this to store solutions in a compact form, without the bookkeeping
+        used while solving. By default, the state itself is stored.
+        """
+        return self
+
 class PuzzleSolver(abc.ABC):
     """Abstract base class that defines the logic to solve a puzzle"""
 
     # Stores the number of PuzzleSolvers created
     StateNum = 0
 
-    def __init__(self, initstate, debug=False, max_depth=50,
-                 solutionlist=None, hashes=None, parent=None, depth=0):
+    def __init__(self, initstate, debug=False, max_depth=50, max_solutions=None, scheduler=None,
+                 nogoods=None, dedupe=True, solutionlist=None, hashes=None, solved=None,
+                 origin=None, parent=None, depth=0):
         """
         Initialize the puzzle solver with an initial state.
         - initstate is a PuzzleState object, describing the initial state
         - debug is a debug flag that prints decision information as the puzzle is solved
         - max_depth is the recursion limit
+        - max_solutions stops the search once this many solutions have been found
+            (None to find them all). Use 2 to check that a solution is unique.
+        - scheduler is a Scheduler that chooses the order in which guesses are explored
+            (None for depth first search, see DepthFirst)
+        - nogoods is a NogoodStore to learn from inconsistent states with (None to not learn)
+        - dedupe keeps the hash of every solution found, so that a solution that is reached
+            twice is only stored once. Turn this off if the search can never reach the same
+            solution twice, so that memory doesn't grow with the number of solutions.
 
         All other flags are for internal use.
-        - solutionlist is a list that solutions are stored in
+        - solutionlist is a list that solutions are stored in (as packed by PuzzleState.pack)
         - hashes is an internal table of hashed states the solver has seen
+        - solved is an internal table of the hashes of the solutions found (if dedupe)
+        - origin is a copy of the root state after its first logic, that nogoods are
+            checked against (see refutes)
         - parent links to the parent PuzzleSolver, so that any helper information can be
             inherited
         - depth indicates how deep we are in the recursion
@@ -73,8 +121,16 @@ class PuzzleSolver(abc.ABC):
         self.parent = parent
         self.depth = depth
         self.max_depth = max_depth
+        self.max_solutions = max_solutions
+        self.scheduler = scheduler if scheduler is not None else DepthFirst()
         self.debug = debug
 
+        # Store the nogoods, the state they are checked against (see refutes), and the
+        # decisions made by the guesses on the way here
+        self.nogoods = nogoods
+        self.origin = origin
+        self.path = ()
+
         # Store the solution list
         if solutionlist is None:
             self.solutionlist = []
@@ -87,13 +143,35 @@ class PuzzleSolver(abc.ABC):
         else:
             self.hashes = hashes
 
+        # Hashes of solutions, used to ensure that each solution is only stored once
+        if not dedupe and self.scheduler.repeats_solutions:
+            raise ValueError("{} needs solutions to be deduplicated".format(type(self.scheduler).__name__))
+        self.dedupe = dedupe
+        if not dedupe:
+            self.solved = None
+        elif solved is None:
+            self.solved = set()
+        else:
+            self.solved = solved
+
         # Store the ID and increment StateNum
         self.id = PuzzleSolver.StateNum
         PuzzleSolver.StateNum += 1
 
     def solve(self):
         """Attempts to solve the puzzle"""
+        self.scheduler.search(self)
+
+    def expand(self):
+        """
+        Explores this state, as a generator that is run by the scheduler.
 
+        Does logic (storing the state if it is solved), and then yields a new solver for
+        each guess in turn, with the guess applied. Once a guess has been yielded, it is
+        assumed to be incorrect (see afterguess), whether or not the solver for it has been
+        explored yet. None is yielded whenever logic has made a new guess list, so that the
+        scheduler can take stock of this state before any guesses are made.
+        """
         # Do presolving (first time only)
         if self.depth == 0:
             self.debugout("Doing presolve")
@@ -103,7 +181,7 @@ class PuzzleSolver(abc.ABC):
                 return
             except Solved:
                 self.debugout("Solution found in presolving!")
-                self.solutionlist.append(self.state)
+                self.store_solution()
                 return
 
         while True:
@@ -115,18 +193,21 @@ class PuzzleSolver(abc.ABC):
                 self.guesslist, self.requiredguesses = self.logic()
             except Inconsistent:
                 # Inconsistent
+                self.learn()
                 return
             except Solved:
                 # Found a solution!
-                solhash = self.state.make_hash()
-                if solhash not in self.hashes:
+                if self.store_solution():
                     self.debugout("Depth {}: Solution found!".format(self.depth))
-                    self.solutionlist.append(self.state)
-                    self.hashes.add(solhash)
                 else:
                     self.debugout("Depth {}: Duplicate solution found".format(self.depth))
                 return
 
+            # Nogoods are checked against the root state after its first logic, which
+            # follows from the initial state alone
+            if self.nogoods is not None and self.origin is None:
+                self.origin = self.state.clone()
+
             # Check to see if we've already explored this path
             currenthash = self.state.make_hash()
             if currenthash in self.hashes:
@@ -140,9 +221,11 @@ class PuzzleSolver(abc.ABC):
                 self.debugout("Hit depth limit")
                 return
 
+            self.guesslist = self.scheduler.order(self, self.guesslist)
             self.debugout("Depth {}: Status before making a guess list".format(self.depth))
-            self.debugout(str(self.state))
+            self.debugout(self.state)
             self.debugout("Depth {}: Made a guess list:".format(self.depth), self.guesslist)
+            yield None
 
             # Run each guess in turn
             for idx, guess in enumerate(self.guesslist):
@@ -161,19 +244,30 @@ class PuzzleSolver(abc.ABC):
                     self.debugout("Depth {}: All applied consistently".format(self.depth))
                     break
 
-                # Make a PuzzleSolver clone
-                solver = self.clone()
-
-                # Apply the guess
-                self.debugout("Depth {}: Try this guess:".format(self.depth), guess)
-                try:
-                    solver.apply_guess(guess)
+                if self.is_nogood(guess):
+                    # No solution can follow from this guess, so don't make a solver for it
+                    self.debugout("Depth {}: Guess completes a nogood:".format(self.depth), guess)
+                    solver = None
+                else:
+                    # Make a PuzzleSolver clone (which can read the guess it is making)
                     self.guess = idx
-                    # And give it a solve!
-                    solver.solve()
-                    self.debugout("Depth {}: Done with guess:".format(self.depth), guess)
-                except Inconsistent:
-                    pass
+                    solver = self.clone()
+                    if self.nogoods is not None:
+                        solver.path = self.path + (self.decision(guess),)
+
+                    # Apply the guess
+                    self.debugout("Depth {}: Try this guess:".format(self.depth), guess)
+                    try:
+                        solver.apply_guess(guess)
+                    except Inconsistent:
+                        solver.learn()
+                    else:
+                        # And hand it over to be solved!
+                        yield solver
+                        self.debugout("Depth {}: Done with guess:".format(self.depth), guess)
+                # Release the solver straight away, so that a finished subtree isn't
+                # kept until the next guess is made
+                solver = None
 
                 # We can now assume that this guess is incorrect
                 # Apply any after-guess instructions
@@ -187,15 +281,123 @@ class PuzzleSolver(abc.ABC):
                 # We're out of guesses
                 return
 
+    def store_solution(self):
+        """
+        Stores the (solved) state in the solution list, unless it has been stored before.
+        Returns True if it was stored.
+        """
+        if self.solved is not None:
+            solhash = self.state.make_hash()
+            if solhash in self.solved:
+                return False
+            self.solved.add(solhash)
+        self.solutionlist.append(self.state.pack())
+        return True
+
+    def spawn(self, state, **kwargs):
+        """
+        Make a new solver for the given state, sharing this solver's settings, solution
+        list and hash tables. Keyword arguments override the constructor arguments.
+        """
+        args = dict(solutionlist=self.solutionlist,
+                    hashes=self.hashes,
+                    solved=self.solved,
+                    dedupe=self.dedupe,
+                    nogoods=self.nogoods,
+                    origin=self.origin,
+                    max_depth=self.max_depth,
+                    max_solutions=self.max_solutions,
+                    scheduler=self.scheduler,
+                    debug=self.debug)
+        args.update(kwargs)
+        return self.__class__(state, **args)
+
     def clone(self):
-        """Make a new PuzzleState that is a clone of this object"""
-        return self.__class__(self.state.clone(),
-                              solutionlist=self.solutionlist,
-                              hashes=self.hashes,
-                              parent=self,
-                              depth=self.depth + 1,
-                              max_depth=self.max_depth,
-                              debug=self.debug)
+        """Make a new PuzzleSolver that is a clone of this object, one level deeper"""
+        return self.spawn(self.state.clone(), parent=self, depth=self.depth + 1)
+
+    def restart(self):
+        """
+        Make a new PuzzleSolver for a copy of this state, to start a fresh search from
+        (with no states marked as explored). Solutions are still shared.
+        """
+        return self.spawn(self.state.clone(), hashes=set(), parent=None, depth=self.depth)
+
+    def finished(self):
+        """Returns True if the solution limit (max_solutions) has been reached"""
+        return self.max_solutions is not None and len(self.solutionlist) >= self.max_solutions
+
+    def learn(self):
+        """
+        Learns from this (inconsistent) state, if there is a NogoodStore. The decisions on
+        its path are shrunk to a minimal set that still can't hold together, by dropping
+        each one in turn (oldest first) and keeping it out if the rest are still refuted
+        (see refutes). The result is stored as a nogood. Nothing is learned if the whole
+        path isn't refuted, as the failure relied on guesses that the search had ruled out.
+        """
+        if self.nogoods is None or len(self.path) == 0:
+            return
+        if not self.refutes(self.path):
+            return
+        core = list(self.path)
+        for decision in self.path:
+            trial = [other for other in core if other != decision]
+            if len(trial) > 0 and self.refutes(trial):
+                core = trial
+        self.nogoods.add(core)
+
+    def is_nogood(self, guess):
+        """
+        Returns True if making the given guess would complete a stored nogood: one that
+        contains the guess's decision, and whose other decisions all hold in this state.
+        Only the nogoods containing the guess's decision are looked at, so a nogood that
+        is completed by logic rather than by a guess goes unnoticed.
+        """
+        if self.nogoods is None:
+            return False
+        return self.nogoods.check(self.decision(guess), self.holds) is not None
+
+    def decision(self, guess):
+        """
+        Returns the decision that a guess makes, as a hashable object, for nogoods.
+        By default, a guess is its own decision.
+        """
+        return guess
+
+    def holds(self, decision):
+        """
+        Returns True if the given decision (see decision) holds in the current state.
+        By default, the decisions that hold are those on the path to this state;
+        override this to also recognise decisions that logic has made.
+        """
+        return decision in self.path
+
+    def refutes(self, decisions):
+        """
+        Returns True if the given decisions can't all hold in any solution: they are
+        applied as guesses to a copy of the root state (after its first logic, which
+        only uses the initial state), and logic is done on it.
+        By default, this needs each decision to be a guess that apply_guess accepts.
+        A puzzle may override this with something cheaper, so long as it only returns
+        True when no solution has all of the decisions.
+        """
+        solver = self.spawn(self.origin.clone(), hashes=set(), nogoods=None)
+        try:
+            for decision in decisions:
+                solver.apply_guess(decision)
+            solver.logic()
+        except Inconsistent:
+            return True
+        except Solved:
+            return False
+        return False
+
+    def heuristic(self):
+        """
+        Estimate how far this state is from being solved (smaller is closer), for
+        schedulers that explore the most promising states first (see BestFirst)
+        """
+        return 0
 
     def debugout(self, *args):
         """Outputs text if debug flag is set"""
@@ -235,3 +437,241 @@ class PuzzleSolver(abc.ABC):
         Raises Inconsistent for an inconsistent state.
         Raises Solved if presolving solves the entire puzzle.
         """
+
+class Scheduler(abc.ABC):
+    """Abstract base class that chooses the order in which a search is explored"""
+
+    # Whether the same solution may be reached more than once, even if the puzzle's
+    # search never reaches a solution twice (see PuzzleSolver's dedupe)
+    repeats_solutions = False
+
+    @abc.abstractmethod
+    def search(self, root):
+        """Explore the search tree from the given root solver"""
+
+    def order(self, solver, guesslist):
+        """Returns the guesses of a solver in the order they should be tried"""
+        return guesslist
+
+class DepthFirst(Scheduler):
+    """Explores each guess completely before moving onto the next one"""
+
+    def search(self, root):
+        """Explore the search tree from the given root solver"""
+        stack = [root.expand()]
+        while stack and not root.finished():
+            try:
+                solver = next(stack[-1])
+            except StopIteration:
+                stack.pop()
+                continue
+            if solver is not None:
+                stack.append(solver.expand())
+                # Leave the solver to its generator, so that it is released once explored
+                solver = None
+
+class PriorityScheduler(Scheduler):
+    """
+    Base class for schedulers that keep every open state in a priority queue, and
+    always advance the one with the smallest priority (the most recent on ties, so
+    that equal priorities are explored depth first). Subclasses define score.
+    """
+
+    @abc.abstractmethod
+    def score(self, solver, base):
+        """
+        The priority of a solver, given the base value of the next solver it will hand
+        out (see child_base). This is called when the solver is created, each time its
+        logic has run, and each time it hands out a solver.
+        """
+
+    def child_base(self, base, index):
+        """
+        The base value for the index'th solver (counting from 0) handed out by a solver
+        with the given base. The root has a base value of 0.
+        """
+        return base
+
+    def search(self, root):
+        """Explore the search tree from the given root solver"""
+        queue = []
+        order = count()
+
+        def push(solver, generator, base, children):
+            # Entries are (priority, tie break, generator, solver, base value, number of
+            # solvers handed out so far). The priority is for the next solver handed out.
+            entry = (self.score(solver, self.child_base(base, children)),
+                     -next(order), generator, solver, base, children)
+            heapq.heappush(queue, entry)
+
+        push(root, root.expand(), 0, 0)
+        while queue and not root.finished():
+            _, _, generator, solver, base, children = heapq.heappop(queue)
+            try:
+                child = next(generator)
+            except StopIteration:
+                continue
+            if child is None:
+                # Logic has run, so take stock of this state again
+                push(solver, generator, base, children)
+                continue
+            # Keep this state for its remaining guesses, and add the new solver
+            push(solver, generator, base, children + 1)
+            push(child, child.expand(), self.child_base(base, children), 0)
+            solver = child = None
+
+class LimitedDiscrepancy(PriorityScheduler):
+    """
+    Limited discrepancy search. Every guess that isn't the first in its guess list
+    counts as a discrepancy (a departure from the order that the solver thinks is
+    best). All of the states that can be reached with no discrepancies are explored
+    first, then those with one, and so on, depth first within each. This visits states
+    in the same order as repeated limited discrepancy searches with an increasing
+    limit, but without exploring any state twice.
+    """
+
+    def score(self, solver, base):
+        """The priority is the number of discrepancies on the way to the solver"""
+        return base
+
+    def child_base(self, base, index):
+        """Every solver after the first that a solver hands out takes one more discrepancy"""
+        return base + (index > 0)
+
+class BestFirst(PriorityScheduler):
+    """
+    Explores the open state that is rated as closest to being solved first.
+    The rating is given by heuristic, a function of a solver (smaller is better),
+    which defaults to the solver's own heuristic method.
+    """
+
+    def __init__(self, heuristic=None):
+        self.heuristic = heuristic
+
+    def score(self, solver, base):
+        """The priority is the heuristic rating of the state"""
+        if self.heuristic is None:
+            return solver.heuristic()
+        return self.heuristic(solver)
+
+class RandomRestarts(Scheduler):
+    """
+    Depth first search with the guesses of every state tried in a random order.
+    Each run of the search may only hand out a budget of new solvers, and the search is
+    started again from the root, with a new order, whenever a run uses up its budget.
+    The budget grows by a factor of growth each time, so that a run eventually
+    finishes, which explores the whole tree. Solutions found in earlier runs are kept,
+    and are not stored again.
+    """
+
+    # Later runs find the solutions of earlier runs again
+    repeats_solutions = True
+
+    def __init__(self, budget=100, growth=2.0, seed=None):
+        self.budget = budget
+        self.growth = growth
+        self.rng = random.Random(seed)
+        # Number of runs made by the last search
+        self.runs = 0
+
+    def order(self, solver, guesslist):
+        """Returns the guesses of a solver in a random order"""
+        guesslist = list(guesslist)
+        self.rng.shuffle(guesslist)
+        return guesslist
+
+    def search(self, root):
+        """Explore the search tree from the given root solver"""
+        budget = self.budget
+        self.runs = 0
+        while True:
+            self.runs += 1
+            # The root is left untouched, so that each run starts from the beginning
+            start = root.restart()
+            stack = [start.expand()]
+            remaining = budget
+            while stack and not root.finished():
+                try:
+                    solver = next(stack[-1])
+                except StopIteration:
+                    stack.pop()
+                    continue
+                if solver is not None:
+                    if remaining == 0:
+                        break
+                    remaining -= 1
+                    stack.append(solver.expand())
+                    solver = None
+            if not stack or root.finished():
+                return
+            root.debugout("Restarting after {} solvers".format(budget))
+            budget = int(budget * self.growth)
+
+class NogoodStore(object):
+    """
+    Bounded store of nogoods: sets of decisions (see PuzzleSolver.decision) that can't
+    all hold in any solution. The least recently used nogoods (by when they were stored
+    or last matched) are discarded once maxsize is reached.
+
+    Each nogood is indexed by every one of its decisions, so that when a guess is made,
+    only the nogoods containing its decision are checked.
+    """
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        # Maps each decision to the set of nogoods that contain it
+        self.index = {}
+        self.added = 0
+        self.hits = 0
+        self.checks = 0
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, nogood):
+        return frozenset(nogood) in self.entries
+
+    def add(self, nogood):
+        """Stores a nogood (an iterable of decisions)"""
+        nogood = frozenset(nogood)
+        if nogood in self.entries:
+            self.entries.move_to_end(nogood)
+            return
+        self.entries[nogood] = None
+        for decision in nogood:
+            self.index.setdefault(decision, set()).add(nogood)
+        self.added += 1
+        while len(self.entries) > self.maxsize:
+            old, _ = self.entries.popitem(last=False)
+            for decision in old:
+                group = self.index[decision]
+                group.discard(old)
+                if len(group) == 0:
+                    del self.index[decision]
+            self.evicted += 1
+
+    def check(self, decision, holds):
+        """
+        Returns a stored nogood containing the given decision, whose other decisions all
+        hold (according to the function holds), or None if there isn't one
+        """
+        self.checks += 1
+        for nogood in self.index.get(decision, ()):
+            if all(other == decision or holds(other) for other in nogood):
+                self.hits += 1
+                self.entries.move_to_end(nogood)
+                return nogood
+        return None
+
+    def clear(self):
+        """Forgets all of the nogoods and resets the statistics"""
+        self.entries.clear()
+        self.index.clear()
+        self.added = self.hits = self.checks = self.evicted = 0
+
+    def stats(self):
+        """Returns a dictionary of statistics"""
+        return {"added": self.added, "hits": self.hits, "checks": self.checks,
+                "evicted": self.evicted, "size": len(self.entries), "maxsize": self.maxsize}
@@ -11,28 +11,76 @@ Jolyon Bloomfield, January 2018
 class Cell(object):
     """Represents a cell containing a 1 in the dancing links algorithm"""
 
-    def __init__(self, header, name):
-        """Initialize the cell to only point to itself. header is the column header for the cell"""
+    def __init__(self, header, name, weight=1):
+        """
+        Initialize the cell to only point to itself. header is the column header for the cell
+        weight is the amount that the cell contributes to its column (see WeightedDLX)
+        """
         self.up = self
         self.down = self
         self.left = self
         self.right = self
         self.header = header
         self.name = name
+        self.weight = weight
 
 class Column(Cell):
     """Represents a column header"""
 
-    def __init__(self, name):
-        """Initialize the sum to zero"""
+    def __init__(self, name, need=1, priority=0):
+        """
+        Initialize the sum to zero
+        need is the total weight that must be selected in this column, and columns with
+        lower priority are branched on first (see WeightedDLX)
+        """
         super(Column, self).__init__(self, name)
         self.sum = 0
+        self.total = 0
+        self.need = need
+        self.priority = priority
+
+class SearchStats(object):
+    """Statistics recorded while searching for solutions"""
+
+    def __init__(self):
+        """Initialize all counts to zero"""
+        # Number of nodes in the search tree
+        self.nodes = 0
+        # Number of rows tried that did not lead to a solution
+        self.backtracks = 0
+        # For each depth in the search tree: [number of nodes, total number of branches]
+        self.levels = []
+
+    def record(self, depth, branches):
+        """Record a search node at the given depth with the given number of branches"""
+        self.nodes += 1
+        while len(self.levels) <= depth:
+            self.levels.append([0, 0])
+        self.levels[depth][0] += 1
+        self.levels[depth][1] += branches
+
+    def branching(self):
+        """
+        Returns the average branching factor at each depth of the search tree, skipping
+        any depth without nodes
+        """
+        return [branches / nodes for nodes, branches in self.levels if nodes > 0]
+
+    def as_dict(self):
+        """Returns the statistics as a dictionary"""
+        return {"nodes": self.nodes,
+                "backtracks": self.backtracks,
+                "branching": self.branching()}
 
 class DLX(object):
     """Represents a dancing links matrix"""
 
-    def __init__(self, numcols):
-        """Initialize the dancling links matrix with a given number of columns"""
+    def __init__(self, numcols, numsecondary=0):
+        """
+        Initialize the dancling links matrix with a given number of columns
+        numsecondary extra columns may be added after these. Secondary columns must be
+        covered at most once, rather than exactly once, and are numbered from numcols.
+        """
         # Start by making a root cell
         # This isn't part of the matrix, but it gives an entry point to the matrix
         # root.right is the first column header, root.left is the last
@@ -40,8 +88,15 @@ class DLX(object):
         root = Column("root")
         self.root = root
         self.numcols = numcols
+        self.numsecondary = numsecondary
         self.numrows = 0
+        # First cell of each row, indexed by name
+        self.rows = {}
+        # Rows that have been selected ahead of solving, and the columns they cover
+        self.selected = []
+        self.selected_cols = set()
         # Now make all of the column headers
+        self.headers = []
         for col in range(numcols):
             c = Column("header-" + str(col))
             # Insert this column to the right side of the matrix
@@ -49,30 +104,24 @@ class DLX(object):
             c.left = root.left
             c.right = root
             root.left = c
+            self.headers.append(c)
+        # Secondary columns are not part of the header chain, so they are never chosen
+        # to be covered, and the matrix is solved without them being covered
+        for col in range(numcols, numcols + numsecondary):
+            self.headers.append(Column("header-" + str(col)))
 
     def add_row(self, cols, name=None):
         """
         Add a row to the matrix.
-        cols is a sorted list of the column numbers that have a 1, indexed from 0.
+        cols is a list of the column numbers that have a 1, indexed from 0.
         """
-
-        def get_header(col_current, col_shift):
-            """
-            Starting at the current column header, shift to the right col_shift times
-            """
-            header = col_current
-            for i in range(col_shift):
-                header = header.right
-            return header
-
         # Update the number of rows
         self.numrows += 1
         if name is None:
             name = self.numrows
 
         # Get the first column header
-        head = self.root.right
-        head = get_header(head, cols[0])
+        head = self.headers[cols[0]]
         # Place the first cell
         cell = Cell(head, name)
         cell.up = head.up
@@ -81,12 +130,12 @@ class DLX(object):
         head.up = cell
         head.sum += 1
         oldcell = cell
-        oldcol = cols[0]
+        self.rows[name] = cell
 
         # Loop over all of the other entries
         for col in cols[1:]:
-            # Shift to get the header
-            head = get_header(head, col - oldcol)
+            # Get the header
+            head = self.headers[col]
             # Add in the cell
             cell = Cell(head, name)
             cell.up = head.up
@@ -102,7 +151,6 @@ class DLX(object):
             head.sum += 1
             # Keep the old cell for reference
             oldcell = cell
-            oldcol = col
 
     def remove_col(self, col_header):
         """
@@ -150,6 +198,43 @@ class DLX(object):
             # Move on to the next row
             cell = cell.up
 
+    def select_row(self, name):
+        """
+        Include the named row in every solution, removing all of its columns (and any
+        rows that clash with it) from the matrix. Used to apply known information
+        (such as clues) to a matrix that contains every possibility.
+        Returns False (and does nothing) if the row clashes with a row already selected.
+        """
+        row = self.rows[name]
+        # Check that no column of this row has been covered by a selected row
+        cols = []
+        cell = row
+        while True:
+            if cell.header in self.selected_cols:
+                return False
+            cols.append(cell.header)
+            cell = cell.right
+            if cell == row:
+                break
+        # Remove each column in the row
+        for col in cols:
+            self.remove_col(col)
+        self.selected.append(row)
+        self.selected_cols.update(cols)
+        return True
+
+    def unselect_row(self):
+        """Undo the most recent select_row, restoring the matrix"""
+        row = self.selected.pop()
+        # Add the columns back in exactly the reverse order
+        cell = row.left
+        while True:
+            self.unremove_col(cell.header)
+            self.selected_cols.discard(cell.header)
+            if cell == row:
+                break
+            cell = cell.left
+
     def get_minimum_column(self):
         """
         Find the column that has the minimum number of cells in it to minimize branching
@@ -181,6 +266,8 @@ class DLX(object):
 
         # Choose the column with the minimum sum
         col = self.get_minimum_column()
+        if self.stats is not None:
+            self.stats.record(len(solution_rows) - len(self.selected), col.sum)
         # Remove the column
         self.remove_col(col)
         # print("Chosen to remove column " + str(col.name))
@@ -201,7 +288,10 @@ class DLX(object):
                 cell = cell.right
 
             # Now try to solve
+            found = len(self.solutions)
             self.solve(solution_rows)
+            if self.stats is not None and len(self.solutions) == found:
+                self.stats.backtracks += 1
 
             # Now add that row back in
             cell = row.left
@@ -213,21 +303,261 @@ class DLX(object):
             solution_rows.pop()
             # print("Removing row " + str(row.name))
 
+            # Stop if we have found as many solutions as we were asked for
+            if self.limit is not None and len(self.solutions) >= self.limit:
+                break
+
             # Move on to the next row
             row = row.down
 
         # Add the column back in
         self.unremove_col(col)
 
-    def run(self):
+    def run(self, limit=None, stats=None):
         """
         Runs the algorithm
         Returns a list of solutions: each solution is a tuple of the row numbers used
+        If limit is given, stop searching once that many solutions have been found
+        (eg, limit=2 is enough to check that a solution is unique)
+        If stats is a SearchStats object, statistics about the search are recorded in it
         """
         # Reset the list of solutions
         self.solutions = []
-        # Start the solver with an empty list of rows
+        self.limit = limit
+        self.stats = stats
+        # Start the solver with the list of selected rows
+        self.solve(list(self.selected))
+        return self.solutions
+
+
+class WeightedDLX(object):
+    """
+    Represents an exact cover matrix with multiplicities and weights.
+
+    Each primary column has a need: the total weight of the selected rows in that column
+    must be exactly equal to it. Each cell of a row has a weight (1 for a plain exact
+    cover). Secondary columns may be covered by at most one selected row.
+
+    The matrix is stored as dancing links, with rows being hidden and restored rather
+    than whole columns. When a column's need is reduced by a selected row, any rows
+    that would overshoot the remaining need are hidden. If every row remaining in a
+    column is needed, they are selected without branching. Otherwise, the search
+    chooses the primary column with the lowest priority, and the fewest rows available
+    out of those, and tries including each of its rows in turn. After a row has been
+    tried, it is excluded while the remaining rows are tried, so that each solution is
+    found exactly once.
+    """
+
+    def __init__(self, needs, numsecondary=0, priorities=None):
+        """
+        Initialize the matrix with a primary column for each entry of needs (the total
+        weight each column requires). numsecondary secondary columns are numbered after
+        the primary columns. priorities optionally gives a priority for each primary
+        column, to guide the choice of column to branch on (lowest first).
+        """
+        self.numrows = 0
+        # First cell of each row, indexed by name
+        self.rows = {}
+        if priorities is None:
+            priorities = [0] * len(needs)
+        self.headers = [Column("header-" + str(col), need, priority)
+                        for col, (need, priority) in enumerate(zip(needs, priorities))]
+        self.primary = self.headers[:]
+        for col in range(len(needs), len(needs) + numsecondary):
+            self.headers.append(Column("header-" + str(col)))
+        # Stack of changes made by selecting rows, so that they can be undone
+        self.trail = []
+
+    def add_row(self, cols, name=None, weights=None):
+        """
+        Add a row to the matrix.
+        cols is a list of the column numbers that the row appears in, indexed from 0.
+        weights is a list of the weights for each column (defaults to all 1).
+        """
+        # Update the number of rows
+        self.numrows += 1
+        if name is None:
+            name = self.numrows
+        if weights is None:
+            weights = [1] * len(cols)
+
+        first = None
+        for col, weight in zip(cols, weights):
+            head = self.headers[col]
+            # Add in the cell at the bottom of the column
+            cell = Cell(head, name, weight)
+            cell.up = head.up
+            cell.down = head
+            head.up.down = cell
+            head.up = cell
+            head.sum += 1
+            head.total += weight
+            # Add the left/right links
+            if first is None:
+                first = cell
+                self.rows[name] = cell
+            else:
+                cell.left = first.left
+                cell.right = first
+                first.left.right = cell
+                first.left = cell
+
+    def hide_row(self, row):
+        """Remove a row from all of its columns"""
+        cell = row
+        while True:
+            cell.down.up = cell.up
+            cell.up.down = cell.down
+            cell.header.sum -= 1
+            cell.header.total -= cell.weight
+            cell = cell.right
+            if cell == row:
+                break
+
+    def unhide_row(self, row):
+        """Restore a row to all of its columns (in the reverse order to hide_row)"""
+        cell = row.left
+        while True:
+            cell.down.up = cell
+            cell.up.down = cell
+            cell.header.sum += 1
+            cell.header.total += cell.weight
+            if cell == row:
+                break
+            cell = cell.left
+
+    def select(self, row):
+        """
+        Include a row in the solution, reducing the needs of its columns and hiding any
+        rows that no longer fit. Returns a marker to pass to unselect.
+        """
+        mark = len(self.trail)
+        self.hide_row(row)
+        self.trail.append(row)
+        cell = row
+        while True:
+            head = cell.header
+            head.need -= cell.weight
+            self.trail.append((head, cell.weight))
+            # Hide any rows that would overshoot this column's need
+            other = head.down
+            while other != head:
+                following = other.down
+                if other.weight > head.need:
+                    self.hide_row(other)
+                    self.trail.append(other)
+                other = following
+            cell = cell.right
+            if cell == row:
+                break
+        return mark
+
+    def unselect(self, mark):
+        """Undo all changes made since the given marker, in reverse order"""
+        while len(self.trail) > mark:
+            entry = self.trail.pop()
+            if isinstance(entry, tuple):
+                head, weight = entry
+                head.need += weight
+            else:
+                self.unhide_row(entry)
+
+    def choose_column(self):
+        """
+        Find the primary column that still needs rows with the lowest priority, and the
+        fewest rows available. A column whose rows are all needed is returned straight away.
+        Returns None if every column is satisfied, or False if some column can no longer
+        be satisfied.
+        """
+        best = None
+        for col in self.primary:
+            if col.need == 0:
+                continue
+            if col.total < col.need:
+                return False
+            if col.total == col.need:
+                return col
+            if best is None or (col.priority, col.sum) < (best.priority, best.sum):
+                best = col
+        return best
+
+    def solve(self, solution_rows, depth=0):
+        """
+        Solve the exact cover problem recursively
+        depth is the number of branches taken to get here (forced rows don't count)
+        """
+        # Select rows that are forced, as every remaining row in their column is needed
+        mark = len(self.trail)
+        forced = len(solution_rows)
+        while True:
+            col = self.choose_column()
+            if not col or col.total > col.need:
+                break
+            row = col.down
+            solution_rows.append(row)
+            self.select(row)
+
+        if col is None:
+            # Every column is satisfied: construct a tuple of the rows in this solution
+            self.solutions.append(tuple(sorted(row.name for row in solution_rows)))
+        elif col is not False:
+            if self.stats is not None:
+                self.stats.record(depth, col.sum)
+            self.branch(col, solution_rows, depth)
+
+        # Undo the forced rows
+        self.unselect(mark)
+        del solution_rows[forced:]
+
+    def branch(self, col, solution_rows, depth):
+        """
+        Try including each row in the given column, excluding it after it has been tried
+        depth is the depth of the search node that is branching
+        """
+        excluded = []
+        while col.total >= col.need and col.down != col:
+            row = col.down
+            solution_rows.append(row)
+            mark = self.select(row)
+            found = len(self.solutions)
+            self.solve(solution_rows, depth + 1)
+            if self.stats is not None and len(self.solutions) == found:
+                self.stats.backtracks += 1
+            self.unselect(mark)
+            solution_rows.pop()
+
+            # Stop if we have found as many solutions as we were asked for
+            if self.limit is not None and len(self.solutions) >= self.limit:
+                break
+
+            self.hide_row(row)
+            excluded.append(row)
+
+        # Restore the excluded rows
+        for row in reversed(excluded):
+            self.unhide_row(row)
+
+    def run(self, limit=None, stats=None):
+        """
+        Runs the algorithm
+        Returns a list of solutions: each solution is a tuple of the row names used
+        If limit is given, stop searching once that many solutions have been found
+        If stats is a SearchStats object, statistics about the search are recorded in it
+        """
+        self.solutions = []
+        self.limit = limit
+        self.stats = stats
+        # Hide any rows that overshoot a column's need from the start
+        for head in self.primary:
+            row = head.down
+            while row != head:
+                following = row.down
+                if row.weight > head.need:
+                    self.hide_row(row)
+                    self.trail.append(row)
+                row = following
         self.solve([])
+        self.unselect(0)
         return self.solutions
 
 
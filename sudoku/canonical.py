@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Canonical forms for 9x9 sudoku puzzles, and a solution cache keyed on them
+
+Two puzzles are equivalent if one can be turned into the other by some combination of
+--- Relabeling the digits
+--- Permuting the bands (groups of three rows), and the rows within each band
+--- Permuting the stacks (groups of three columns), and the columns within each stack
+--- Transposing the grid
+Equivalent puzzles have equivalent solutions, so we only need to solve one puzzle
+from each equivalence class.
+
+The canonical form of a puzzle is the smallest 81-character string (unknowns are "0")
+that can be reached through these transformations, with digits relabeled in the order
+that they first appear. It is found by building the canonical form up one row at a
+time, keeping every transformation that ties for the smallest string so far.
+
+Puzzles are given in the same 81-character format that sudokulib.py uses.
+"""
+import shelve
+from collections import OrderedDict
+from itertools import permutations
+from sudokulib import solve
+
+class Transform(object):
+    """Describes how to turn a puzzle into its canonical form"""
+
+    def __init__(self, transpose, rows, cols, labels):
+        """
+        transpose indicates if the puzzle is transposed first
+        rows and cols give the (transposed) row and column that end up in each position
+        labels maps each original digit to its canonical digit
+        """
+        self.transpose = transpose
+        self.rows = rows
+        self.cols = cols
+        # Complete the relabeling, so that digits not in the puzzle can be mapped too
+        labels = dict(labels)
+        unused = [d for d in "123456789" if d not in labels.values()]
+        for digit in "123456789":
+            if digit not in labels:
+                labels[digit] = unused.pop(0)
+        labels["0"] = "0"
+        self.labels = labels
+        self.unlabels = {v: k for k, v in labels.items()}
+
+    def apply(self, puzzle):
+        """Map a puzzle (or solution) into canonical space"""
+        if self.transpose:
+            puzzle = transpose(puzzle)
+        return "".join(self.labels[puzzle[r * 9 + c]] for r in self.rows for c in self.cols)
+
+    def invert(self, canonical):
+        """Map a puzzle (or solution) from canonical space back to the original space"""
+        result = ["0"] * 81
+        for i, r in enumerate(self.rows):
+            for j, c in enumerate(self.cols):
+                result[r * 9 + c] = self.unlabels[canonical[i * 9 + j]]
+        result = "".join(result)
+        if self.transpose:
+            result = transpose(result)
+        return result
+
+def transpose(puzzle):
+    """Transpose an 81-character puzzle"""
+    return "".join(puzzle[c * 9 + r] for r in range(9) for c in range(9))
+
+def relabel(values, labels):
+    """
+    Relabel a row of digits, assigning new labels in order of first appearance.
+    labels is updated with any new labels.
+    """
+    result = ""
+    for char in values:
+        if char != "0" and char not in labels:
+            labels[char] = str(len(labels) + 1)
+        result += labels.get(char, "0")
+    return result
+
+def first_row_orders(values):
+    """
+    Generate all column orders that put the given row into its smallest pattern:
+    stacks with the fewest digits go first, and zeros go first within each stack
+    """
+    counts = [sum(values[c] != "0" for c in range(s * 3, s * 3 + 3)) for s in range(3)]
+    stackorders = [order for order in permutations(range(3))
+                   if counts[order[0]] <= counts[order[1]] <= counts[order[2]]]
+    within = []
+    for s in range(3):
+        cols = range(s * 3, s * 3 + 3)
+        zeros = [c for c in cols if values[c] == "0"]
+        digits = [c for c in cols if values[c] != "0"]
+        within.append([z + d for z in permutations(zeros) for d in permutations(digits)])
+    for order in stackorders:
+        for a in within[order[0]]:
+            for b in within[order[1]]:
+                for c in within[order[2]]:
+                    yield a + b + c
+
+def next_rows(rows):
+    """Given the rows placed so far, return the rows that may be placed next"""
+    if len(rows) % 3 == 0:
+        # Starting a new band: any row in an unused band
+        bands = {r // 3 for r in rows}
+        return [r for r in range(9) if r // 3 not in bands]
+    # Continue with the current band
+    band = rows[-1] // 3
+    return [r for r in range(band * 3, band * 3 + 3) if r not in rows]
+
+def unique_states(states, lines):
+    """
+    Remove states that would produce identical results from here on. This happens when
+    the puzzle has columns or rows that are empty, and prevents sparse puzzles from
+    generating huge numbers of equivalent states.
+    """
+    seen = set()
+    result = []
+    for t, cols, rows, labels in states:
+        band = rows[-1] // 3 if len(rows) % 3 else None
+        remaining = tuple("".join(lines[t][r][c] for c in cols) for r in range(9) if r not in rows)
+        key = (t, frozenset(rows), band, tuple(sorted(labels.items())), remaining)
+        if key not in seen:
+            seen.add(key)
+            result.append((t, cols, rows, labels))
+    return result
+
+def canonicalize(puzzle):
+    """
+    Compute the canonical form of an 81-character puzzle.
+    Returns the canonical form and the Transform that maps the puzzle onto it.
+    """
+    grids = (puzzle, transpose(puzzle))
+    lines = [[grid[r * 9:r * 9 + 9] for r in range(9)] for grid in grids]
+
+    # Find the smallest possible first row. For a row without repeated digits, this
+    # depends only on the number of digits in each stack, so only generate the column
+    # orders for the rows that can achieve it.
+    candidates = []
+    for t in range(2):
+        for r in range(9):
+            values = lines[t][r]
+            cols = next(first_row_orders(values))
+            candidates.append((relabel([values[c] for c in cols], {}), t, r))
+    smallest = min(candidates)[0]
+
+    # Each state is (transpose, column order, rows placed, labels)
+    best = None
+    states = []
+    for text, t, r in candidates:
+        if text != smallest:
+            continue
+        values = lines[t][r]
+        for cols in first_row_orders(values):
+            labels = {}
+            text = relabel([values[c] for c in cols], labels)
+            if best is None or text < best:
+                best = text
+                states = []
+            if text == best:
+                states.append((t, cols, (r,), labels))
+    states = unique_states(states, lines)
+    result = best
+
+    # Add the remaining rows one at a time, keeping only the states that tie
+    for _ in range(8):
+        best = None
+        newstates = []
+        for t, cols, rows, labels in states:
+            for r in next_rows(rows):
+                newlabels = dict(labels)
+                values = lines[t][r]
+                text = relabel([values[c] for c in cols], newlabels)
+                if best is None or text < best:
+                    best = text
+                    newstates = []
+                if text == best:
+                    newstates.append((t, cols, rows + (r,), newlabels))
+        states = unique_states(newstates, lines)
+        result += best
+
+    t, cols, rows, labels = states[0]
+    return result, Transform(t == 1, rows, cols, labels)
+
+class SolutionCache(object):
+    """
+    Cache of sudoku solutions, keyed on the canonical form of the puzzle.
+    Keeps the most recently used results in memory, and optionally stores all
+    results on disk so that they survive between runs.
+    """
+
+    def __init__(self, solver=solve, maxsize=1024, filename=None):
+        """
+        solver is a function taking an 81-character puzzle and returning a list of solutions
+          (defaults to sudokulib.solve)
+        maxsize is the number of results to keep in memory
+        filename is the name of the on-disk cache (None for memory only)
+        """
+        self.solver = solver
+        self.maxsize = maxsize
+        self.memory = OrderedDict()
+        self.disk = shelve.open(filename) if filename is not None else None
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, canonical):
+        """Look up the solutions to a canonical puzzle, returning None if unknown"""
+        if canonical in self.memory:
+            self.memory.move_to_end(canonical)
+            return self.memory[canonical]
+        if self.disk is not None and canonical in self.disk:
+            solutions = self.disk[canonical]
+            self.remember(canonical, solutions)
+            return solutions
+        return None
+
+    def remember(self, canonical, solutions):
+        """Store the solutions to a canonical puzzle in memory"""
+        self.memory[canonical] = solutions
+        self.memory.move_to_end(canonical)
+        while len(self.memory) > self.maxsize:
+            self.memory.popitem(last=False)
+
+    def store(self, canonical, solutions):
+        """Store the solutions to a canonical puzzle in memory and on disk"""
+        self.remember(canonical, solutions)
+        if self.disk is not None:
+            self.disk[canonical] = solutions
+
+    def solve(self, puzzle):
+        """Solve a puzzle, returning a list of solutions as the solver would"""
+        canonical, transform = canonicalize(puzzle)
+        solutions = self.lookup(canonical)
+        if solutions is None:
+            self.misses += 1
+            solutions = self.solver(canonical)
+            self.store(canonical, solutions)
+        else:
+            self.hits += 1
+        return [transform.invert(soln) for soln in solutions]
+
+    def close(self):
+        """Close the on-disk cache"""
+        if self.disk is not None:
+            self.disk.close()
+            self.disk = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
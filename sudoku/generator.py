@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Sudoku puzzle generator
+
+Generates puzzles with unique solutions as follows:
+--- Fill a random grid by running dancing links on an empty puzzle, with the rows of
+    the matrix shuffled so that the first solution found is random
+--- Remove clues in a random order (a group of cells at a time when a symmetric
+    pattern is requested), putting back any removal that makes the solution non-unique
+--- Uniqueness is checked by a search that stops as soon as it finds a second solution
+
+Run as:
+python generator.py [count] [--clues N] [--symmetry SYMMETRY] [--processes N]
+
+Puzzles are printed one per line in the same 81-character format that sudoku.py reads.
+"""
+import sys
+import time
+import random
+import argparse
+from multiprocessing import Pool
+from links import DLX
+from sudokulib import get_constraints, solve
+
+# Symmetric patterns: each maps a cell (row, col) to the cells that must match it
+SYMMETRIES = {
+    "none": lambda row, col: [(row, col)],
+    "rotational": lambda row, col: [(row, col), (8 - row, 8 - col)],
+    "mirror": lambda row, col: [(row, col), (row, 8 - col)],
+    "diagonal": lambda row, col: [(row, col), (col, row)],
+    "dihedral": lambda row, col: [(row, col), (8 - row, 8 - col), (row, 8 - col), (8 - row, col),
+                                  (col, row), (8 - col, 8 - row), (col, 8 - row), (8 - col, row)],
+}
+
+def count_solutions(puzzle, limit=2):
+    """Count the number of solutions to a puzzle, stopping once limit is reached"""
+    return len(solve(puzzle, limit))
+
+def random_grid(rng):
+    """
+    Construct a random complete sudoku grid, by adding the rows of the links matrix
+    in a random order and taking the first solution
+    """
+    rows = [(row, col, num) for row in range(9) for col in range(9) for num in range(9)]
+    rng.shuffle(rows)
+    links = DLX(4*81)
+    for row, col, num in rows:
+        links.add_row(get_constraints(row, col, num), (row, col, num))
+
+    soln = ["0"] * 81
+    for row, col, num in links.run(limit=1)[0]:
+        soln[row * 9 + col] = str(num + 1)
+    return "".join(soln)
+
+def remove_clues(grid, rng, clues=None, symmetry="none"):
+    """
+    Remove clues from a complete grid, keeping the solution unique.
+    Never goes below the target number of clues (if given): a group of cells that would
+    take the puzzle below it is skipped. Stops once the target is reached, or when no
+    further clues can be removed.
+    """
+    pattern = SYMMETRIES[symmetry]
+    # Construct the groups of cells that are removed together
+    groups = []
+    seen = set()
+    for cell in range(81):
+        if cell in seen:
+            continue
+        group = sorted({r * 9 + c for r, c in pattern(*divmod(cell, 9))})
+        seen.update(group)
+        groups.append(group)
+    rng.shuffle(groups)
+
+    puzzle = list(grid)
+    count = 81
+    for group in groups:
+        if clues is not None and count <= clues:
+            break
+        if clues is not None and count - len(group) < clues:
+            continue
+        for cell in group:
+            puzzle[cell] = "0"
+        if count_solutions("".join(puzzle)) == 1:
+            count -= len(group)
+        else:
+            # Removing this group loses uniqueness; put it back
+            for cell in group:
+                puzzle[cell] = grid[cell]
+    return "".join(puzzle)
+
+def generate(seed=None, clues=None, symmetry="none", attempts=100):
+    """
+    Generate a puzzle with a unique solution.
+    clues is the target number of clues (None removes as many as possible)
+    symmetry is one of the patterns in SYMMETRIES
+    Returns the puzzle, or None if the target could not be met in the given number of attempts
+    """
+    rng = random.Random(seed)
+    for _ in range(attempts):
+        puzzle = remove_clues(random_grid(rng), rng, clues, symmetry)
+        if clues is None or puzzle.count("0") == 81 - clues:
+            return puzzle
+    return None
+
+def _generate(args):
+    """Helper for generate_many: unpacks arguments for use with a process pool"""
+    return generate(*args)
+
+def generate_many(count, clues=None, symmetry="none", processes=None, seed=None, attempts=100):
+    """
+    Generate count puzzles in parallel over a pool of processes (defaults to all cores).
+    Yields puzzles as they are produced. Jobs that don't meet the target (after the given
+    number of attempts each, see generate) are retried with new seeds until count puzzles
+    have been produced. If every job in a round fails, the target is taken to be out of
+    reach, and fewer than count puzzles are yielded.
+    """
+    rng = random.Random(seed)
+    remaining = count
+    with Pool(processes) as pool:
+        while remaining > 0:
+            jobs = [(rng.getrandbits(64), clues, symmetry, attempts) for _ in range(remaining)]
+            found = 0
+            for puzzle in pool.imap_unordered(_generate, jobs):
+                if puzzle is not None:
+                    found += 1
+                    yield puzzle
+            if found == 0:
+                return
+            remaining -= found
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate sudoku puzzles with unique solutions")
+    parser.add_argument("count", type=int, nargs="?", default=1, help="number of puzzles to generate")
+    parser.add_argument("--clues", type=int, default=None, help="target number of clues")
+    parser.add_argument("--symmetry", choices=sorted(SYMMETRIES), default="none",
+                        help="symmetric pattern of clues")
+    parser.add_argument("--processes", type=int, default=None,
+                        help="number of processes to use (defaults to all cores)")
+    parser.add_argument("--seed", type=int, default=None, help="random seed")
+    args = parser.parse_args()
+
+    start = time.time()
+    generated = 0
+    for puzzle in generate_many(args.count, args.clues, args.symmetry, args.processes, args.seed):
+        print(puzzle)
+        generated += 1
+    elapsed = time.time() - start
+
+    rate = generated / elapsed if elapsed > 0 else 0
+    print("Generated {} of {} puzzles in {:.2f}s ({:.2f} puzzles/s)".format(
+        generated, args.count, elapsed, rate), file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
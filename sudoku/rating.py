@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Sudoku difficulty rating based on search effort
+
+A puzzle is rated by solving it once with dancing links while recording statistics
+about the search (see links.SearchStats): the number of nodes visited, the number of
+backtracks, and the branching factor at each level of the search tree.
+
+A puzzle that can be solved without guessing has a branching factor of 1 at every
+level, and visits one node per unknown cell. Harder puzzles require the search to
+branch, and visit more nodes. The difficulty score is
+log2 of the ratio of nodes visited to this minimum, so that 0 means no guessing was
+required, and each additional point means the search did twice as much work. Scores
+are never negative. Puzzles without a solution (such as those with clashing clues)
+have no score, and are reported as unsolvable rather than rated.
+
+The search is stopped after two solutions, as this is enough to prove uniqueness.
+Puzzles are rated in their canonical form (see canonical.py), so that equivalent
+puzzles always receive the same rating.
+
+Run as:
+python rating.py puzzlefile [--sort] [--processes N]
+where puzzlefile contains one 81 character puzzle per line.
+"""
+import sys
+import math
+import argparse
+from multiprocessing import Pool
+from links import SearchStats
+from sudokulib import SudokuSolver, parse_input
+from canonical import canonicalize
+
+# Solver used for rating, created on first use (in each process)
+rating_solver = None
+
+def difficulty(stats, unknowns):
+    """
+    Turn search statistics into a difficulty score, given the number of unknown cells.
+    The score is at least 0 (no guessing required).
+    """
+    if stats.nodes == 0:
+        # Nothing to search for
+        return 0.0
+    return round(max(math.log2(stats.nodes / max(unknowns, 1)), 0.0), 3)
+
+def rate(puzzle, canonical=True):
+    """
+    Rate the difficulty of a puzzle.
+    Returns (score, number of solutions found (at most 2), stats), where score is None
+    if the puzzle has no solution
+    """
+    global rating_solver
+    if rating_solver is None:
+        rating_solver = SudokuSolver()
+    if canonical:
+        puzzle = canonicalize(puzzle)[0]
+    stats = SearchStats()
+    solutions = rating_solver.solve(puzzle, limit=2, stats=stats)
+    if len(solutions) == 0:
+        return None, 0, stats
+    return difficulty(stats, puzzle.count("0")), len(solutions), stats
+
+def _rate(puzzle):
+    """Helper for rate_batch: rates a puzzle in a worker process"""
+    score, solutions, stats = rate(puzzle)
+    return puzzle, score, solutions, stats.as_dict()
+
+def rate_batch(puzzles, processes=None):
+    """
+    Rate many puzzles in parallel over a pool of processes (defaults to all cores).
+    Yields (puzzle, score, number of solutions, stats dictionary) in the original order.
+    """
+    with Pool(processes) as pool:
+        yield from pool.imap(_rate, puzzles, chunksize=16)
+
+def main():
+    parser = argparse.ArgumentParser(description="Rate the difficulty of sudoku puzzles")
+    parser.add_argument("puzzlefile", help="file containing one puzzle per line")
+    parser.add_argument("--sort", action="store_true", help="sort puzzles from easiest to hardest")
+    parser.add_argument("--processes", type=int, default=None,
+                        help="number of processes to use (defaults to all cores)")
+    args = parser.parse_args()
+
+    try:
+        with open(args.puzzlefile) as f:
+            puzzles = [parse_input(line) for line in f
+                       if len(line.strip()) > 0 and not line.strip().startswith("#")]
+    except (ValueError, IOError) as e:
+        print("Unable to read puzzles:", e)
+        sys.exit(1)
+
+    results = rate_batch(puzzles, args.processes)
+    if args.sort:
+        # Unsolvable puzzles go last
+        results = sorted(results, key=lambda result: (result[1] is None, result[1] or 0))
+    for puzzle, score, solutions, stats in results:
+        rating = "unsolvable" if score is None else "{:7.3f}".format(score)
+        print("{} {:>10} nodes={} backtracks={} solutions={}".format(
+            puzzle, rating, stats["nodes"], stats["backtracks"], solutions if solutions < 2 else "2+"))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Sudoku brute force solver library via dancing links exact cover algorithm
+
+A sudoku has four constraints, represented by the columns of the matrix
+--- Each cell has one number (81 columns, 9 rows and 9 columns)
+--- Each row has each number once (81 columns, 9 rows and 9 numbers)
+--- Each column has each number once (81 columns, 9 columns and 9 numbers)
+--- Each box has each number once (81 columns, 9 boxes and 9 numbers)
+We thus need 4*81 = 324 columns
+
+Each row consists of four 1's: one for each constraint it satisfies
+Eg, the number 1 in a given row and column contributes to a number in that cell,
+a number in that row, a number in that column, and a number in that box
+
+Variants (X-sudoku, windoku, jigsaw and so on) are handled by a Layout, which can
+replace the boxes with other regions, and add extra regions to the matrix. Regions of
+9 cells must contain each number exactly once, and so add primary columns. Smaller
+regions may contain each number at most once, and add secondary columns.
+
+Puzzles are represented as 81 character strings, with 0 indicating an unknown.
+This library has no side effects on import; the command line interface is in sudoku.py.
+
+Jolyon Bloomfield, January 2018
+"""
+from links import DLX
+
+# Arto Inkala puzzle!
+defaultpuzzle = "800000000003600000070090200050007000000045700000100030001000068008500010090000400"
+
+# Regions are lists of cells, numbered as row * 9 + col
+ROWS = [[row * 9 + col for col in range(9)] for row in range(9)]
+COLUMNS = [[row * 9 + col for row in range(9)] for col in range(9)]
+BOXES = [[(row + 3 * (box // 3)) * 9 + col + 3 * (box % 3) for row in range(3) for col in range(3)]
+         for box in range(9)]
+DIAGONALS = [[i * 10 for i in range(9)], [i * 8 + 8 for i in range(9)]]
+WINDOWS = [[(row + top) * 9 + col + left for row in range(3) for col in range(3)]
+           for top in (1, 5) for left in (1, 5)]
+
+class Layout(object):
+    """
+    Describes the columns of the links matrix for a sudoku variant:
+    --- One column for each cell (81 columns)
+    --- For each row, column and box (or jigsaw region), one column for each number
+    --- For each extra region, one column for each number
+    Extra regions of 9 cells give primary columns (exactly once), while smaller
+    extra regions give secondary columns (at most once).
+    """
+
+    def __init__(self, regions=BOXES, extra=()):
+        """
+        regions are the nine regions that replace the boxes (eg, for jigsaw sudoku)
+        extra is a list of extra regions (eg, DIAGONALS for X-sudoku)
+        Raises ValueError if regions don't split the grid into nine regions of nine cells,
+        or if an extra region has more than nine cells, repeats a cell or leaves the grid.
+        """
+        check_regions(regions)
+        check_extra(extra)
+        primary = ROWS + COLUMNS + list(regions) + [r for r in extra if len(r) == 9]
+        secondary = [r for r in extra if len(r) < 9]
+        self.numcols = 81 + 9 * len(primary)
+        self.numsecondary = 9 * len(secondary)
+        # Find the regions that each cell belongs to
+        self.cell_regions = [[] for _ in range(81)]
+        for idx, region in enumerate(primary + secondary):
+            for cell in region:
+                self.cell_regions[cell].append(idx)
+
+    def constraints(self, row, col, num):
+        """
+        Compute the constraint columns given the information for the cell
+        num runs from 0 to 8
+        """
+        cell = row * 9 + col
+        return [cell] + [81 + idx * 9 + num for idx in self.cell_regions[cell]]
+
+    def make_links(self):
+        """Make an empty links matrix for this layout"""
+        return DLX(self.numcols, self.numsecondary)
+
+def check_regions(regions):
+    """
+    Checks that regions split the grid into nine regions of nine distinct cells, with
+    every cell in exactly one region. Raises ValueError if not.
+    """
+    regions = [list(region) for region in regions]
+    if len(regions) != 9:
+        raise ValueError("Expected 9 regions, found {}".format(len(regions)))
+    for region in regions:
+        if len(region) != 9 or len(set(region)) != 9:
+            raise ValueError("Each region must have 9 distinct cells: {}".format(region))
+    cells = sorted(cell for region in regions for cell in region)
+    if cells != list(range(81)):
+        raise ValueError("Regions must cover each of the 81 cells exactly once")
+
+def check_extra(extra):
+    """
+    Checks that each extra region has at most nine distinct cells, all on the grid.
+    Raises ValueError if not.
+    """
+    for region in extra:
+        region = list(region)
+        if len(region) > 9 or len(set(region)) != len(region):
+            raise ValueError("Each extra region must have at most 9 distinct cells: {}".format(region))
+        if any(cell not in range(81) for cell in region):
+            raise ValueError("Extra region has cells off the grid: {}".format(region))
+
+def jigsaw(regions):
+    """
+    Make a Layout for a jigsaw sudoku, given an 81 character string that labels
+    the region that each cell belongs to.
+    Raises ValueError if the labels don't describe nine regions of nine cells.
+    """
+    if len(regions) != 81:
+        raise ValueError("Jigsaw layout must have 81 characters, found {}".format(len(regions)))
+    labels = sorted(set(regions))
+    return Layout(regions=[[cell for cell in range(81) if regions[cell] == label] for label in labels])
+
+CLASSIC = Layout()
+X_SUDOKU = Layout(extra=DIAGONALS)
+WINDOKU = Layout(extra=WINDOWS)
+VARIANTS = {"classic": CLASSIC, "x": X_SUDOKU, "windoku": WINDOKU}
+
+def get_constraints(row, col, num):
+    """
+    Compute the four constraint columns given the information for the cell
+    num runs from 0 to 8
+    """
+    return CLASSIC.constraints(row, col, num)
+
+def row_name(row, col, num):
+    """Name of the row in the links matrix for placing num (1 to 9) in the given cell"""
+    return str(row) + str(col) + ": " + str(num)
+
+def add_cell(row, col, num, links, layout=CLASSIC):
+    """
+    Add rows to links for a given row and column in the puzzle
+    If num = 0, add all 9 rows for all possibilities in this cell
+    If num is a number, add just the single row
+
+    rows and columns are numbered from 0 to 8
+    boxes are numbered from 0 to 8, with 123 across the top
+    """
+    if num == 0:
+        for i in range(9):
+            links.add_row(layout.constraints(row, col, i), row_name(row, col, i + 1))
+    else:
+        links.add_row(layout.constraints(row, col, num-1), row_name(row, col, num))
+
+def convert_results(results):
+    """Convert the results from the links matrix back into a list of 81 character strings"""
+    solns = []
+    for result in results:
+        soln = ["0"] * 81
+        for cell in result:
+            row = int(cell[0])
+            col = int(cell[1])
+            soln[row * 9 + col] = cell[4]
+        solns.append("".join(soln))
+    return solns
+
+class SudokuSolver(object):
+    """
+    Solves sudoku puzzles using a links matrix containing every possibility for
+    every cell. The matrix is built once; each puzzle selects the rows for its
+    clues, and the matrix is restored after solving, ready for the next puzzle.
+    Not safe to share between threads.
+    """
+
+    def __init__(self, layout=CLASSIC):
+        """Build the template links matrix for the given layout"""
+        self.links = layout.make_links()
+        for row in range(9):
+            for col in range(9):
+                add_cell(row, col, 0, self.links, layout)
+
+    def solve(self, problem, limit=None, stats=None):
+        """
+        Solve the given sudoku problem, provided as a list of 81 numbers
+        with 0 indicating an unknown. Stops after limit solutions if given.
+        Search statistics are recorded in stats if given (see links.SearchStats).
+        """
+        selected = 0
+        try:
+            for idx, char in enumerate(problem):
+                # Cells may be given as characters or ints
+                char = str(char)
+                if char == "0":
+                    continue
+                row, col = divmod(idx, 9)
+                if not self.links.select_row(row_name(row, col, char)):
+                    # Clues clash with each other
+                    return []
+                selected += 1
+            results = self.links.run(limit, stats)
+        finally:
+            # Restore the template
+            for _ in range(selected):
+                self.links.unselect_row()
+        return convert_results(results)
+
+# Shared solvers used by solve, created on first use for each layout
+default_solvers = {}
+
+def solve(problem, limit=None, layout=CLASSIC):
+    """
+    Solve the given sudoku problem, provided as a list of 81 numbers
+    with 0 indicating an unknown. Stops after limit solutions if given.
+    """
+    if layout not in default_solvers:
+        default_solvers[layout] = SudokuSolver(layout)
+    return default_solvers[layout].solve(problem, limit)
+
+def combine_solutions(results):
+    """
+    Combine a list of solutions into a full grid, indexed as grid[x][y], where each
+    entry is a string of all the numbers that appear in that cell
+    """
+    fullgrid = [[results[0][x + y * 9] for y in range(9)] for x in range(9)]
+    for soln in results[1:]:
+        for x in range(9):
+            for y in range(9):
+                if soln[x + y * 9] not in fullgrid[x][y]:
+                    fullgrid[x][y] += soln[x + y * 9]
+    return fullgrid
+
+def pretty_print(problem):
+    """Draws a pretty sudoku grid for the given problem"""
+    # Construct the blank grid
+    top     = "\u2554===\u2564===\u2564===\u2557".replace("=", "\u2550")
+    bottom  = "\u255a===\u2567===\u2567===\u255d".replace("=", "\u2550")
+    line =    "\u255f---\u253c---\u253c---\u2562".replace("-", "\u2500")
+    data =    "\u2551   \u2502   \u2502   \u2551"
+    output = [data] * 9
+
+    def place_number(x, y, i):
+        outputx = x + 1
+        if x > 2:
+            outputx += 1
+        if x > 5:
+            outputx += 1
+        current = output[y]
+        output[y] = current[:outputx] + i + current[outputx+1:]
+
+    # Place the numbers into the grid
+    x = 0
+    y = 0
+    for char in problem:
+        if char != "0":
+            place_number(x, y, char)
+        x += 1
+        if x > 8:
+            x = 0
+            y += 1
+
+    # Now combine it all
+    fulloutput = []
+    fulloutput.append(top)
+    for i in range(0, 9):
+        fulloutput.append(output[i])
+        if (i + 1) % 9 == 0:
+            fulloutput.append(bottom)
+        elif (i + 1) % 3 == 0:
+            fulloutput.append(line)
+
+    print("\n".join(fulloutput))
+
+def full_print(grid):
+    """Prints a full sudoku grid"""
+    # Construct the blank grid
+    line =    "\u255f---\u253c---\u253c---\u256b---\u253c---\u253c---\u256b---\u253c---\u253c---\u2562".replace("-", "\u2500")
+    top     = "\u2554===\u2564===\u2564===\u2566===\u2564===\u2564===\u2566===\u2564===\u2564===\u2557".replace("=", "\u2550")
+    between = "\u2560===\u256a===\u256a===\u256c===\u256a===\u256a===\u256c===\u256a===\u256a===\u2563".replace("=", "\u2550")
+    bottom  = "\u255a===\u2567===\u2567===\u2569===\u2567===\u2567===\u2569===\u2567===\u2567===\u255d".replace("=", "\u2550")
+
+    output = [" " * 27] * 27
+
+    def place_num(x, y, i):
+        outputx = x * 3 + ((int(i) - 1) % 3)
+        outputy = y * 3 + ((int(i) - 1) // 3)
+        current = output[outputy]
+        output[outputy] = current[:outputx] + i + current[outputx + 1:]
+    def place_middle(x, y, i):
+        outputx = x * 3
+        outputy = y * 3 + 1
+        current = output[outputy]
+        output[outputy] = current[:outputx] + " " + i + " " + current[outputx + 3:]
+
+    # Now put the numbers into it
+    for x in range(9):
+        for y in range(9):
+            # Check if this cell is solved
+            if len(grid[x][y]) == 1:
+                place_middle(x, y, grid[x][y])
+            else:
+                for i in grid[x][y]:
+                    place_num(x, y, i)
+
+    # Add spaces and pipes into the lines
+    for i, txt in enumerate(output):
+        lists = [txt[i:i+3] for i in range(0, len(txt), 3)]
+        output[i] = "\u2551" + "\u2502".join(lists[0:3]) + "\u2551" + \
+                    "\u2502".join(lists[3:6]) + "\u2551" + \
+                    "\u2502".join(lists[6:9]) + "\u2551"
+
+    # Now combine it all
+    fulloutput = []
+    fulloutput.append(top)
+    for i in range(0, 27):
+        fulloutput.append(output[i])
+        if i == 26:
+            break
+        if (i + 1) % 9 == 0:
+            fulloutput.append(between)
+        elif (i + 1) % 3 == 0:
+            fulloutput.append(line)
+    fulloutput.append(bottom)
+
+    print("\n".join(fulloutput))
+
+def parse_input(text):
+    """Converts input text into 81-character format"""
+    # Start by turning multiple lines into a single line
+    working = ""
+    if isinstance(text, list):
+        for line in text:
+            line = line.strip()
+            if len(line) > 0 and not line.startswith("#"):
+                working += line
+    else:
+        working = text.strip()
+    # Convert to numerical data
+    result = ""
+    for char in working:
+        if char in "123456789":
+            result += char
+        elif char == " " or char == "\n" :
+            # Ignore spaces and newlines
+            pass
+        else:
+            result += "0"
+    # Check for applicability
+    if len(result) != 81:
+        raise ValueError("Unable to interpret input data")
+    return result
+
+def load_file(filename):
+    """
+    Loads data from a file, or if filename is 81 characters long,
+    interprets that as the puzzle
+    """
+    if len(filename) == 81:
+        result = parse_input(filename)
+    else:
+        try:
+            with open(filename) as f:
+                data = f.readlines()
+        except:
+            raise IOError("Unable to load data from file")
+        result = parse_input(data)
+
+    return result
+
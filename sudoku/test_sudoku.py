@@ -0,0 +1,127 @@
+"""
+Unit tests running on the sudoku library
+"""
+
+from sudokulib import solve, SudokuSolver, Layout, X_SUDOKU, WINDOKU, DIAGONALS, WINDOWS, BOXES, jigsaw
+from canonical import canonicalize, transpose, SolutionCache
+from generator import generate, generate_many, count_solutions
+from rating import rate, difficulty
+
+# Arto Inkala puzzle and its solution
+puzzle = "800000000003600000070090200050007000000045700000100030001000068008500010090000400"
+solution = "812753649943682175675491283154237896369845721287169534521974368438526917796318452"
+
+def transform(puzzle):
+    """Relabel digits, swap the first two bands and the first two columns, and transpose"""
+    labels = dict(zip("0123456789", "0987654321"))
+    rows = [3, 4, 5, 0, 1, 2, 6, 7, 8]
+    cols = [1, 0, 2, 3, 4, 5, 6, 7, 8]
+    result = "".join(labels[puzzle[r * 9 + c]] for r in rows for c in cols)
+    return transpose(result)
+
+def test_canonical():
+    canonical, trans = canonicalize(puzzle)
+    assert trans.apply(puzzle) == canonical
+    assert trans.invert(canonical) == puzzle
+    assert canonicalize(transform(puzzle))[0] == canonical
+
+def test_cache():
+    calls = []
+    def solver(problem):
+        # A solved grid is its own solution
+        calls.append(problem)
+        return [problem]
+
+    cache = SolutionCache(solver, maxsize=1)
+    assert cache.solve(solution) == [solution]
+    other = transform(solution)
+    assert cache.solve(other) == [other]
+    assert len(calls) == 1
+    assert cache.hits == 1 and cache.misses == 1
+
+def test_generate():
+    assert count_solutions(puzzle) == 1
+    assert count_solutions("0" * 81, limit=2) == 2
+
+    generated = generate(seed=1, clues=30, symmetry="rotational")
+    assert generated.count("0") == 51
+    assert count_solutions(generated) == 1
+    for cell in range(81):
+        assert (generated[cell] == "0") == (generated[80 - cell] == "0")
+    # Groups of eight cells would overshoot the target, so they are skipped
+    assert generate(seed=2, clues=77, symmetry="dihedral").count("0") == 4
+
+    # Failed jobs are retried, unless the target is out of reach
+    puzzles = list(generate_many(3, clues=30, processes=2, seed=1, attempts=1))
+    assert len(puzzles) == 3 and all(puzzle.count("0") == 51 for puzzle in puzzles)
+    assert list(generate_many(2, clues=10, processes=2, seed=1, attempts=1)) == []
+
+def test_solve():
+    assert solve(puzzle) == [solution]
+    # The template is reused between puzzles, including after clashing clues
+    solver = SudokuSolver()
+    assert solver.solve("11" + "0" * 79) == []
+    assert solver.solve(puzzle) == [solution]
+    assert len(solver.solve("0" * 81, limit=3)) == 3
+    # Puzzles may also be given as lists of ints
+    assert solver.solve([int(char) for char in puzzle]) == [solution]
+
+def test_rate():
+    easy = "003020600900305001001806400008102900700000008006708200002609500800203009005010300"
+    score, solutions, stats = rate(easy)
+    assert score == 0 and solutions == 1 and stats.backtracks == 0
+
+    score, solutions, stats = rate(puzzle)
+    assert score > 5 and solutions == 1
+    assert rate(transform(puzzle))[0] == score
+
+    # Clashing clues can't be solved, so aren't rated
+    score, solutions, stats = rate("11" + "0" * 79)
+    assert score is None and solutions == 0
+    # Fewer nodes than unknown cells doesn't make a negative score
+    stats.nodes = 10
+    assert difficulty(stats, 50) == 0.0
+
+def test_variants():
+    for layout, regions in [(X_SUDOKU, DIAGONALS), (WINDOKU, WINDOWS)]:
+        grid = solve("0" * 81, limit=1, layout=layout)[0]
+        for region in regions:
+            assert len({grid[cell] for cell in region}) == 9
+        # Blanking the first three rows leaves more classic solutions than variant solutions
+        problem = "0" * 27 + grid[27:]
+        assert grid in solve(problem, layout=layout)
+        assert len(solve(problem, layout=layout)) < len(solve(problem))
+
+    # Short regions give secondary columns: each number at most once
+    layout = Layout(extra=[[0, 40, 80]])
+    assert layout.numsecondary == 9
+    for grid in solve("0" * 81, limit=5, layout=layout):
+        assert len({grid[0], grid[40], grid[80]}) == 3
+
+def test_jigsaw_checks():
+    # Labelling the boxes gives the classic layout
+    labels = "".join(str(box) for cell in range(81) for box in range(9) if cell in BOXES[box])
+    assert solve(puzzle, layout=jigsaw(labels)) == solve(puzzle)
+    bad = [labels[:80],                     # too short
+           labels[:3] + "0" + labels[4:],   # region 0 has ten cells, region 1 has eight
+           labels.replace("8", "7"),        # only eight regions
+           ]
+    for layout in bad:
+        try:
+            jigsaw(layout)
+            assert False
+        except ValueError:
+            pass
+    for regions in ([BOXES[0]] * 9, BOXES[:8] + [BOXES[8][:8] + [0]]):
+        try:
+            Layout(regions=regions)
+            assert False
+        except ValueError:
+            pass
+    # Extra regions have at most nine distinct cells on the grid
+    for extra in (list(range(10)), [0, 0, 1], [0, 81]):
+        try:
+            Layout(extra=[extra])
+            assert False
+        except ValueError:
+            pass